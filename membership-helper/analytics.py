@@ -0,0 +1,237 @@
+'''
+analytics.py
+Click and subscriber reporting on pandas DataFrames
+- click_activity and subscribers are loaded once per refresh into typed,
+  categorical-encoded frames shared by every session in the process
+- headline popularity, clicks per newsletter per day, engagement distribution
+  and list overlap are vectorized group-bys over those frames
+- the dashboards read from here instead of querying Supabase per widget
+
+'''
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+from db import iter_click_activity, iter_subscribers
+
+ANALYTICS_TTL = 600          # Seconds before the frames are reloaded
+ANALYTICS_DAYS = 365         # Days of click activity loaded
+ENGAGEMENT_BINS = [0, 1, 2, 5, 10, 25, 50, 100]
+ENGAGEMENT_LABELS = ["0", "1", "2-4", "5-9", "10-24", "25-49", "50-99", "100+"]
+
+CLICK_COLUMNS = "id, subscriber_hash, clicked_headline, newsletter, click_date"
+SUBSCRIBER_COLUMNS = "subscriber_hash, list_id, status, total_clicks, created_at"
+
+
+def load_clicks(start_date=None, end_date=None):
+    """
+    Load click activity into a typed DataFrame.
+
+    Args:
+        start_date (str, optional): First click date (YYYY-MM-DD).
+        end_date (str, optional): Last click date (YYYY-MM-DD).
+
+    Returns:
+        DataFrame: id (int64); subscriber_hash, clicked_headline and
+        newsletter (category); click_date (UTC datetime).
+    """
+    frame = pd.DataFrame.from_records(
+        iter_click_activity(start_date=start_date, end_date=end_date, columns=CLICK_COLUMNS),
+        columns=[c.strip() for c in CLICK_COLUMNS.split(",")],
+    )
+    return frame.astype({
+        "id": "int64",
+        "subscriber_hash": "category",
+        "clicked_headline": "category",
+        "newsletter": "category",
+    }).assign(click_date=pd.to_datetime(frame["click_date"], utc=True, format="ISO8601"))
+
+
+def load_subscribers():
+    """
+    Load subscribers and their list memberships into typed DataFrames.
+
+    Returns:
+        tuple: (subscribers, memberships). subscribers has subscriber_hash,
+        status (category), total_clicks (int32) and created_at (UTC
+        datetime); memberships has one subscriber_hash/list_id row per list
+        a subscriber is on, both categorical.
+    """
+    frame = pd.DataFrame.from_records(
+        iter_subscribers(SUBSCRIBER_COLUMNS),
+        columns=[c.strip() for c in SUBSCRIBER_COLUMNS.split(",")],
+    )
+    memberships = (
+        frame[["subscriber_hash", "list_id"]]
+        .explode("list_id")
+        .dropna(subset=["list_id"])
+        .astype({"subscriber_hash": "category", "list_id": "category"})
+        .reset_index(drop=True)
+    )
+    subscribers = frame.drop(columns="list_id").assign(
+        status=frame["status"].astype("category"),
+        total_clicks=pd.to_numeric(frame["total_clicks"]).fillna(0).astype("int32"),
+        created_at=pd.to_datetime(frame["created_at"], utc=True, format="ISO8601"),
+    )
+    return subscribers, memberships
+
+
+def _date_range(clicks, start_date=None, end_date=None, newsletter=None):
+    mask = pd.Series(True, index=clicks.index)
+    if start_date:
+        mask &= clicks["click_date"] >= pd.Timestamp(start_date, tz="UTC")
+    if end_date:
+        # end_date is inclusive of the whole day
+        mask &= clicks["click_date"] < pd.Timestamp(end_date, tz="UTC") + pd.Timedelta(days=1)
+    if newsletter:
+        mask &= clicks["newsletter"] == newsletter
+    return clicks[mask]
+
+
+class ClickAnalytics:
+    """
+    One load of click activity and subscribers, with the reports computed from it.
+    """
+
+    def __init__(self, clicks, subscribers, memberships):
+        self.clicks = clicks
+        self.subscribers = subscribers
+        self.memberships = memberships
+        self.loaded_at = datetime.now(timezone.utc)
+
+    @classmethod
+    def load(cls, days=ANALYTICS_DAYS):
+        """
+        Load the last `days` of click activity and every subscriber.
+        """
+        start_date = (datetime.now(timezone.utc) - timedelta(days=days)).date().isoformat()
+        started = time.perf_counter()
+        analytics = cls(load_clicks(start_date=start_date), *load_subscribers())
+        print(
+            f"Loaded {len(analytics.clicks)} clicks and {len(analytics.subscribers)} subscribers "
+            f"for analytics in {time.perf_counter() - started:.1f}s"
+        )
+        return analytics
+
+    def filter_clicks(self, start_date=None, end_date=None, newsletter=None, limit=None):
+        """
+        Click rows for a date range and newsletter, newest first.
+
+        Args:
+            start_date (str, optional): First click date (YYYY-MM-DD).
+            end_date (str, optional): Last click date (YYYY-MM-DD), inclusive.
+            newsletter (str, optional): Newsletter list ID.
+            limit (int, optional): Maximum number of rows.
+
+        Returns:
+            DataFrame: Matching click_activity rows.
+        """
+        clicks = _date_range(self.clicks, start_date, end_date, newsletter).sort_values(
+            ["click_date", "id"], ascending=False
+        )
+        return clicks.head(limit) if limit else clicks
+
+    def headline_popularity(self, start_date=None, end_date=None, newsletter=None, limit=10):
+        """
+        The most clicked headlines.
+
+        Returns:
+            DataFrame: clicked_headline, clicks and distinct subscribers, most
+            clicked first.
+        """
+        clicks = _date_range(self.clicks, start_date, end_date, newsletter)
+        popularity = (
+            clicks.groupby("clicked_headline", observed=True)
+            .agg(clicks=("id", "size"), subscribers=("subscriber_hash", "nunique"))
+            .sort_values(["clicks", "subscribers"], ascending=False)
+            .reset_index()
+        )
+        return popularity.head(limit) if limit else popularity
+
+    def clicks_per_day(self, start_date=None, end_date=None):
+        """
+        Clicks per newsletter per day.
+
+        Returns:
+            DataFrame: One row per day, one column per newsletter list ID, zero filled.
+        """
+        clicks = _date_range(self.clicks, start_date, end_date)
+        return (
+            clicks.groupby([clicks["click_date"].dt.floor("D").rename("day"), "newsletter"], observed=True)
+            .size()
+            .unstack("newsletter", fill_value=0)
+        )
+
+    def engagement(self, list_id=None):
+        """
+        How many clicks each subscriber made in the loaded window.
+
+        Args:
+            list_id (str, optional): Only subscribers on this list, counting
+                clicks from its newsletter.
+
+        Returns:
+            Series: Clicks per subscriber hash, including subscribers with none.
+        """
+        clicks = self.clicks
+        subscribers = self.subscribers["subscriber_hash"]
+        if list_id:
+            clicks = clicks[clicks["newsletter"] == list_id]
+            subscribers = self.memberships.loc[self.memberships["list_id"] == list_id, "subscriber_hash"]
+
+        counts = clicks["subscriber_hash"].value_counts()
+        counts.index = counts.index.astype(str)
+        return counts.reindex(pd.Index(subscribers.astype(str).unique()).union(counts.index), fill_value=0)
+
+    def engagement_distribution(self, list_id=None):
+        """
+        Subscribers bucketed by their number of clicks.
+
+        Args:
+            list_id (str, optional): See engagement().
+
+        Returns:
+            DataFrame: clicks bucket and subscriber count, plus a share column.
+        """
+        counts = self.engagement(list_id)
+        buckets = pd.cut(counts, bins=ENGAGEMENT_BINS + [float("inf")], labels=ENGAGEMENT_LABELS, right=False)
+        distribution = buckets.value_counts(sort=False).rename_axis("clicks").reset_index(name="subscribers")
+        total = distribution["subscribers"].sum()
+        distribution["share"] = distribution["subscribers"] / total if total else 0.0
+        return distribution
+
+    def list_overlap(self):
+        """
+        Subscribers shared between every pair of lists.
+
+        Returns:
+            DataFrame: Square matrix indexed and labelled by list ID; the
+            diagonal is each list's size.
+        """
+        if self.memberships.empty:
+            return pd.DataFrame()
+        on_list = pd.crosstab(self.memberships["subscriber_hash"], self.memberships["list_id"]).clip(upper=1)
+        return on_list.T @ on_list
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_analytics(max_age=ANALYTICS_TTL, refresh=False):
+    """
+    The shared analytics snapshot, reloaded when older than max_age.
+
+    Args:
+        max_age (int): Seconds a snapshot is reused.
+        refresh (bool): Reload now.
+
+    Returns:
+        ClickAnalytics: The current snapshot.
+    """
+    global _snapshot
+    with _snapshot_lock:
+        stale = _snapshot is None or (datetime.now(timezone.utc) - _snapshot.loaded_at).total_seconds() > max_age
+        if refresh or stale:
+            _snapshot = ClickAnalytics.load()
+        return _snapshot
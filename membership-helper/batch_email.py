@@ -0,0 +1,351 @@
+'''
+batch_email.py
+Generates fundraising drafts for many subscribers at once
+- click profiles are fetched in bulk
+- completions run concurrently on an async client, capped by a semaphore and
+  a requests/tokens per minute limiter
+- every result is streamed to NDJSON or CSV with its latency, token usage and error
+- click sets with an email in email_cache are answered without a request
+- optionally, near-identical profiles are clustered (clustering.py) and share one email
+
+    python batch_email.py --top 1000 --out temp/emails.ndjson
+
+Pass --base-url to point it at llm_stub.py instead of OpenAI.
+
+'''
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+import openai
+import email_generator as gen
+from email_cache import email_cache, fingerprint
+from prompt_builder import estimate_tokens as estimate_text_tokens
+from clustering import cluster_profiles
+from db import fetch_click_profiles, fetch_subscribers, fetch_subscribers_sorted_by_clicks
+
+CONCURRENCY = 8                # Completions in flight at once
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 30000      # Prompt plus completion tokens
+MAX_RETRIES = 3                # Retries of 429s and 5xx, done by the OpenAI client
+JOB_KEY = "email_batch"        # list_id of email_batch jobs, which only read lists; the list to draft for is in params
+
+OUTPUT_FIELDS = [
+    "subscriber_hash", "cluster", "status", "click_count", "latency", "prompt_tokens",
+    "completion_tokens", "total_tokens", "error", "email",
+]
+
+
+def estimate_tokens(messages):
+    """Rough token count of chat messages, including a few tokens of overhead per message."""
+    return sum(estimate_text_tokens(message["content"]) + 4 for message in messages)
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter for requests and tokens per minute, shared by every
+    coroutine of a batch.
+    """
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        self.request_rate = requests_per_minute / 60
+        self.token_rate = tokens_per_minute / 60
+        self.request_capacity = requests_per_minute
+        self.token_capacity = tokens_per_minute
+        self.requests = float(requests_per_minute)
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests = min(self.request_capacity, self.requests + elapsed * self.request_rate)
+        self.tokens = min(self.token_capacity, self.tokens + elapsed * self.token_rate)
+
+    async def acquire(self, tokens):
+        """Wait until one request using `tokens` tokens fits in both budgets."""
+        tokens = min(tokens, self.token_capacity)
+        while True:
+            async with self._lock:
+                self._refill()
+                if self.requests >= 1 and self.tokens >= tokens:
+                    self.requests -= 1
+                    self.tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self.requests) / self.request_rate if self.requests < 1 else 0,
+                    (tokens - self.tokens) / self.token_rate if self.tokens < tokens else 0,
+                )
+            await asyncio.sleep(wait)
+
+    async def settle(self, estimated, actual):
+        """Give back (or take) the difference once a request's real usage is known."""
+        async with self._lock:
+            self._refill()
+            self.tokens = min(self.token_capacity, self.tokens + estimated - actual)
+
+
+class ResultWriter:
+    """
+    Streams result records to an NDJSON file, or CSV if the path ends in .csv.
+    Each record is flushed as soon as it is written.
+    """
+
+    def __init__(self, path, append=False):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.is_csv = path.lower().endswith(".csv")
+        self._file = open(path, "a" if append else "w", encoding="utf-8", newline="")
+        self._csv = None
+        if self.is_csv:
+            self._csv = csv.DictWriter(self._file, fieldnames=OUTPUT_FIELDS, extrasaction="ignore")
+            if not append:
+                self._csv.writeheader()
+
+    def write(self, record):
+        if self._csv:
+            self._csv.writerow(record)
+        else:
+            self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def top_subscriber_hashes(limit, list_id=None):
+    """
+    The hashes of the subscribers with the most clicks.
+
+    Args:
+        limit (int): Number of subscribers.
+        list_id (str, optional): Only subscribers on this list.
+
+    Returns:
+        list: Subscriber hashes, most clicks first.
+    """
+    if list_id:
+        subscribers = fetch_subscribers_sorted_by_clicks(list_id, limit=limit)
+    else:
+        subscribers = fetch_subscribers(limit=limit)
+    return [s["subscriber_hash"] for s in subscribers]
+
+
+async def _generate_one(client, limiter, semaphore, subscriber_hash, clicks, model, temperature, use_cache, base_url):
+    messages = gen.build_messages(clicks)
+    key = fingerprint(model, temperature, messages, gen.MAX_COMPLETION_TOKENS, base_url)
+    record = {"subscriber_hash": subscriber_hash, "click_count": len(clicks)}
+
+    # Replies from another endpoint (e.g. llm_stub) are never cached or served from the cache
+    cacheable = base_url is None
+    if use_cache and cacheable:
+        cached = email_cache.lookup(key)
+        if cached:
+            record.update(status="cached", latency=0.0, email=cached["email"])
+            return record
+    elif cacheable:
+        email_cache.record_bypass()
+
+    estimated = estimate_tokens(messages) + gen.MAX_COMPLETION_TOKENS
+
+    async with semaphore:
+        await limiter.acquire(estimated)
+        started = time.perf_counter()
+        try:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=gen.MAX_COMPLETION_TOKENS,
+            )
+        except Exception as e:
+            record.update(status="failed", latency=round(time.perf_counter() - started, 3), error=str(e))
+            await limiter.settle(estimated, 0)
+            return record
+
+    usage = response.usage
+    choice = response.choices[0]
+    record.update(
+        status="ok",
+        latency=round(time.perf_counter() - started, 3),
+        prompt_tokens=usage.prompt_tokens if usage else None,
+        completion_tokens=usage.completion_tokens if usage else None,
+        total_tokens=usage.total_tokens if usage else None,
+        email=choice.message.content,
+    )
+    # Emails cut off at the completion limit are written out but not reused
+    if cacheable and choice.finish_reason == "stop":
+        email_cache.store(key, model, record["email"], record["prompt_tokens"], record["completion_tokens"])
+    if usage:
+        await limiter.settle(estimated, usage.total_tokens)
+    return record
+
+
+async def generate_emails_async(profiles, output_path, concurrency=CONCURRENCY, requests_per_minute=REQUESTS_PER_MINUTE,
+                                tokens_per_minute=TOKENS_PER_MINUTE, base_url=None, api_key=None,
+                                model=gen.MODEL, temperature=gen.TEMPERATURE, use_cache=True, members=None,
+                                progress_callback=None):
+    """
+    Generate one email per click profile concurrently and stream the results to a file.
+
+    Args:
+        profiles (dict): Subscriber hash (or cluster) -> clicked headlines,
+            or headline -> click_date.
+        output_path (str): NDJSON file, or CSV if it ends in .csv.
+        concurrency (int): Completions in flight at once.
+        requests_per_minute (int): Request budget.
+        tokens_per_minute (int): Token budget, using estimated tokens until
+            each response reports its real usage.
+        base_url (str, optional): OpenAI-compatible API root, e.g. a local stub.
+            Emails from it bypass email_cache entirely.
+        api_key (str, optional): Defaults to the OPENAI_API_KEY environment variable.
+        model (str): Chat model.
+        temperature (float): Sampling temperature.
+        use_cache (bool): Set to False to request every email even if it is
+            cached; new emails still replace the cached ones.
+        members (dict, optional): Cluster -> subscriber hashes sharing its
+            email. Each member gets its own output record naming the cluster.
+        progress_callback (callable, optional): Called as progress_callback(done, total).
+
+    Returns:
+        dict: Counts of `succeeded`, `cached` and `failed` profiles, summed token usage,
+        `p50_latency`/`p95_latency` in seconds and total `duration`.
+    """
+    client = openai.AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=MAX_RETRIES)
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+
+    summary = {"succeeded": 0, "cached": 0, "failed": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    latencies = []
+
+    tasks = [
+        asyncio.ensure_future(_generate_one(client, limiter, semaphore, subscriber_hash, clicks, model, temperature, use_cache, base_url))
+        for subscriber_hash, clicks in profiles.items()
+    ]
+    try:
+        with ResultWriter(output_path) as writer:
+            for done, task in enumerate(asyncio.as_completed(tasks), start=1):
+                record = await task
+                if members:
+                    cluster = record["subscriber_hash"]
+                    for subscriber_hash in members[cluster]:
+                        writer.write({**record, "subscriber_hash": subscriber_hash, "cluster": cluster})
+                else:
+                    writer.write(record)
+
+                if record["status"] == "ok":
+                    summary["succeeded"] += 1
+                    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                        summary[key] += record.get(key) or 0
+                elif record["status"] == "cached":
+                    summary["cached"] += 1
+                else:
+                    summary["failed"] += 1
+                if record["status"] != "cached":
+                    latencies.append(record["latency"])
+
+                if progress_callback:
+                    progress_callback(done, len(tasks))
+    finally:
+        # Stop outstanding requests if the batch is cancelled or fails
+        for task in tasks:
+            task.cancel()
+        await client.close()
+
+    latencies.sort()
+    summary.update(
+        p50_latency=latencies[len(latencies) // 2] if latencies else None,
+        p95_latency=latencies[int(len(latencies) * 0.95)] if latencies else None,
+        duration=round(time.perf_counter() - started, 3),
+    )
+    return summary
+
+
+def generate_batch_emails(subscriber_hashes, output_path, cluster_threshold=None, progress_callback=None, **options):
+    """
+    Generate fundraising drafts for many subscribers.
+
+    Click profiles are fetched in bulk; subscribers without clicks are written
+    to the output as skipped. With a cluster_threshold, subscribers with
+    near-identical profiles are grouped and each group gets one email, written
+    from the headlines most of its members clicked.
+
+    Args:
+        subscriber_hashes (iterable): The subscribers to write to.
+        output_path (str): NDJSON file, or CSV if it ends in .csv.
+        cluster_threshold (float, optional): Cosine similarity needed to share
+            an email, see clustering.cluster_profiles. None writes one email
+            per subscriber.
+        progress_callback (callable, optional): Called as progress_callback(done, total).
+        **options: Passed to generate_emails_async (concurrency, rate limits, base_url, ...).
+
+    Returns:
+        dict: generate_emails_async's summary plus `skipped`, `requested`,
+        `clusters`, `llm_calls_saved` (by clustering) and `output_path`.
+    """
+    subscriber_hashes = list(dict.fromkeys(subscriber_hashes))
+    profiles = fetch_click_profiles(subscriber_hashes, with_dates=True)
+    skipped = [h for h in subscriber_hashes if not profiles.get(h)]
+
+    if cluster_threshold is not None:
+        clusters = cluster_profiles(profiles, threshold=cluster_threshold)
+        prompts = {f"cluster-{n}": set(c["headlines"]) for n, c in enumerate(clusters)}
+        options["members"] = {f"cluster-{n}": c["members"] for n, c in enumerate(clusters)}
+        print(f"Grouped {len(profiles)} subscribers into {len(clusters)} clusters")
+    else:
+        prompts = profiles
+
+    summary = asyncio.run(generate_emails_async(prompts, output_path, progress_callback=progress_callback, **options))
+
+    # Subscribers with nothing to personalise on go at the end of the file
+    with ResultWriter(output_path, append=True) as writer:
+        for subscriber_hash in skipped:
+            writer.write({"subscriber_hash": subscriber_hash, "status": "skipped", "click_count": 0, "error": "No click activity"})
+
+    summary.update(
+        skipped=len(skipped),
+        requested=len(subscriber_hashes),
+        clusters=len(prompts) if cluster_threshold is not None else None,
+        llm_calls_saved=len(profiles) - len(prompts),
+        output_path=output_path,
+    )
+    print(f"Batch email generation finished: {summary}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate fundraising drafts for the top clickers.")
+    parser.add_argument("--top", type=int, default=100, help="Number of top clickers.")
+    parser.add_argument("--list-id", help="Only subscribers on this list.")
+    parser.add_argument("--out", default="temp/emails.ndjson", help="Output file (.ndjson or .csv).")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--rpm", type=int, default=REQUESTS_PER_MINUTE, help="Requests per minute.")
+    parser.add_argument("--tpm", type=int, default=TOKENS_PER_MINUTE, help="Tokens per minute.")
+    parser.add_argument("--base-url", help="OpenAI-compatible API root, e.g. llm_stub.py's.")
+    parser.add_argument("--no-cache", action="store_true", help="Request every email, even if cached.")
+    parser.add_argument("--cluster-threshold", type=float, help="Share one email among subscribers this similar (0-1).")
+    args = parser.parse_args()
+
+    generate_batch_emails(
+        top_subscriber_hashes(args.top, args.list_id),
+        args.out,
+        concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        base_url=args.base_url,
+        use_cache=not args.no_cache,
+        cluster_threshold=args.cluster_threshold,
+    )
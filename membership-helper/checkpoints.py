@@ -0,0 +1,216 @@
+'''
+checkpoints.py
+Resumable checkpoints for long click ingestion runs
+- completed subscriber hashes, the cursor and running stats are saved every few subscribers
+- an interrupted run with the same key and parameters resumes where it stopped
+- stored in SQLite next to the other local state
+
+'''
+import json
+import os
+import sqlite3
+import uuid
+from contextlib import closing
+from datetime import datetime, timezone
+
+CHECKPOINT_PATH = "temp/ingest_checkpoints.sqlite3"
+CHECKPOINT_EVERY = 100   # Subscribers between saved checkpoints
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class IngestCheckpoint:
+    """
+    Checkpoint of one ingestion run, identified by a run key such as
+    "click_sync:<list_id>".
+
+    Call begin() before the loop, mark_done() after each subscriber is fully
+    stored, save() whenever pending() reaches CHECKPOINT_EVERY (after anything
+    the checkpoint depends on, like watermarks, is written), and complete()
+    at the end. Subscribers marked done but not yet saved are simply
+    processed again after a crash.
+    """
+
+    def __init__(self, run_key, path=CHECKPOINT_PATH):
+        """
+        Args:
+            run_key (str): Identifies the run; one unfinished run per key.
+            path (str): Location of the SQLite file.
+        """
+        self.run_key = run_key
+        self.path = path
+        self.run_id = None
+        self.completed = set()
+        self.cursor = 0
+        self.stats = {}
+        self.resumed = False
+        self._pending = []
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS ingest_runs (
+                    run_id TEXT PRIMARY KEY,
+                    run_key TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    cursor INTEGER NOT NULL DEFAULT 0,
+                    stats TEXT NOT NULL DEFAULT '{}',
+                    started_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    completed_at TEXT
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS ingest_completed (
+                    run_id TEXT NOT NULL,
+                    subscriber_hash TEXT NOT NULL,
+                    PRIMARY KEY (run_id, subscriber_hash)
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ingest_runs_key ON ingest_runs (run_key, status)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def begin(self, params=None, resume=True):
+        """
+        Resume the unfinished run for this key, or start a new one.
+
+        A run is only resumed if it was started with the same parameters;
+        otherwise it is abandoned.
+
+        Args:
+            params (dict, optional): Run options that must match to resume.
+            resume (bool): Set to False to abandon any unfinished run.
+
+        Returns:
+            bool: True if an interrupted run was resumed.
+        """
+        params_json = json.dumps(params or {}, sort_keys=True)
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT run_id, params, cursor, stats FROM ingest_runs WHERE run_key = ? AND status = 'running'",
+                (self.run_key,),
+            ).fetchone()
+
+            if row and resume and row[1] == params_json:
+                self.run_id, _, self.cursor, stats = row
+                self.stats = json.loads(stats)
+                self.completed = {
+                    subscriber_hash
+                    for (subscriber_hash,) in conn.execute(
+                        "SELECT subscriber_hash FROM ingest_completed WHERE run_id = ?", (self.run_id,)
+                    )
+                }
+                self.resumed = True
+                print(f"Resuming {self.run_key} at subscriber {self.cursor} ({len(self.completed)} already done)")
+                return True
+
+            if row:
+                self._close_run(conn, row[0], "abandoned")
+
+            self.run_id = uuid.uuid4().hex
+            conn.execute(
+                """
+                INSERT INTO ingest_runs (run_id, run_key, params, status, started_at, updated_at)
+                VALUES (?, ?, ?, 'running', ?, ?)
+                """,
+                (self.run_id, self.run_key, params_json, _now(), _now()),
+            )
+        return False
+
+    def is_done(self, subscriber_hash):
+        """True if the subscriber was completed by this run, before or after a resume."""
+        return subscriber_hash in self.completed
+
+    def mark_done(self, subscriber_hash):
+        """Record a subscriber whose clicks are fully stored. Persisted by the next save()."""
+        self.completed.add(subscriber_hash)
+        self._pending.append(subscriber_hash)
+
+    def pending(self):
+        """Number of subscribers marked done since the last save()."""
+        return len(self._pending)
+
+    def save(self, cursor, stats):
+        """
+        Persist the pending completed subscribers, the cursor and the run stats.
+
+        Args:
+            cursor (int): Position of the run in its subscriber list.
+            stats (dict): JSON-serialisable running totals.
+        """
+        self.cursor = cursor
+        self.stats = dict(stats)
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO ingest_completed (run_id, subscriber_hash) VALUES (?, ?)",
+                [(self.run_id, subscriber_hash) for subscriber_hash in self._pending],
+            )
+            conn.execute(
+                "UPDATE ingest_runs SET cursor = ?, stats = ?, updated_at = ? WHERE run_id = ?",
+                (cursor, json.dumps(self.stats), _now(), self.run_id),
+            )
+        self._pending = []
+
+    def complete(self, stats):
+        """
+        Mark the run finished so the next one starts from the top.
+
+        Args:
+            stats (dict): The run's final totals, kept with the run record.
+        """
+        self.stats = dict(stats)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE ingest_runs SET stats = ? WHERE run_id = ?", (json.dumps(self.stats), self.run_id))
+            self._close_run(conn, self.run_id, "completed")
+        self._pending = []
+
+    @staticmethod
+    def _close_run(conn, run_id, status):
+        conn.execute(
+            "UPDATE ingest_runs SET status = ?, updated_at = ?, completed_at = ? WHERE run_id = ?",
+            (status, _now(), _now(), run_id),
+        )
+        conn.execute("DELETE FROM ingest_completed WHERE run_id = ?", (run_id,))
+
+
+def recent_runs(run_key=None, limit=10, path=CHECKPOINT_PATH):
+    """
+    Fetch recent ingestion runs, newest first.
+
+    Args:
+        run_key (str, optional): Only runs with this key.
+        limit (int): Maximum number of runs.
+        path (str): Location of the SQLite file.
+
+    Returns:
+        list: Run dictionaries with parsed `stats`.
+    """
+    if not os.path.exists(path):
+        return []
+    query = "SELECT * FROM ingest_runs"
+    args = []
+    if run_key:
+        query += " WHERE run_key = ?"
+        args.append(run_key)
+    query += " ORDER BY started_at DESC LIMIT ?"
+    args.append(limit)
+
+    with closing(sqlite3.connect(path, timeout=30)) as conn:
+        conn.row_factory = sqlite3.Row
+        runs = [dict(row) for row in conn.execute(query, args)]
+    for run in runs:
+        run["stats"] = json.loads(run["stats"] or "{}")
+    return runs
@@ -0,0 +1,175 @@
+"""
+Fetching member activity for a whole list through Mailchimp Batch Operations.
+
+Instead of one HTTPS call per subscriber, the activity requests are submitted
+to /batches, polled until Mailchimp finishes them, and the resulting tar.gz of
+JSON responses is parsed as it downloads.
+"""
+import json
+import tarfile
+import time
+import streamlit as st
+import transport
+
+SERVER_PREFIX = 'us2'  # Replace 'usX' with your specific Mailchimp server prefix
+BASE_URL = f'https://{SERVER_PREFIX}.api.mailchimp.com/3.0/'
+
+OPERATIONS_PER_BATCH = 5000   # Keeps each /batches request body well under Mailchimp's size limit
+POLL_INTERVAL = 10            # Seconds between status checks
+BATCH_TIMEOUT = 60 * 60       # Give up waiting on a batch after an hour
+
+
+def _auth(api_key):
+    # Mailchimp accepts any username with the API key as the password
+    return ("anystring", api_key or st.secrets["API_KEY"])
+
+
+def submit_activity_batch(list_id, subscriber_hashes, base_url=BASE_URL, api_key=None):
+    """
+    Submit a batch of member activity requests to Mailchimp.
+
+    Args:
+        list_id (str): The Mailchimp list ID.
+        subscriber_hashes (list): Subscriber hashes to fetch activity for.
+        base_url (str): Mailchimp API root, overridable for a local stub.
+        api_key (str, optional): Mailchimp API key. Defaults to the API_KEY secret.
+
+    Returns:
+        str: The batch ID, or None if the submission failed.
+    """
+    operations = [
+        {
+            "method": "GET",
+            "path": f"/lists/{list_id}/members/{subscriber_hash}/activity",
+            "operation_id": subscriber_hash,
+        }
+        for subscriber_hash in subscriber_hashes
+    ]
+
+    try:
+        response = transport.post(f"{base_url}batches", json={"operations": operations}, auth=_auth(api_key))
+        if response.status_code != 200:
+            print(f"Error submitting activity batch for list {list_id}: {response.status_code} - {response.text}")
+            return None
+
+        batch_id = response.json()["id"]
+        print(f"Submitted activity batch {batch_id} with {len(operations)} operations for list {list_id}")
+        return batch_id
+
+    except Exception as e:
+        print(f"An unexpected error occurred while submitting activity batch for list {list_id}: {e}")
+        return None
+
+
+def wait_for_batch(batch_id, base_url=BASE_URL, api_key=None, poll_interval=POLL_INTERVAL, timeout=BATCH_TIMEOUT):
+    """
+    Poll a batch until Mailchimp has finished it.
+
+    Args:
+        batch_id (str): The batch ID returned by submit_activity_batch.
+        base_url (str): Mailchimp API root, overridable for a local stub.
+        api_key (str, optional): Mailchimp API key. Defaults to the API_KEY secret.
+        poll_interval (float): Seconds between status checks.
+        timeout (float): Seconds to wait before giving up.
+
+    Returns:
+        dict: The finished batch status (including `response_body_url`), or
+        None if it failed or timed out.
+    """
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            response = transport.get(f"{base_url}batches/{batch_id}", auth=_auth(api_key))
+            if response.status_code == 200:
+                status = response.json()
+                print(
+                    f"Batch {batch_id}: {status.get('status')} "
+                    f"({status.get('finished_operations', 0)}/{status.get('total_operations', 0)})"
+                )
+                if status.get("status") == "finished":
+                    return status
+            else:
+                print(f"Error checking batch {batch_id}: {response.status_code} - {response.text}")
+        except Exception as e:
+            print(f"An unexpected error occurred while checking batch {batch_id}: {e}")
+
+        time.sleep(poll_interval)
+
+    print(f"Timed out waiting for batch {batch_id}")
+    return None
+
+
+def iter_batch_results(response_body_url):
+    """
+    Stream the results of a finished batch.
+
+    The tar.gz archive is read straight off the HTTP response, one JSON file at
+    a time, so the whole archive is never held in memory.
+
+    Args:
+        response_body_url (str): The `response_body_url` of a finished batch.
+
+    Yields:
+        tuple: (operation_id, status_code, parsed response body) per operation.
+    """
+    with transport.get(response_body_url, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = False
+
+        with tarfile.open(fileobj=response.raw, mode="r|gz") as archive:
+            for member in archive:
+                if not member.isfile() or not member.name.endswith(".json"):
+                    continue
+
+                results = json.loads(archive.extractfile(member).read())
+                for result in results:
+                    try:
+                        body = json.loads(result.get("response") or "{}")
+                    except ValueError:
+                        body = {}
+                    yield result.get("operation_id"), result.get("status_code"), body
+
+
+def fetch_list_activity_batched(list_id, subscriber_hashes, base_url=BASE_URL, api_key=None,
+                                operations_per_batch=OPERATIONS_PER_BATCH, poll_interval=POLL_INTERVAL):
+    """
+    Fetch member activity for many subscribers through Mailchimp Batch Operations.
+
+    Args:
+        list_id (str): The Mailchimp list ID.
+        subscriber_hashes (list): Subscriber hashes to fetch activity for.
+        base_url (str): Mailchimp API root, overridable for a local stub.
+        api_key (str, optional): Mailchimp API key. Defaults to the API_KEY secret.
+        operations_per_batch (int): Maximum operations submitted per batch.
+        poll_interval (float): Seconds between status checks.
+
+    Yields:
+        tuple: (subscriber_hash, activity) where activity has the same shape as
+        get_member_activity's response, or an empty dict if the operation failed.
+    """
+    subscriber_hashes = list(subscriber_hashes)
+
+    # Submit every chunk up front so Mailchimp works on them in parallel
+    batch_ids = []
+    for i in range(0, len(subscriber_hashes), operations_per_batch):
+        batch_id = submit_activity_batch(
+            list_id, subscriber_hashes[i : i + operations_per_batch], base_url=base_url, api_key=api_key
+        )
+        if batch_id:
+            batch_ids.append(batch_id)
+
+    for batch_id in batch_ids:
+        status = wait_for_batch(batch_id, base_url=base_url, api_key=api_key, poll_interval=poll_interval)
+        if not status or not status.get("response_body_url"):
+            continue
+
+        try:
+            for operation_id, status_code, body in iter_batch_results(status["response_body_url"]):
+                if status_code != 200:
+                    print(f"Mailchimp batch error for Subscriber {operation_id}: {status_code} - {body.get('detail')}")
+                    yield operation_id, {}
+                else:
+                    yield operation_id, body
+        except Exception as e:
+            print(f"An unexpected error occurred while reading results of batch {batch_id}: {e}")
@@ -0,0 +1,178 @@
+"""
+Local stand-in for Mailchimp's /batches endpoint, for exercising
+chimp.batch_activity offline.
+
+    python -m chimp.batch_stub
+
+starts the stub, runs a batch through fetch_list_activity_batched and prints
+what came back. Use start_stub() to run it from your own scripts.
+"""
+import io
+import json
+import re
+import tarfile
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ACTIVITY_PATH = re.compile(r"^/lists/(?P<list_id>[^/]+)/members/(?P<subscriber_hash>[^/]+)/activity$")
+RESULTS_PER_FILE = 100   # Mailchimp splits results over several JSON files in the archive
+
+
+def sample_activity(list_id, subscriber_hash):
+    """
+    Build a plausible activity response for a subscriber.
+
+    Args:
+        list_id (str): The Mailchimp list ID.
+        subscriber_hash (str): The subscriber's unique hash.
+
+    Returns:
+        dict: Activity in the shape of /lists/{list_id}/members/{hash}/activity.
+    """
+    return {
+        "email_id": subscriber_hash,
+        "list_id": list_id,
+        "activity": [
+            {"action": "open", "timestamp": "2024-12-01T14:00:00+00:00"},
+            {
+                "action": "click",
+                "timestamp": "2024-12-01T14:02:00+00:00",
+                "url": "https://berkeleyside.org/2024/12/01/sample-story/",
+            },
+        ],
+    }
+
+
+class BatchStub:
+    """
+    In-memory batch store behind the stub server.
+
+    Batches finish after `polls_until_finished` status checks, so callers
+    exercise their polling loop.
+    """
+
+    def __init__(self, activity_for=sample_activity, polls_until_finished=1):
+        self.activity_for = activity_for
+        self.polls_until_finished = polls_until_finished
+        self.batches = {}
+        self.base_url = None
+        self._lock = threading.Lock()
+
+    def create(self, operations):
+        batch_id = uuid.uuid4().hex[:10]
+        with self._lock:
+            self.batches[batch_id] = {"operations": operations, "polls": 0}
+        return self.status(batch_id, poll=False)
+
+    def status(self, batch_id, poll=True):
+        with self._lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            if poll:
+                batch["polls"] += 1
+            finished = batch["polls"] >= self.polls_until_finished
+            total = len(batch["operations"])
+
+        return {
+            "id": batch_id,
+            "status": "finished" if finished else "started",
+            "total_operations": total,
+            "finished_operations": total if finished else 0,
+            "errored_operations": 0,
+            "response_body_url": f"{self.base_url}/batch-results/{batch_id}.tar.gz" if finished else "",
+        }
+
+    def results_archive(self, batch_id):
+        with self._lock:
+            operations = list(self.batches[batch_id]["operations"])
+
+        results = []
+        for operation in operations:
+            match = ACTIVITY_PATH.match(operation.get("path", ""))
+            if match:
+                body = self.activity_for(match["list_id"], match["subscriber_hash"])
+                results.append({"status_code": 200, "operation_id": operation.get("operation_id"), "response": json.dumps(body)})
+            else:
+                body = {"status": 404, "detail": "Resource not found"}
+                results.append({"status_code": 404, "operation_id": operation.get("operation_id"), "response": json.dumps(body)})
+
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+            for n, i in enumerate(range(0, len(results), RESULTS_PER_FILE)):
+                data = json.dumps(results[i : i + RESULTS_PER_FILE]).encode("utf-8")
+                info = tarfile.TarInfo(name=f"{batch_id}/{n}.json")
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        return buffer.getvalue()
+
+
+def _handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body, content_type="application/json"):
+            data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path.rstrip("/").endswith("/batches"):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                self._send(200, stub.create(payload.get("operations", [])))
+            else:
+                self._send(404, {"detail": "Not found"})
+
+        def do_GET(self):
+            results = re.match(r"^/batch-results/(?P<batch_id>\w+)\.tar\.gz$", self.path)
+            status = re.match(r"^.*/batches/(?P<batch_id>\w+)$", self.path)
+
+            if results and results["batch_id"] in stub.batches:
+                self._send(200, stub.results_archive(results["batch_id"]), "application/x-gzip")
+            elif status and stub.status(status["batch_id"], poll=False):
+                self._send(200, stub.status(status["batch_id"]))
+            else:
+                self._send(404, {"detail": "Not found"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_stub(host="127.0.0.1", port=0, **kwargs):
+    """
+    Start the stub server on a background thread.
+
+    Args:
+        host (str): Interface to bind.
+        port (int): Port to bind, or 0 for any free port.
+        **kwargs: Passed to BatchStub.
+
+    Returns:
+        tuple: (server, base_url) where base_url can be passed as `base_url`
+        to the chimp.batch_activity functions. Call server.shutdown() when done.
+    """
+    stub = BatchStub(**kwargs)
+    server = ThreadingHTTPServer((host, port), _handler(stub))
+    stub.base_url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{stub.base_url}/3.0/"
+
+
+if __name__ == "__main__":
+    from chimp.batch_activity import fetch_list_activity_batched
+
+    server, base_url = start_stub(polls_until_finished=2)
+    hashes = [uuid.uuid4().hex for _ in range(250)]
+    try:
+        received = dict(
+            fetch_list_activity_batched("stub-list", hashes, base_url=base_url, api_key="stub", poll_interval=0.1)
+        )
+        clicks = sum(1 for activity in received.values() for act in activity.get("activity", []) if act["action"] == "click")
+        print(f"Received activity for {len(received)} of {len(hashes)} subscribers ({clicks} clicks).")
+    finally:
+        server.shutdown()
@@ -0,0 +1,152 @@
+"""
+Campaign-centric click data: which members clicked which tracked link.
+
+A campaign has a few dozen links but thousands of recipients, so walking
+campaign -> link -> clickers needs far fewer calls than asking Mailchimp for
+every subscriber's activity.
+"""
+import streamlit as st
+from mailchimp_marketing.api_client import ApiClientError
+from chimp.member_clicks import connection_slots
+from transport import mailchimp_client
+
+API_KEY = st.secrets["API_KEY"]
+SERVER_PREFIX = 'us2'  # Replace 'usX' with your specific Mailchimp server prefix
+PAGE_SIZE = 1000       # Mailchimp's maximum `count`
+
+
+def _client():
+    return mailchimp_client(API_KEY, SERVER_PREFIX)
+
+
+def fetch_recent_campaigns(list_id, since_send_time=None):
+    """
+    Fetch the sent campaigns of a list, newest first.
+
+    Args:
+        list_id (str): The Mailchimp list ID.
+        since_send_time (str, optional): Only campaigns sent after this ISO 8601 time.
+
+    Returns:
+        list: Campaigns with `id`, `send_time` and `settings.subject_line`.
+
+    Raises:
+        Exception: A page could not be fetched.
+    """
+    campaigns = []
+    try:
+        client = _client()
+        offset = 0
+        while True:
+            options = {
+                "list_id": list_id,
+                "status": "sent",
+                "count": PAGE_SIZE,
+                "offset": offset,
+                "sort_field": "send_time",
+                "sort_dir": "DESC",
+                "fields": ["campaigns.id", "campaigns.send_time", "campaigns.settings.subject_line"],
+            }
+            if since_send_time:
+                options["since_send_time"] = since_send_time
+
+            with connection_slots:
+                response = client.campaigns.list(**options)
+
+            campaigns.extend(response["campaigns"])
+            if len(response["campaigns"]) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+
+        return campaigns
+
+    except ApiClientError as error:
+        print(f"Mailchimp API Client Error while fetching campaigns for list {list_id}: {error.text}")
+        raise
+    except Exception as e:
+        print(f"An unexpected error occurred while fetching campaigns for list {list_id}: {e}")
+        raise
+
+
+def fetch_campaign_links(campaign_id):
+    """
+    Fetch the tracked links of a campaign and their click counts.
+
+    Args:
+        campaign_id (str): The Mailchimp campaign ID.
+
+    Returns:
+        list: Links with `id`, `url` and `unique_clicks`.
+
+    Raises:
+        Exception: A page could not be fetched.
+    """
+    links = []
+    try:
+        client = _client()
+        offset = 0
+        while True:
+            with connection_slots:
+                response = client.reports.get_campaign_click_details(
+                    campaign_id,
+                    count=PAGE_SIZE,
+                    offset=offset,
+                    fields=["urls_clicked.id", "urls_clicked.url", "urls_clicked.unique_clicks"],
+                )
+
+            links.extend(response["urls_clicked"])
+            if len(response["urls_clicked"]) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+
+        return links
+
+    except ApiClientError as error:
+        print(f"Mailchimp API Client Error while fetching links for campaign {campaign_id}: {error.text}")
+        raise
+    except Exception as e:
+        print(f"An unexpected error occurred while fetching links for campaign {campaign_id}: {e}")
+        raise
+
+
+def iter_link_clickers(campaign_id, link_id):
+    """
+    Page through the members who clicked a campaign link.
+
+    Args:
+        campaign_id (str): The Mailchimp campaign ID.
+        link_id (str): The link ID from fetch_campaign_links.
+
+    Yields:
+        str: The subscriber hash (`email_id`) of each member who clicked.
+
+    Raises:
+        Exception: A page could not be fetched. Clickers already yielded are
+            only part of the link's clickers.
+    """
+    try:
+        client = _client()
+        offset = 0
+        while True:
+            with connection_slots:
+                response = client.reports.get_subscribers_info(
+                    campaign_id,
+                    link_id,
+                    count=PAGE_SIZE,
+                    offset=offset,
+                    fields=["members.email_id"],
+                )
+
+            for member in response["members"]:
+                yield member["email_id"]
+
+            if len(response["members"]) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+
+    except ApiClientError as error:
+        print(f"Mailchimp API Client Error while fetching clickers of link {link_id} in campaign {campaign_id}: {error.text}")
+        raise
+    except Exception as e:
+        print(f"An unexpected error occurred while fetching clickers of link {link_id} in campaign {campaign_id}: {e}")
+        raise
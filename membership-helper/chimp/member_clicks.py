@@ -1,6 +1,7 @@
+import threading
 import streamlit as st
-import mailchimp_marketing as MailchimpMarketing
 from mailchimp_marketing.api_client import ApiClientError
+from transport import mailchimp_client
 
 
 API_KEY = st.secrets["API_KEY"]
@@ -11,6 +12,11 @@ HEADERS = {
     'Authorization': f'Bearer {MC_KEY}'
     }
 
+# Mailchimp allows 10 simultaneous connections per API key; every concurrent
+# caller in this process shares this limit.
+MAX_CONNECTIONS = 10
+connection_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+
 
 def get_member_activity(list_id, subscriber):
     """
@@ -24,13 +30,10 @@ def get_member_activity(list_id, subscriber):
         dict: Member activity response from Mailchimp, or an empty dict on error.
     """
     try:
-        client = MailchimpMarketing.Client()
-        client.set_config({
-            "api_key": API_KEY,
-            "server": SERVER_PREFIX
-        })
+        client = mailchimp_client(API_KEY, SERVER_PREFIX)
 
-        response = client.lists.get_list_member_activity(list_id, subscriber)
+        with connection_slots:
+            response = client.lists.get_list_member_activity(list_id, subscriber)
         return response
 
     except ApiClientError as error:
@@ -2,9 +2,14 @@
 import streamlit as st
 from db import update_newsletter_subscriber_count
 from datetime import datetime
-import mailchimp_marketing as MailchimpMarketing
 from mailchimp_marketing.api_client import ApiClientError
+from transport import mailchimp_client
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from chimp.member_clicks import connection_slots
+import gzip
 import json
+import os
+import time
 
 
 """
@@ -21,74 +26,212 @@ HEADERS = {
     }
 
 
-def fetch_and_export_subscribers(list_id, temp_dir="temp"):
+def export_path(list_id, temp_dir="temp", compress=False):
     """
-    Fetch subscribers from a Mailchimp list and export as a JSON file.
+    Get the path of a list's subscriber export file.
 
     Args:
         list_id (str): The Mailchimp list ID.
-        temp_dir (str): Directory to store the exported JSON file.
+        temp_dir (str): Directory holding the export.
+        compress (bool): Whether the export is gzip-compressed.
 
     Returns:
-        str: Path to the exported JSON file, or None if an error occurred.
+        str: Path to the newline-delimited JSON export.
     """
-    try:
-        # Mailchimp API configuration
-        MC_KEY = st.secrets["MC_KEY"]
-        SERVER_PREFIX = 'us2'
+    return f"{temp_dir}/subscribers_{list_id}.ndjson" + (".gz" if compress else "")
 
-        client = MailchimpMarketing.Client()
 
-        client.set_config({
-            "api_key": MC_KEY,
-            "server": SERVER_PREFIX
-        })
+def _open_export(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
 
-        # Prepare for fetching
-        response_list = []
-        offset = 0
-        count = 100  # Number of records to fetch per request
-
-        fields = [
-            "members.id",
-            "members.status",
-            "members.stats.avg_open_rate",
-            "members.stats.avg_click_rate",
-            "members.timestamp_opt",
-            "members.tags"
-        ]
-
-        # Fetch data in batches
-        while True:
-            response = client.lists.get_list_members_info(
-                list_id,
-                count=count,
-                offset=offset,
-                fields=fields,
-                status="subscribed"
-            )
 
-            response_list.extend(response["members"])
-            
-            #print(len(response_list))
+EXPORT_FIELDS = [
+    "members.id",
+    "members.status",
+    "members.stats.avg_open_rate",
+    "members.stats.avg_click_rate",
+    "members.timestamp_opt",
+    "members.tags"
+]
+MAX_PAGE_SIZE = 1000    # Mailchimp's maximum `count`
+PAGE_RETRIES = 3        # Attempts per page before the export is abandoned
 
-            # Check if all members have been fetched
-            if len(response["members"]) < count:
-                break
 
-            offset += count  # Move to the next batch
+def _fetch_members_page(client, list_id, offset, count, since_last_changed=None, max_retries=PAGE_RETRIES):
+    """
+    Fetch one page of members, retrying just this page on failure.
 
-        # Export data to a JSON file
-       # timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-       # output_path = f"{temp_dir}/subscribers_{list_id}.json"
-        output_file = f"{temp_dir}/subscribers_{list_id}.json"
+    Only subscribed members are returned, unless `since_last_changed` is given:
+    then members of every status changed since that time are returned, so
+    unsubscribes and cleans are included.
 
+    Args:
+        client (MailchimpMarketing.Client): A configured Mailchimp client.
+        list_id (str): The Mailchimp list ID.
+        offset (int): Offset of the first member in the page.
+        count (int): Number of members in the page.
+        since_last_changed (str, optional): ISO 8601 time to fetch changes since.
+        max_retries (int): Attempts before giving up.
+
+    Returns:
+        list: The members in the page.
+    """
+    if since_last_changed:
+        filters = {"since_last_changed": since_last_changed}
+    else:
+        filters = {"status": "subscribed"}
+
+    for attempt in range(1, max_retries + 1):
+        try:
+            with connection_slots:
+                response = client.lists.get_list_members_info(
+                    list_id,
+                    count=count,
+                    offset=offset,
+                    fields=EXPORT_FIELDS,
+                    **filters
+                )
+            return response["members"]
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            print(f"Error fetching members {offset}-{offset + count} of list {list_id} (attempt {attempt}): {e}")
+            time.sleep(2 ** attempt)
 
-        with open(output_file, "w") as f:
-            json.dump(response_list, f, indent=4)
 
-        print(f"Exported subscribers to {output_file}")
-        return output_file
+def _iter_member_pages_parallel(client, list_id, total, count, concurrency, ordered=True):
+    """
+    Fetch offset windows concurrently and yield each page of members.
+
+    In-flight pages plus finished pages waiting to be yielded in order are
+    capped at 2 x `concurrency`, so a slow page holds back new requests rather
+    than letting the pages after it pile up in memory.
+
+    Args:
+        client (MailchimpMarketing.Client): A configured Mailchimp client.
+        list_id (str): The Mailchimp list ID.
+        total (int): Member count reported by Mailchimp.
+        count (int): Members per page.
+        concurrency (int): Maximum concurrent requests.
+        ordered (bool): Yield pages in offset order. Otherwise pages are
+            yielded as soon as they arrive.
+
+    Yields:
+        list: The members of one page.
+    """
+    offsets = iter(range(0, total, count))
+    in_flight = {}
+    finished = {}
+    next_offset = 0
+    last_page_full = total == 0
+    max_pending = concurrency * 2
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        def submit_more():
+            # The page at next_offset is always in flight, so waiting pages can always drain
+            while len(in_flight) + len(finished) < max_pending:
+                offset = next(offsets, None)
+                if offset is None:
+                    return
+                in_flight[pool.submit(_fetch_members_page, client, list_id, offset, count)] = offset
+
+        submit_more()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                offset = in_flight.pop(future)
+                members = future.result()
+                if offset + count >= total:
+                    last_page_full = len(members) == count
+
+                if ordered:
+                    finished[offset] = members
+                else:
+                    yield members
+
+            while next_offset in finished:
+                yield finished.pop(next_offset)
+                next_offset += count
+
+            submit_more()
+
+    # Members who joined while the export ran land past the reported total
+    offset = max(total, count * ((total + count - 1) // count))
+    while last_page_full:
+        members = _fetch_members_page(client, list_id, offset, count)
+        if members:
+            yield members
+        last_page_full = len(members) == count
+        offset += count
+
+
+def fetch_and_export_subscribers(list_id, temp_dir="temp", compress=False, concurrency=1, page_size=100, ordered=True,
+                                 since_last_changed=None):
+    """
+    Fetch subscribers from a Mailchimp list and export them as newline-delimited JSON.
+
+    Each page is written as soon as it arrives, so memory use doesn't grow
+    with the size of the list. With `concurrency` above 1, the member count is
+    read first and the offset windows are fetched in parallel; a failed page
+    is retried on its own without restarting the export.
+
+    Args:
+        list_id (str): The Mailchimp list ID.
+        temp_dir (str): Directory to store the exported file.
+        compress (bool): Gzip the export.
+        concurrency (int): Maximum concurrent page requests.
+        page_size (int): Members per request (up to 1000).
+        ordered (bool): Keep members in Mailchimp's order when fetching in
+            parallel. Set to False to write pages as they arrive.
+        since_last_changed (str, optional): Only export members changed since
+            this ISO 8601 time, whatever their status. Fetched sequentially,
+            since Mailchimp doesn't report how many members changed.
+
+    Returns:
+        dict: Export stats (`path`, `count`, `bytes`, `duration`), or None if
+        an error occurred.
+    """
+    try:
+        started = time.monotonic()
+
+        # Shared, connection-pooled Mailchimp client
+        client = mailchimp_client(MC_KEY, SERVER_PREFIX)
+
+        # Prepare for fetching
+        count = min(page_size, MAX_PAGE_SIZE)  # Number of records to fetch per request
+        exported = 0
+
+        if concurrency > 1 and not since_last_changed:
+            total = get_mc_subscribers_by_list_id(list_id)
+            if total is False:
+                return None
+            pages = _iter_member_pages_parallel(client, list_id, total, count, concurrency, ordered)
+        else:
+            pages = _iter_member_pages(client, list_id, count, since_last_changed)
+
+        os.makedirs(temp_dir, exist_ok=True)
+        output_file = export_path(list_id, temp_dir, compress)
+        if since_last_changed:
+            output_file = output_file.replace(f"subscribers_{list_id}", f"subscriber_changes_{list_id}")
+
+        # Write each page as it arrives
+        with _open_export(output_file, "w") as f:
+            for members in pages:
+                for member in members:
+                    f.write(json.dumps(member) + "\n")
+                exported += len(members)
+
+        stats = {
+            "path": output_file,
+            "count": exported,
+            "bytes": os.path.getsize(output_file),
+            "duration": time.monotonic() - started,
+        }
+        print(f"Exported {exported} subscribers to {output_file} ({stats['bytes']} bytes in {stats['duration']:.1f}s)")
+        return stats
 
     except ApiClientError as error:
         print(f"Mailchimp API Error: {error.text}")
@@ -97,19 +240,53 @@ def fetch_and_export_subscribers(list_id, temp_dir="temp"):
         print(f"An unexpected error occurred while exporting subscribers: {e}")
         return None
 
+
+def _iter_member_pages(client, list_id, count, since_last_changed=None):
+    """
+    Fetch pages of members one after another until a short page comes back.
+
+    Args:
+        client (MailchimpMarketing.Client): A configured Mailchimp client.
+        list_id (str): The Mailchimp list ID.
+        count (int): Members per page.
+        since_last_changed (str, optional): ISO 8601 time to fetch changes since.
+
+    Yields:
+        list: The members of one page.
+    """
+    offset = 0
+    while True:
+        members = _fetch_members_page(client, list_id, offset, count, since_last_changed)
+        yield members
+
+        # Check if all members have been fetched
+        if len(members) < count:
+            break
+
+        offset += count  # Move to the next batch
+
+
+def iter_exported_subscribers(path):
+    """
+    Read an export written by fetch_and_export_subscribers, one member at a time.
+
+    Args:
+        path (str): Path to the `.ndjson` or `.ndjson.gz` export.
+
+    Yields:
+        dict: One Mailchimp member record per line.
+    """
+    with _open_export(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
 def get_mc_subscribers_by_list_id(list_id):
     """
      Get the nunmber of subscribers from a given list id
     """
     try:
-        MC_KEY = st.secrets["MC_KEY"]
-        SERVER_PREFIX = 'us2'
-            
-        client = MailchimpMarketing.Client()
-        client.set_config({
-                "api_key": MC_KEY,
-                "server": SERVER_PREFIX
-            })
+        client = mailchimp_client(MC_KEY, SERVER_PREFIX)
         
         # Fetch the total count of subscribed members
         response = client.lists.get_list(list_id, fields=["stats.member_count"])
@@ -125,6 +302,53 @@ def get_mc_subscribers_by_list_id(list_id):
         return False
     
 
+def fetch_member_click_stats(list_id, count=1000):
+    """
+    Fetch each subscribed member's click rate and last-changed time.
+
+    Much cheaper than fetching activity: one call returns up to 1000 members.
+
+    Args:
+        list_id (str): The Mailchimp list ID.
+        count (int): Number of members per request (Mailchimp allows up to 1000).
+
+    Returns:
+        dict: Mapping of subscriber hash to {"avg_click_rate", "last_changed"}.
+    """
+    stats = {}
+    try:
+        client = mailchimp_client(MC_KEY, SERVER_PREFIX)
+
+        offset = 0
+        while True:
+            response = client.lists.get_list_members_info(
+                list_id,
+                count=count,
+                offset=offset,
+                fields=["members.id", "members.stats.avg_click_rate", "members.last_changed"],
+                status="subscribed"
+            )
+
+            for member in response["members"]:
+                stats[member["id"]] = {
+                    "avg_click_rate": member.get("stats", {}).get("avg_click_rate"),
+                    "last_changed": member.get("last_changed"),
+                }
+
+            if len(response["members"]) < count:
+                break
+            offset += count
+
+        return stats
+
+    except ApiClientError as error:
+        print(f"Mailchimp API Error while fetching member stats for list {list_id}: {error.text}")
+        return stats
+    except Exception as e:
+        print(f"An unexpected error occurred while fetching member stats for list {list_id}: {e}")
+        return stats
+
+
 def sync_newsletter_data(list_id):
     """
     Sync the data for a specific newsletter.
@@ -1,58 +1,155 @@
-from db import get_all_subscriber_hashes, add_new_subscribers, mark_missing_subscribers_as_deleted, sync_subscriber_list_id
-from chimp.newsletters import fetch_and_export_subscribers
-import json
+from db import get_newsletter, merge_subscriber_memberships, remove_subscriber_list_membership, stage_subscriber_hashes, reconcile_missing_subscribers
+from chimp.newsletters import fetch_and_export_subscribers, iter_exported_subscribers, get_mc_subscribers_by_list_id
+from datetime import datetime, timedelta, timezone
+from collections import defaultdict
+import time
+import uuid
 
-def sync_subscribers_from_mailchimp(list_id):
+MERGE_BATCH_SIZE = 5000  # Subscribers merged per database call while streaming the export
+EXPORT_CONCURRENCY = 4   # Parallel Mailchimp page requests during the export
+EXPORT_PAGE_SIZE = 1000  # Members per Mailchimp page request
+
+# Delta syncs ask for changes since the last sync minus this margin, so edits
+# made while the previous sync was running aren't missed.
+DELTA_OVERLAP = timedelta(minutes=5)
+
+
+def _delta_since(last_synced):
+    """
+    Turn a newsletter's last_synced value into a Mailchimp since_last_changed time.
+
+    Args:
+        last_synced (str): ISO timestamp of the last successful sync. Older
+            rows were saved in server local time without an offset.
+
+    Returns:
+        str: ISO 8601 UTC time to request changes since, or None if unknown.
+    """
+    if not last_synced or last_synced == "Never":
+        return None
+    try:
+        synced = datetime.fromisoformat(last_synced)
+    except ValueError:
+        return None
+    # Naive values are local time; astimezone() interprets them that way
+    synced = synced.astimezone(timezone.utc)
+    return (synced - DELTA_OVERLAP).isoformat()
+
+
+def sync_subscribers_from_mailchimp(list_id, compress=False, concurrency=EXPORT_CONCURRENCY, page_size=EXPORT_PAGE_SIZE,
+                                    full=False):
     """
     Sync subscribers from a Mailchimp list with the database.
 
+    By default only members changed since the newsletter's `last_synced` are
+    fetched (a delta sync): new and updated subscribers are upserted, and
+    members who unsubscribed, were cleaned or archived have the list removed.
+    The first sync of a list, or `full=True`, exports the entire audience.
+
+    The export is streamed back one member at a time and merged into the
+    database in batches of MERGE_BATCH_SIZE, each a single set-based statement
+    that adds the list to the subscribers' list_id arrays. Memory use stays
+    flat regardless of list size.
+
+    A full export only contains current members, so its hashes are also staged
+    in the database and the list's members missing from it are reconciled
+    there in one anti-join (see db.reconcile_missing_subscribers).
+
     Args:
         list_id (str): The Mailchimp list ID.
+        compress (bool): Gzip the intermediate export file.
+        concurrency (int): Parallel page requests for a full export.
+        page_size (int): Members per page request.
+        full (bool): Force a full reconcile instead of a delta sync.
 
     Returns:
-        str: Path to the exported JSON file.
+        dict: Sync stats: the export's `path`, `count` and `bytes`, plus `mode`
+        ("delta" or "full"), `synced_count`, `removed_count`, the list's
+        `subscriber_count`, `started_at` (use it as the new last_synced) and
+        total `duration` in seconds. None if the sync failed.
     """
     print(f"Attempting a sync of list ID {list_id}")
+    started = time.monotonic()
+    started_at = datetime.now(timezone.utc).isoformat()
     try:
+        since_last_changed = None
+        if not full:
+            newsletter = get_newsletter(list_id)
+            since_last_changed = _delta_since(newsletter.get("last_synced") if newsletter else None)
+        mode = "delta" if since_last_changed else "full"
+
         # Fetch the latest subscribers from Mailchimp
-        exported_file = fetch_and_export_subscribers(list_id)
-        if not exported_file:
+        export = fetch_and_export_subscribers(
+            list_id, compress=compress, concurrency=concurrency, page_size=page_size, ordered=False,
+            since_last_changed=since_last_changed
+        )
+        if not export:
             print("Failed to fetch subscribers from Mailchimp.")
             return None
 
-        with open(exported_file, "r") as f:
-            latest_subscribers = json.load(f)
-
         # Prepare data for the database
         new_subscribers = []
-        latest_hashes = []  # Track all subscriber hashes from this sync
+        departed = defaultdict(list)  # status -> hashes of members who left the list
+        synced_count = 0
+        sync_id = str(uuid.uuid4()) if mode == "full" else None
+
+        def merge(batch):
+            merged = merge_subscriber_memberships(list_id, batch, batch_size=MERGE_BATCH_SIZE)
+            if merged is None:
+                raise RuntimeError(f"Failed to merge {len(batch)} subscribers into list {list_id}")
+            if sync_id:
+                stage_subscriber_hashes(sync_id, (s["subscriber_hash"] for s in batch), batch_size=MERGE_BATCH_SIZE)
+            return merged
 
-        for subscriber in latest_subscribers:
+        for subscriber in iter_exported_subscribers(export["path"]):
             subscriber_hash = subscriber["id"]
-            print(f"appending {subscriber_hash}. ")
-            latest_hashes.append(subscriber_hash)
 
-            # Update or append the list_id
-            sync_subscriber_list_id(subscriber_hash, list_id)
+            if subscriber.get("status", "subscribed") != "subscribed":
+                departed[subscriber["status"]].append(subscriber_hash)
+                continue
 
-            # Prepare new subscriber data
             new_subscribers.append({
                 "subscriber_hash": subscriber_hash,
-                "list_id": [list_id],  # Ensure new entries have list_id as an array
-                "status": "subscribed",
                 "created_at": subscriber["timestamp_opt"]
             })
 
-        # Add or update subscribers
+            # Merge list membership a batch at a time
+            if len(new_subscribers) >= MERGE_BATCH_SIZE:
+                synced_count += merge(new_subscribers)
+                new_subscribers = []
+
         if new_subscribers:
-            add_new_subscribers(new_subscribers)
+            synced_count += merge(new_subscribers)
+
+        removed_count = 0
+        for status, hashes in departed.items():
+            removed_count += remove_subscriber_list_membership(hashes, list_id, status)
+
+        # An empty export is more likely a Mailchimp hiccup than an empty list
+        if sync_id and export["count"]:
+            counts = reconcile_missing_subscribers(sync_id, list_id=list_id)
+            if counts is None:
+                raise RuntimeError(f"Failed to reconcile departed subscribers of list {list_id}")
+            removed_count += counts["updated"]
 
-        # Mark missing subscribers as deleted
-        #removed = mark_missing_subscribers_as_deleted(latest_hashes)
-       # print(f"Marked {len(removed)} subscribers as deleted.")
+        if mode == "delta":
+            subscriber_count = get_mc_subscribers_by_list_id(list_id)
+            if subscriber_count is False:
+                subscriber_count = None
+        else:
+            subscriber_count = export["count"]
 
-        print("Subscriber sync complete.")
-        return exported_file
+        stats = {
+            **export,
+            "mode": mode,
+            "synced_count": synced_count,
+            "removed_count": removed_count,
+            "subscriber_count": subscriber_count,
+            "started_at": started_at,
+            "duration": time.monotonic() - started,
+        }
+        print(f"Subscriber sync complete: {stats}")
+        return stats
     except Exception as e:
         print(f"An error occurred during subscriber sync: {e}")
-        return None
\ No newline at end of file
+        return None
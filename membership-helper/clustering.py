@@ -0,0 +1,192 @@
+'''
+clustering.py
+Groups subscribers with near-identical click profiles so one email can serve each group
+- every profile (set of clicked headlines) becomes a hashed TF-IDF vector
+- profiles join the closest group whose centroid is at least `threshold`
+  cosine-similar, or start a new one
+- each group is described by the headlines most of its members clicked
+
+'''
+import re
+import zlib
+from collections import Counter
+import numpy as np
+
+N_FEATURES = 2 ** 13          # Hashed word buckets; collisions only blur similarity slightly
+DEFAULT_THRESHOLD = 0.8       # Cosine similarity needed to join a cluster
+MAX_CLUSTER_HEADLINES = 15    # Headlines describing a cluster in its prompt
+
+_WORD = re.compile(r"[a-z0-9]+")
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "in", "is", "it",
+    "its", "of", "on", "or", "that", "the", "this", "to", "was", "were", "will", "with", "after",
+    "about", "into", "over", "new", "says", "say",
+}
+
+
+def tokenize(headline):
+    """
+    Lower-case content words of a headline or URL slug, stop words removed.
+    Both split on anything that isn't a letter or digit.
+    """
+    return [w for w in _WORD.findall(headline.lower()) if len(w) > 1 and w not in STOP_WORDS]
+
+
+def _bucket(token, n_features):
+    # crc32 rather than hash(), which changes between processes
+    return zlib.crc32(token.encode("utf-8")) % n_features
+
+
+def vectorize_profiles(profiles, n_features=N_FEATURES):
+    """
+    Turn click profiles into L2-normalised hashed TF-IDF vectors.
+
+    Vectors are kept sparse as (indices, values) pairs of NumPy arrays.
+
+    Args:
+        profiles (dict): Subscriber hash -> clicked headlines.
+        n_features (int): Number of hash buckets.
+
+    Returns:
+        dict: Subscriber hash -> (indices, values). Profiles without a
+        usable word are left out.
+    """
+    counts = {}
+    document_frequency = np.zeros(n_features, dtype=np.int64)
+
+    for subscriber_hash, headlines in profiles.items():
+        buckets = Counter(_bucket(token, n_features) for headline in headlines for token in tokenize(headline))
+        if not buckets:
+            continue
+        indices = np.fromiter(buckets.keys(), dtype=np.int64, count=len(buckets))
+        counts[subscriber_hash] = (indices, np.fromiter(buckets.values(), dtype=np.float64, count=len(buckets)))
+        document_frequency[indices] += 1
+
+    idf = np.log((1 + len(counts)) / (1 + document_frequency)) + 1
+
+    vectors = {}
+    for subscriber_hash, (indices, tf) in counts.items():
+        values = np.log1p(tf) * idf[indices]
+        vectors[subscriber_hash] = (indices, values / np.linalg.norm(values))
+    return vectors
+
+
+class _Centroids:
+    """
+    Summed member vectors of every cluster, stored as an inverted index from
+    hash bucket to the clusters with weight in it. Memory grows with the words
+    the clusters contain rather than clusters x n_features, so thousands of
+    clusters (e.g. a threshold of 1.0) stay small.
+    """
+
+    def __init__(self):
+        self._postings = {}               # bucket -> [cluster ids, weights, used, {cluster: slot}]
+        self._sq_norms = np.zeros(64)     # Squared norm of each cluster's sum
+        self.count = 0
+
+    def add_cluster(self):
+        """Start an empty cluster and return its index."""
+        if self.count == len(self._sq_norms):
+            self._sq_norms = np.concatenate([self._sq_norms, np.zeros(self.count)])
+        self.count += 1
+        return self.count - 1
+
+    def similarities(self, indices, values):
+        """Cosine similarity of a normalised vector to every cluster centroid."""
+        scores = np.zeros(self.count)
+        for bucket, value in zip(indices.tolist(), values.tolist()):
+            posting = self._postings.get(bucket)
+            if posting:
+                ids, weights, used, _ = posting
+                # A cluster appears once per bucket, so fancy-index addition is safe
+                scores[ids[:used]] += weights[:used] * value
+        return scores / np.sqrt(np.maximum(self._sq_norms[:self.count], 1e-12))
+
+    def similarity(self, cluster, indices, values):
+        """Cosine similarity of a normalised vector to one cluster centroid."""
+        dot = 0.0
+        for bucket, value in zip(indices.tolist(), values.tolist()):
+            posting = self._postings.get(bucket)
+            slot = posting[3].get(cluster) if posting else None
+            if slot is not None:
+                dot += posting[1][slot] * value
+        return dot / np.sqrt(max(self._sq_norms[cluster], 1e-12))
+
+    def add(self, cluster, indices, values):
+        """Add a member's vector to a cluster's sum."""
+        for bucket, value in zip(indices.tolist(), values.tolist()):
+            posting = self._postings.get(bucket)
+            if posting is None:
+                posting = self._postings[bucket] = [np.empty(4, dtype=np.int64), np.empty(4), 0, {}]
+            slot = posting[3].get(cluster)
+            if slot is None:
+                slot = posting[2]
+                if slot == len(posting[0]):
+                    posting[0] = np.concatenate([posting[0], np.empty(slot, dtype=np.int64)])
+                    posting[1] = np.concatenate([posting[1], np.empty(slot)])
+                posting[0][slot] = cluster
+                posting[1][slot] = 0.0
+                posting[2] += 1
+                posting[3][cluster] = slot
+            old = posting[1][slot]
+            posting[1][slot] = old + value
+            self._sq_norms[cluster] += (old + value) ** 2 - old ** 2
+
+
+def cluster_profiles(profiles, threshold=DEFAULT_THRESHOLD, n_features=N_FEATURES):
+    """
+    Group subscribers whose click profiles are near-identical.
+
+    Profiles are visited largest first. Each joins the most similar existing
+    cluster if the cosine similarity to its centroid reaches `threshold`,
+    otherwise it starts a new cluster. A threshold of 1.0 only groups
+    identical profiles.
+
+    Args:
+        profiles (dict): Subscriber hash -> clicked headlines.
+        threshold (float): Minimum cosine similarity to join a cluster.
+        n_features (int): Number of hash buckets.
+
+    Returns:
+        list: Cluster dictionaries, largest first, with `members` (subscriber
+        hashes), `headlines` (the ones most members clicked, for the prompt)
+        and `cohesion` (mean similarity of the members to the centroid).
+    """
+    vectors = vectorize_profiles(profiles, n_features)
+    order = sorted(vectors, key=lambda h: (-len(profiles[h]), h))
+
+    centroids = _Centroids()
+    members = []
+
+    for subscriber_hash in order:
+        indices, values = vectors[subscriber_hash]
+        best, best_similarity = None, -1.0
+        if members:
+            scores = centroids.similarities(indices, values)
+            best = int(np.argmax(scores))
+            best_similarity = float(scores[best])
+
+        if best is None or best_similarity < threshold - 1e-9:
+            best = centroids.add_cluster()
+            members.append([])
+
+        centroids.add(best, indices, values)
+        members[best].append(subscriber_hash)
+
+    clusters = []
+    for k, cluster_members in enumerate(members):
+        headline_counts = Counter(headline for h in cluster_members for headline in set(profiles[h]))
+        cohesion = np.mean([centroids.similarity(k, *vectors[h]) for h in cluster_members])
+        clusters.append({
+            "members": cluster_members,
+            "headlines": [headline for headline, _ in headline_counts.most_common(MAX_CLUSTER_HEADLINES)],
+            "cohesion": round(float(cohesion), 3),
+        })
+
+    # Profiles with no usable words can't be compared, so each keeps its own email
+    for subscriber_hash in profiles:
+        if subscriber_hash not in vectors and profiles[subscriber_hash]:
+            clusters.append({"members": [subscriber_hash], "headlines": sorted(profiles[subscriber_hash]), "cohesion": 1.0})
+
+    clusters.sort(key=lambda c: -len(c["members"]))
+    return clusters
@@ -5,34 +5,261 @@ Holds all Stupabase logic
 - add a newsletter
 
 '''
+import copy
+import functools
+import threading
+import uuid
+import time
+from collections import Counter, defaultdict
+from itertools import islice
 import streamlit as st
 from supabase import create_client
+from jobs import job_queue
 
 # Initialize Supabase client
 SUPABASE_URL = st.secrets["SB_URL"]
 SUPABASE_KEY = st.secrets["SB_KEY"]
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Rows per request for the streaming readers. PostgREST caps a single response
+# (1000 rows by default), so anything larger has to be paged.
+PAGE_SIZE = 1000
+
+
+def _filter_value(value):
+    # Quote values used inside or=() filters; timestamps contain ':' and '+'
+    return '"' + str(value).replace('"', '\\"') + '"'
+
+
+def _iter_keyset(build_query, keys, page_size=PAGE_SIZE, descending=False):
+    """
+    Page through a query with a keyset cursor instead of OFFSET.
+
+    Each page continues strictly after the last row of the previous one on the
+    `keys` columns, so every page costs the same however deep the scan goes,
+    and only one page is held in memory at a time.
+
+    Args:
+        build_query (callable): Returns a fresh filtered select query. The
+            selected columns must include every key column.
+        keys (list): One or two columns forming a unique sort key, e.g.
+            ["subscriber_hash"] or ["click_date", "id"].
+        page_size (int): Rows per request.
+        descending (bool): Walk the keys from highest to lowest.
+
+    Yields:
+        dict: One row at a time.
+    """
+    op = "lt" if descending else "gt"
+    last_row = None
+
+    while True:
+        query = build_query()
+        if last_row is not None:
+            if len(keys) == 1:
+                query = query.filter(keys[0], op, last_row[keys[0]])
+            else:
+                first, second = keys
+                query = query.or_(
+                    f"{first}.{op}.{_filter_value(last_row[first])},"
+                    f"and({first}.eq.{_filter_value(last_row[first])},{second}.{op}.{_filter_value(last_row[second])})"
+                )
+
+        for key in keys:
+            query = query.order(key, desc=descending)
+
+        rows = query.limit(page_size).execute().data or []
+        yield from rows
+
+        if len(rows) < page_size:
+            return
+        last_row = rows[-1]
+
+"""
+     <-----------------------------------   QUERY CACHE ------------------------------------>
+
+"""
+
+# Seconds cached query results stay valid. Writers in this module invalidate
+# them straight away and worker jobs are noticed through the job queue; the TTL
+# only bounds staleness from writes made elsewhere.
+NEWSLETTERS_TTL = 5 * 60
+SUBSCRIBER_COUNT_TTL = 5 * 60
+
+# Job kinds (see worker.py) whose handlers write each cached table. They run in
+# worker processes, so their invalidate() calls never reach this one.
+TABLE_WRITERS = {
+    "newsletters": ("subscriber_sync",),
+    "subscribers": ("subscriber_sync", "click_sync", "click_sync_all"),
+}
+
+
+class QueryCache:
+    """
+    In-process read-through cache for small, hot, rarely-changing queries.
+
+    Entries are tagged with the tables they read, and writers call
+    invalidate() with the tables they change. Writes from other processes are
+    caught by `version`. Shared by every Streamlit session in the process, so
+    page reruns reuse the same results.
+    """
+
+    def __init__(self, version=None):
+        """
+        Args:
+            version (callable, optional): Called with an entry's tables, returns
+                a value that changes whenever another process may have written
+                them. Entries loaded under a different value are reloaded.
+        """
+        self.version = version
+        self._entries = {}   # key -> (expires_at, tables, value, version)
+        self._generations = defaultdict(int)   # table (None for all) -> invalidations so far
+        self._lock = threading.Lock()
+        self.stats = defaultdict(lambda: {"hits": 0, "misses": 0})
+        self.invalidations = 0
+
+    def get_or_load(self, key, tables, ttl, loader):
+        """
+        Return the cached value for `key`, calling `loader()` on a miss.
+
+        Exceptions from the loader are not cached. Neither is a value whose
+        tables were invalidated while it loaded, since it may predate the write.
+        """
+        name = key[0]
+        version = self.version(tables) if self.version else None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now and entry[3] == version:
+                self.stats[name]["hits"] += 1
+                return copy.deepcopy(entry[2])
+            self.stats[name]["misses"] += 1
+            generation = self._generation(tables)
+
+        value = loader()
+        with self._lock:
+            if self._generation(tables) == generation:
+                self._entries[key] = (time.monotonic() + ttl, frozenset(tables), value, version)
+        return copy.deepcopy(value)
+
+    def _generation(self, tables):
+        return tuple(self._generations[table] for table in (None, *tables))
+
+    def invalidate(self, *tables):
+        """Drop every entry that read any of `tables`, or everything if none are given."""
+        with self._lock:
+            for table in tables or (None,):
+                self._generations[table] += 1
+            stale = [key for key, entry in self._entries.items() if not tables or entry[1] & set(tables)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def get_stats(self):
+        """Hit/miss counts per query, plus totals and the current number of entries."""
+        with self._lock:
+            queries = {name: dict(counts) for name, counts in self.stats.items()}
+            size = len(self._entries)
+        hits = sum(q["hits"] for q in queries.values())
+        misses = sum(q["misses"] for q in queries.values())
+        return {
+            "queries": queries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "invalidations": self.invalidations,
+            "size": size,
+        }
+
+
+def _jobs_version(tables):
+    # Finishing a job that writes one of the tables makes older entries stale
+    return job_queue.last_finished({kind for table in tables for kind in TABLE_WRITERS.get(table, ())})
+
+
+query_cache = QueryCache(version=_jobs_version)
+
+
+def cached_query(tables, ttl):
+    """
+    Cache a query function's result in `query_cache`, keyed on its arguments.
+
+    The decorated function should raise on errors so failures are not cached.
+    Pass `use_cache=False` to bypass the cache for one call.
+
+    Args:
+        tables (tuple): Tables the query reads, used for invalidation.
+        ttl (int): Seconds a result stays valid.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, use_cache=True, **kwargs):
+            if not use_cache:
+                return func(*args, **kwargs)
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            return query_cache.get_or_load(key, tables, ttl, lambda: func(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def get_query_cache_stats():
+    """
+    Get hit/miss statistics of the db query cache.
+
+    Returns:
+        dict: `queries` (per-query hits and misses), total `hits`, `misses`,
+        `hit_rate`, `invalidations` and current `size`.
+    """
+    return query_cache.get_stats()
+
 """
     <----------------------------------- NEWSLETTERS  ------------------------------------>
     
 """
 
-def fetch_all_newsletters():
+@cached_query(("newsletters",), ttl=NEWSLETTERS_TTL)
+def _query_newsletters():
+    response = supabase.table("newsletters").select("*").execute()
+    return response.data if response.data else []
+
+
+def fetch_all_newsletters(use_cache=True):
     """
     Fetch all newsletters from the database.
 
+    Cached for NEWSLETTERS_TTL seconds and invalidated by the newsletter writers.
+
+    Args:
+        use_cache (bool): Set False to read straight from the database.
+
     Returns:
         list: A list of newsletter records.
     """
     try:
-        response = supabase.table("newsletters").select("*").execute()
-        return response.data if response.data else []
+        return _query_newsletters(use_cache=use_cache)
     except Exception as e:
         print(f"An error occurred while fetching newsletters: {e}")
         return []
     
 
+def get_newsletter(list_id):
+    """
+    Fetch a single newsletter by its list_id.
+
+    Args:
+        list_id (str): The Mailchimp list ID.
+
+    Returns:
+        dict: The newsletter record, or None if it doesn't exist.
+    """
+    try:
+        response = supabase.table("newsletters").select("*").eq("list_id", list_id).execute()
+        return response.data[0] if response.data else None
+    except Exception as e:
+        print(f"An error occurred while fetching newsletter {list_id}: {e}")
+        return None
+
+
 def newsletter_exists(list_id):
     """
     Check if a newsletter with the given list_id exists.
@@ -66,6 +293,7 @@ def add_newsletter(list_id, name):
     ).execute()
 
     if response.data:
+        query_cache.invalidate("newsletters")
         print(f"Newsletter '{name}' added successfully.")
         return True
     else:
@@ -88,6 +316,7 @@ def update_newsletter_subscriber_count(list_id, subscriber_count, last_synced):
         response = supabase.table("newsletters").update(
             {"subscriber_count": subscriber_count, "last_synced": last_synced}
         ).eq("list_id", list_id).execute()
+        query_cache.invalidate("newsletters")
 
         if response.data:
             print(f"Newsletter {list_id} updated successfully.")
@@ -105,20 +334,73 @@ def update_newsletter_subscriber_count(list_id, subscriber_count, last_synced):
     
 """
 
-def get_total_subscribers():
+@cached_query(("subscribers",), ttl=SUBSCRIBER_COUNT_TTL)
+def _query_total_subscribers():
+    # head=True returns only the count, not the rows
+    response = supabase.table("subscribers").select("id", count="exact", head=True).execute()
+    return response.count or 0
+
+
+def get_total_subscribers(use_cache=True):
     """
     Fetch the total count of subscribers in the database.
 
+    Cached for SUBSCRIBER_COUNT_TTL seconds and invalidated by the subscriber writers.
+
+    Args:
+        use_cache (bool): Set False to count straight from the database.
+
     Returns:
         int: The total number of subscribers.
     """
-    response = supabase.table("subscribers").select("id", count="exact").execute()
-    if response.data:
-        return response.count
-    else: 
-        print("Error fetching total subscribers:", response.error)
+    try:
+        return _query_total_subscribers(use_cache=use_cache)
+    except Exception as e:
+        print(f"Error fetching total subscribers: {e}")
         return 0
 
+def iter_subscribers(columns="subscriber_hash", list_id=None, created_after=None, page_size=PAGE_SIZE):
+    """
+    Stream subscribers in subscriber_hash order, one page at a time.
+
+    Args:
+        columns (str): Columns to select. subscriber_hash is always included.
+        list_id (str, optional): Only subscribers on this list.
+        created_after (str, optional): Only members created after this date (ISO format).
+        page_size (int): Rows per request.
+
+    Yields:
+        dict: One subscriber row at a time.
+    """
+    if "subscriber_hash" not in [c.strip() for c in columns.split(",")]:
+        columns = f"subscriber_hash, {columns}"
+
+    def build_query():
+        query = supabase.table("subscribers").select(columns)
+        if list_id:
+            query = query.filter("list_id", "cs", f"{{{list_id}}}")
+        if created_after:
+            query = query.gte("created_at", created_after)
+        return query
+
+    yield from _iter_keyset(build_query, ["subscriber_hash"], page_size=page_size)
+
+
+def iter_subscriber_hashes(list_id=None, page_size=PAGE_SIZE):
+    """
+    Stream every subscriber hash, one page at a time.
+
+    Args:
+        list_id (str, optional): Only subscribers on this list.
+        page_size (int): Rows per request.
+
+    Yields:
+        str: One subscriber hash at a time.
+    """
+    for row in iter_subscribers(list_id=list_id, page_size=page_size):
+        yield row["subscriber_hash"]
+
+
 def get_all_subscriber_hashes():
     """
     Fetch all subscriber hashes from the database.
@@ -126,17 +408,18 @@ def get_all_subscriber_hashes():
     Returns:
         list: A list of subscriber hashes.
     """
-    response = supabase.table("subscribers").select("subscriber_hash").execute()
-    if response.data:
-        return [row["subscriber_hash"] for row in response.data]
-    else:
-        print("Error fetching subscriber hashes:", response.error)
+    try:
+        return list(iter_subscriber_hashes())
+    except Exception as e:
+        print(f"Error fetching subscriber hashes: {e}")
         return []
 
 def fetch_subscribers(limit=10, created_after=None):
     """
     Fetch subscribers sorted by total_clicks, filtered by creation date.
 
+    Requests are paged, so limits above the PostgREST row cap return every row.
+
     Args:
         limit (int): The maximum number of results to fetch.
         created_after (str, optional): Fetch members created after this date (ISO format).
@@ -144,19 +427,27 @@ def fetch_subscribers(limit=10, created_after=None):
     Returns:
         list: A list of subscribers.
     """
-    query = supabase.table("subscribers").select("id, subscriber_hash, total_clicks, created_at")
+    subscribers = []
+    try:
+        while len(subscribers) < limit:
+            query = supabase.table("subscribers").select("id, subscriber_hash, total_clicks, created_at")
 
-    if created_after:
-        query = query.gte("created_at", created_after)
+            if created_after:
+                query = query.gte("created_at", created_after)
 
-    query = query.order("total_clicks", desc=True).limit(limit)
+            start = len(subscribers)
+            end = min(limit, start + PAGE_SIZE) - 1
+            query = query.order("total_clicks", desc=True).order("subscriber_hash").range(start, end)
 
-    response = query.execute()
-    if response.data:
-        return response.data
-    else:
-        print("Error fetching subscribers:", response.error)
-        return []
+            rows = query.execute().data or []
+            subscribers.extend(rows)
+            if len(rows) < end - start + 1:
+                break
+
+        return subscribers
+    except Exception as e:
+        print(f"Error fetching subscribers: {e}")
+        return subscribers
     
 
 def add_new_subscribers(subscribers):
@@ -173,6 +464,7 @@ def add_new_subscribers(subscribers):
         response = supabase.table("subscribers").upsert(
             subscribers, on_conflict="subscriber_hash"
         ).execute()
+        query_cache.invalidate("subscribers")
         if response.data:
             print(f"Added or updated {len(response.data)} subscribers.")
             return True
@@ -185,101 +477,130 @@ def add_new_subscribers(subscribers):
     
 
     
-def remove_missing_subscribers(subscriber_hashes_to_keep, batch_size=100):
+def stage_subscriber_hashes(sync_id, subscriber_hashes, batch_size=5000):
     """
-    Remove subscribers from the database whose hashes are not in the given list.
+    Bulk load exported subscriber hashes into the reconcile staging table.
 
     Args:
-        subscriber_hashes_to_keep (list): List of current subscriber hashes to keep.
-        batch_size (int): Number of hashes to process per batch.
+        sync_id (str): Identifies this sync's rows in subscriber_sync_staging.
+        subscriber_hashes (iterable): Hashes to stage. Consumed a batch at a time,
+            so a streamed export never has to be held in memory.
+        batch_size (int): Hashes sent per call.
 
     Returns:
-        bool: True if the operation was successful, False otherwise.
+        int: The number of hashes staged.
+    """
+    staged = 0
+    batch = []
+
+    def flush():
+        response = supabase.rpc("stage_subscriber_hashes", {"p_sync_id": sync_id, "p_hashes": batch}).execute()
+        return response.data or 0
+
+    for subscriber_hash in subscriber_hashes:
+        batch.append(subscriber_hash)
+        if len(batch) >= batch_size:
+            staged += flush()
+            batch = []
+    if batch:
+        staged += flush()
+
+    return staged
+
+
+def reconcile_missing_subscribers(sync_id, list_id=None, status="deleted", delete=False):
+    """
+    Mark or delete the subscribers missing from a staged export.
+
+    Runs the `reconcile_missing_subscribers` Postgres function (see
+    sql/subscriber_reconcile.sql): one anti-join between subscribers and the
+    hashes staged under `sync_id`, then one set-based update or delete. The
+    staging rows are cleared afterwards.
+
+    Args:
+        sync_id (str): The sync whose hashes were staged with stage_subscriber_hashes.
+        list_id (str, optional): Only reconcile members of this list; the list is
+            removed from missing subscribers who are still on other lists.
+            Reconciles the whole table when None.
+        status (str): Status for missing subscribers left on no list.
+        delete (bool): Delete those subscribers instead of marking them.
+
+    Returns:
+        dict: Counts of `staged`, `missing`, `updated` and `deleted` subscribers,
+        or None if the reconcile failed.
     """
     try:
-        total_removed = 0
-        # Fetch all subscriber hashes currently in the database
-        response = supabase.table("subscribers").select("subscriber_hash").execute()
-        if not response.data:
-            print("No subscribers found in the database to remove.")
-            return True
+        response = supabase.rpc("reconcile_missing_subscribers", {
+            "p_sync_id": sync_id,
+            "p_list_id": list_id,
+            "p_status": status,
+            "p_delete": delete,
+        }).execute()
+        query_cache.invalidate("subscribers")
+        counts = response.data
+        print(f"Reconciled subscribers{f' of list {list_id}' if list_id else ''}: {counts}")
+        return counts
+    except Exception as e:
+        print(f"An unexpected error occurred while reconciling subscribers: {e}")
+        return None
 
-        current_hashes_in_db = {row["subscriber_hash"] for row in response.data}
-
-        # Identify hashes to delete
-        hashes_to_delete = list(current_hashes_in_db - set(subscriber_hashes_to_keep))
-        print(f"Total hashes to delete: {len(hashes_to_delete)}")
-
-        # Process deletion in batches
-        total_batches = (len(hashes_to_delete) - 1) // batch_size + 1
-        for i in range(total_batches):
-            batch = hashes_to_delete[i * batch_size : (i + 1) * batch_size]
-            try:
-                response = supabase.table("subscribers").delete().in_(
-                    "subscriber_hash", batch
-                ).execute()
-
-                removed_count = len(response.data) if response.data else 0
-                total_removed += removed_count
-                print(f"Batch {i + 1}: Removed {removed_count} subscribers.")
-            except Exception as e:
-                print(f"Error removing subscribers in batch {i + 1}: {e}")
-                return False
-
-        print(f"Total subscribers removed: {total_removed}")
-        return True
+
+def _reconcile_against(subscriber_hashes_to_keep, list_id, delete, batch_size):
+    sync_id = str(uuid.uuid4())
+    staged = stage_subscriber_hashes(sync_id, subscriber_hashes_to_keep, batch_size=batch_size)
+    print(f"Staged {staged} subscriber hashes to keep.")
+    return reconcile_missing_subscribers(sync_id, list_id=list_id, delete=delete)
+
+
+def remove_missing_subscribers(subscriber_hashes_to_keep, list_id=None, batch_size=5000):
+    """
+    Remove subscribers from the database whose hashes are not in the given list.
+
+    The hashes to keep are staged in the database and the missing subscribers
+    are deleted there in one statement.
+
+    Args:
+        subscriber_hashes_to_keep (iterable): Current subscriber hashes to keep.
+        list_id (str, optional): Only remove members of this list.
+        batch_size (int): Number of hashes staged per call.
+
+    Returns:
+        int: The number of subscribers removed, or None if the operation failed.
+    """
+    try:
+        counts = _reconcile_against(subscriber_hashes_to_keep, list_id, True, batch_size)
+        if counts is None:
+            return None
+        print(f"Total subscribers removed: {counts['deleted']}")
+        return counts["deleted"]
     except Exception as e:
         print(f"An unexpected error occurred while removing subscribers: {e}")
-        return False
+        return None
     
-def mark_missing_subscribers_as_deleted(subscriber_hashes_to_keep, batch_size=100):
+def mark_missing_subscribers_as_deleted(subscriber_hashes_to_keep, list_id=None, batch_size=5000):
     """
     Mark subscribers as 'deleted' in the database if their hashes are not in the given list.
 
+    The hashes to keep are staged in the database and the missing subscribers
+    are marked there in one statement.
+
     Args:
-        subscriber_hashes_to_keep (list): List of current subscriber hashes to keep.
-        batch_size (int): Number of records to process in each batch.
+        subscriber_hashes_to_keep (iterable): Current subscriber hashes to keep.
+        list_id (str, optional): Only mark members of this list.
+        batch_size (int): Number of hashes staged per call.
 
     Returns:
-        list: List of subscriber hashes marked as deleted.
+        int: The number of subscribers updated, or None if the operation failed.
     """
     try:
-        # Fetch all subscriber hashes currently in the database
-        response = supabase.table("subscribers").select("subscriber_hash").execute()
-        if not response.data:
-            print("No subscribers found in the database to compare.")
-            return []
-
-        current_hashes_in_db = {row["subscriber_hash"] for row in response.data}
-        hashes_to_mark_deleted = list(current_hashes_in_db - set(subscriber_hashes_to_keep))
-
-        print(f"Hashes to keep: {len(subscriber_hashes_to_keep)}")
-        print(f"Hashes to mark as deleted: {len(hashes_to_mark_deleted)}")
-
-        if not hashes_to_mark_deleted:
-            print("No subscribers to mark as deleted.")
-            return []
-
-        # Process deletion in batches
-        total_removed = 0
-        for i in range(0, len(hashes_to_mark_deleted), batch_size):
-            batch = hashes_to_mark_deleted[i : i + batch_size]
-            try:
-                response = supabase.table("subscribers").update(
-                    {"status": "deleted"}
-                ).in_("subscriber_hash", batch).execute()
-
-                removed_count = len(response.data) if response.data else 0
-                total_removed += removed_count
-                print(f"Batch {i // batch_size + 1}: Marked {removed_count} subscribers as deleted.")
-            except Exception as e:
-                print(f"Error marking subscribers as deleted in batch {i // batch_size + 1}: {e}")
-
-        print(f"Total subscribers marked as deleted: {total_removed}")
-        return hashes_to_mark_deleted
+        counts = _reconcile_against(subscriber_hashes_to_keep, list_id, False, batch_size)
+        if counts is None:
+            return None
+        print(f"Total subscribers marked as deleted: {counts['updated']}")
+        return counts["updated"]
     except Exception as e:
         print(f"An unexpected error occurred while marking subscribers as deleted: {e}")
-        return []
+        return None
 
 
 def sync_subscriber_list_id(subscriber_hash, list_id):
@@ -324,6 +645,7 @@ def sync_subscriber_list_id(subscriber_hash, list_id):
                     "status": "subscribed"
                 }
             ).execute()
+            query_cache.invalidate("subscribers")
             print(f"Inserted new subscriber {subscriber_hash} with list_id '{list_id}'.")
             return True
     except Exception as e:
@@ -332,92 +654,230 @@ def sync_subscriber_list_id(subscriber_hash, list_id):
 
 
 
+def merge_subscriber_memberships(list_id, subscribers, batch_size=5000):
+    """
+    Upsert subscribed members of a list and add the list to their list_id array.
+
+    Runs the `merge_subscriber_memberships` Postgres function (see
+    sql/subscriber_memberships.sql), which merges a whole batch in one
+    statement, so a list of N members takes N / batch_size round-trips.
+
+    Args:
+        list_id (str): The Mailchimp list ID.
+        subscribers (list): Dictionaries with `subscriber_hash` and `created_at`.
+        batch_size (int): Subscribers sent per call.
+
+    Returns:
+        int: The number of subscribers inserted or updated, or None if a batch failed.
+    """
+    merged = 0
+    for i in range(0, len(subscribers), batch_size):
+        batch = [
+            {"subscriber_hash": s["subscriber_hash"], "created_at": s.get("created_at")}
+            for s in subscribers[i : i + batch_size]
+        ]
+        try:
+            response = supabase.rpc(
+                "merge_subscriber_memberships", {"p_list_id": list_id, "p_subscribers": batch}
+            ).execute()
+            merged += response.data or 0
+        except Exception as e:
+            print(f"Error merging memberships for list {list_id} in batch {i // batch_size + 1}: {e}")
+            query_cache.invalidate("subscribers")
+            return None
+
+    query_cache.invalidate("subscribers")
+    print(f"Merged {merged} subscribers into list {list_id}.")
+    return merged
+
+
+def remove_subscriber_list_membership(subscriber_hashes, list_id, status, batch_size=5000):
+    """
+    Remove a list from subscribers who left it (unsubscribed, cleaned, ...).
+
+    Subscribers who are still on other lists keep their status; those left on
+    no list get the given status. Runs the `remove_subscriber_memberships`
+    Postgres function, one statement per batch.
+
+    Args:
+        subscriber_hashes (list): Hashes of the subscribers who left the list.
+        list_id (str): The list ID they left.
+        status (str): Status for subscribers no longer on any list.
+        batch_size (int): Number of subscribers to process per batch.
+
+    Returns:
+        int: The number of subscribers updated.
+    """
+    updated = 0
+    for i in range(0, len(subscriber_hashes), batch_size):
+        batch = subscriber_hashes[i : i + batch_size]
+        try:
+            response = supabase.rpc(
+                "remove_subscriber_memberships", {"p_list_id": list_id, "p_hashes": batch, "p_status": status}
+            ).execute()
+            updated += response.data or 0
+        except Exception as e:
+            print(f"Error removing list {list_id} from subscribers in batch {i // batch_size + 1}: {e}")
+
+    query_cache.invalidate("subscribers")
+
+    print(f"Removed list {list_id} from {updated} subscribers ({status}).")
+    return updated
+
 """
      <-----------------------------------   CLICK ACTIVITY ------------------------------------>
     
 """
 
 
-def fetch_click_activity(start_date=None, end_date=None, newsletter=None, limit=100):
+def iter_click_activity(start_date=None, end_date=None, newsletter=None, subscriber_hash=None,
+                        columns="id, subscriber_hash, clicked_headline, newsletter, click_date",
+                        descending=False, page_size=PAGE_SIZE):
     """
-    Fetch click activity from the database, with optional filters.
+    Stream click activity in (click_date, id) order, one page at a time.
 
     Args:
         start_date (str): Start date to filter click activity (YYYY-MM-DD).
         end_date (str): End date to filter click activity (YYYY-MM-DD).
         newsletter (str): Newsletter name or ID to filter results.
-        limit (int): Maximum number of results to fetch.
+        subscriber_hash (str): Only this subscriber's clicks.
+        columns (str): Columns to select. id and click_date are always included.
+        descending (bool): Newest clicks first.
+        page_size (int): Rows per request.
 
-    Returns:
-        list: A list of click activity records, or an empty list on error.
+    Yields:
+        dict: One click activity row at a time.
     """
-    try:
-        query = supabase.table("click_activity").select("id, subscriber_hash, clicked_headline, newsletter, click_date")
-        
+    selected = [c.strip() for c in columns.split(",")]
+    for key in ("click_date", "id"):
+        if key not in selected:
+            columns = f"{key}, {columns}"
+
+    def build_query():
+        query = supabase.table("click_activity").select(columns)
         if start_date:
             query = query.gte("click_date", start_date)
         if end_date:
             query = query.lte("click_date", end_date)
         if newsletter:
             query = query.eq("newsletter", newsletter)
+        if subscriber_hash:
+            query = query.eq("subscriber_hash", subscriber_hash)
+        return query
+
+    yield from _iter_keyset(build_query, ["click_date", "id"], page_size=page_size, descending=descending)
+
+
+def iter_click_activity_since(after_id=0, columns="id, subscriber_hash, clicked_headline, newsletter, click_date",
+                              page_size=PAGE_SIZE):
+    """
+    Stream click activity stored after a known row, in id order.
+
+    Args:
+        after_id (int): Only rows with a larger id.
+        columns (str): Columns to select. id is always included.
+        page_size (int): Rows per request.
+
+    Yields:
+        dict: One click activity row at a time.
+    """
+    if "id" not in [c.strip() for c in columns.split(",")]:
+        columns = f"id, {columns}"
+
+    def build_query():
+        return supabase.table("click_activity").select(columns).gt("id", after_id)
 
-        query = query.order("click_date", desc=True).limit(limit)
-        response = query.execute()
+    yield from _iter_keyset(build_query, ["id"], page_size=page_size)
 
-        # Return data directly if available
-        return response.data if response.data else []
+
+def fetch_click_activity(start_date=None, end_date=None, newsletter=None, limit=100):
+    """
+    Fetch click activity from the database, with optional filters.
+
+    Args:
+        start_date (str): Start date to filter click activity (YYYY-MM-DD).
+        end_date (str): End date to filter click activity (YYYY-MM-DD).
+        newsletter (str): Newsletter name or ID to filter results.
+        limit (int): Maximum number of results to fetch.
+
+    Returns:
+        list: A list of click activity records, newest first, or an empty list on error.
+    """
+    try:
+        clicks = iter_click_activity(
+            start_date=start_date,
+            end_date=end_date,
+            newsletter=newsletter,
+            descending=True,
+            page_size=min(limit, PAGE_SIZE),
+        )
+        return list(islice(clicks, limit))
 
     except Exception as e:
         print(f"An unexpected error occurred while fetching click activity--> {e}")
         return []
     
-def fetch_most_popular_headline(start_date=None, end_date=None):
+def fetch_top_headlines(start_date=None, end_date=None, newsletter=None, limit=10):
     """
-    Fetch the most popular headline based on the number of clicks.
+    Fetch the most clicked headlines for a date range.
+
+    Answered from the headline_daily_clicks rollup (see sql/headline_rollups.sql)
+    through the `top_headlines` function, so click_activity is never scanned.
 
     Args:
         start_date (str): Start date to filter click activity (YYYY-MM-DD).
         end_date (str): End date to filter click activity (YYYY-MM-DD).
+        newsletter (str): Newsletter list ID to filter results.
+        limit (int): Number of headlines to return.
 
     Returns:
-        dict: The most popular headline and its click count, or None on error.
+        list: (headline, clicks) tuples, most clicked first, or an empty list on error.
     """
     try:
-        query = supabase.table("click_activity").select(
-            "clicked_headline, count(clicked_headline) as click_count", count="exact"
-        )
-        
-        if start_date:
-            query = query.gte("click_date", start_date)
-        if end_date:
-            query = query.lte("click_date", end_date)
+        response = supabase.rpc(
+            "top_headlines",
+            {"p_start": start_date, "p_end": end_date, "p_newsletter": newsletter, "p_limit": limit},
+        ).execute()
+        return [(row["clicked_headline"], row["click_count"]) for row in response.data or []]
 
-        query = query.group("clicked_headline").order("click_count", desc=True).limit(1)
-        response = query.execute()
+    except Exception as e:
+        print(f"An unexpected error occurred while fetching the top headlines: {e}")
+        return []
 
-        if response.data and len(response.data) > 0:
-            return response.data[0]
-        else:
-            print("No data found or error occurred:", response.error)
-            return None
 
-    except Exception as e:
-        print(f"An unexpected error occurred while fetching the most popular headline: {e}")
+def fetch_most_popular_headline(start_date=None, end_date=None, newsletter=None):
+    """
+    Fetch the most popular headline based on the number of clicks.
+
+    Args:
+        start_date (str): Start date to filter click activity (YYYY-MM-DD).
+        end_date (str): End date to filter click activity (YYYY-MM-DD).
+        newsletter (str): Newsletter list ID to filter results.
+
+    Returns:
+        dict: The most popular headline and its click count, or None if there are no clicks.
+    """
+    top_headlines = fetch_top_headlines(start_date, end_date, newsletter, limit=1)
+    if top_headlines:
+        headline, clicks = top_headlines[0]
+        return {"clicked_headline": headline, "click_count": clicks}
+    else:
+        print("No headline data found for the given criteria.")
         return None
     
 def get_all_newsletter_names():
     """
     Fetch all newsletters and return a dictionary mapping list_id to name.
 
+    Served from the same cached query as fetch_all_newsletters.
+
     Returns:
         dict: A dictionary where the keys are `list_id` and the values are `name`.
     """
-    response = supabase.table("newsletters").select("list_id, name").execute()
-    if response.data:
-        return {n["list_id"]: n["name"] for n in response.data}
-    else:
-        print("Error fetching newsletters:", response.error)
-        return {}
+    newsletters = fetch_all_newsletters()
+    if not newsletters:
+        print("Error fetching newsletters: none found")
+    return {n["list_id"]: n["name"] for n in newsletters}
     
 def update_total_clicks(subscriber_hash, total_clicks):
     """
@@ -457,7 +917,7 @@ def insert_click_activity(subscriber_hash, clicked_headline, newsletter, click_d
         ).execute()
 
         if response.data:
-            print(f"Click activity inserted: {response.data}")
+            print(f"Click activity inserted for subscriber {subscriber_hash}.")
         else:
             print(f"Error inserting click activity: {response.error}")
 
@@ -465,51 +925,339 @@ def insert_click_activity(subscriber_hash, clicked_headline, newsletter, click_d
         print(f"An error occurred while inserting click activity: {e}")
 
 
+class ClickWriter:
+    """
+    Buffers click_activity rows and writes them as multi-row inserts.
+
+    Rows are flushed when `batch_size` rows are waiting or `flush_interval`
+    seconds have passed since the last flush, and on close(). The interval is
+    checked by add() and flush_if_due(), which callers run between slow steps
+    so rows don't sit in the buffer while no new ones arrive. If a batch
+    insert fails, its rows are retried one at a time so that each failing row
+    is reported individually in `failed_rows`.
 
+    Use it as a context manager so the remaining rows are flushed on exit:
 
-def fetch_subscribers_sorted_by_clicks(list_id, limit=100):
+        with ClickWriter() as writer:
+            writer.add(subscriber_hash, headline, list_id, click_date)
+    """
+
+    def __init__(self, batch_size=500, flush_interval=10.0):
+        """
+        Args:
+            batch_size (int): Number of buffered rows that triggers a flush.
+            flush_interval (float): Seconds after which buffered rows are flushed.
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.inserted_count = 0
+        self.failed_rows = []
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, subscriber_hash, clicked_headline, newsletter, click_date):
+        """
+        Queue a click activity record for insertion.
+
+        Args:
+            subscriber_hash (str): The subscriber's unique hash.
+            clicked_headline (str): The headline of the clicked article.
+            newsletter (str): The newsletter name or list ID.
+            click_date (str): The date of the click in ISO 8601 format.
+        """
+        with self._lock:
+            self._buffer.append(
+                {
+                    "subscriber_hash": subscriber_hash,
+                    "clicked_headline": clicked_headline,
+                    "newsletter": newsletter,
+                    "click_date": click_date,
+                }
+            )
+            due = self._due()
+
+        if due:
+            self.flush()
+
+    def flush_if_due(self):
+        """
+        Flush if buffered rows have waited `flush_interval` seconds.
+
+        Returns:
+            int: The number of rows inserted, 0 if no flush was due.
+        """
+        with self._lock:
+            due = self._due()
+        return self.flush() if due else 0
+
+    def _due(self):
+        # Called with the lock held
+        return len(self._buffer) >= self.batch_size or (
+            bool(self._buffer) and time.monotonic() - self._last_flush >= self.flush_interval
+        )
+
+    def flush(self):
+        """
+        Insert every buffered row.
+
+        Returns:
+            int: The number of rows inserted by this flush.
+        """
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+
+        if not rows:
+            return 0
+
+        inserted, failed = _insert_click_rows(rows)
+
+        with self._lock:
+            self.inserted_count += inserted
+            self.failed_rows.extend(failed)
+
+        print(f"Flushed {inserted} click activity rows ({len(failed)} failed).")
+        return inserted
+
+    def close(self):
+        """
+        Flush any rows still waiting in the buffer.
+        """
+        self.flush()
+
+    def failures_by_subscriber(self):
+        """
+        Count failed rows per subscriber.
+
+        Returns:
+            Counter: Mapping of subscriber hash to number of rows that failed.
+        """
+        with self._lock:
+            return Counter(row["subscriber_hash"] for row, _ in self.failed_rows)
+
+
+def _insert_click_rows(rows):
+    """
+    Insert click_activity rows in one request, falling back to one request
+    per row if the batch is rejected.
+
+    Args:
+        rows (list): click_activity row dictionaries.
+
+    Returns:
+        tuple: (number inserted, list of (row, error) pairs that failed).
+    """
+    # A multi-row INSERT is a single statement, so it either stores every row or none
+    try:
+        supabase.table("click_activity").insert(rows).execute()
+        return len(rows), []
+    except Exception as e:
+        print(f"Batch insert of {len(rows)} click rows failed, retrying individually: {e}")
+
+    inserted = 0
+    failed = []
+    for row in rows:
+        try:
+            response = supabase.table("click_activity").insert(row).execute()
+            if response.data:
+                inserted += 1
+            else:
+                failed.append((row, "No data returned"))
+        except Exception as e:
+            print(f"Error inserting click activity for subscriber {row['subscriber_hash']}: {e}")
+            failed.append((row, str(e)))
+    return inserted, failed
+
+
+
+
+def fetch_subscribers_sorted_by_clicks(list_id, limit=None):
     """
     Fetch subscribers for a specific newsletter, sorted by total_clicks in descending order.
 
+    The list is read page by page, so lists larger than the PostgREST row cap
+    come back complete.
+
     Args:
         list_id (str): The newsletter list ID.
-        limit (int): The maximum number of subscribers to fetch.
+        limit (int, optional): The maximum number of subscribers to return. All by default.
 
     Returns:
         list: A list of subscribers sorted by total_clicks.
     """
     try:
-        response = supabase.table("subscribers").select(
-            "subscriber_hash, total_clicks"
-        ).filter("list_id", "cs", f"{{{list_id}}}").execute()
-        
-        if response.data:
-            return response.data
-        else:
+        subscribers = list(iter_subscribers("subscriber_hash, total_clicks", list_id=list_id))
+        if not subscribers:
             print(f"No data returned for list {list_id}.")
             return []
+
+        subscribers.sort(key=lambda s: s.get("total_clicks") or 0, reverse=True)
+        return subscribers[:limit] if limit else subscribers
     except Exception as e:
         print(f"An unexpected error occurred while fetching subscribers: {e}")
         return []
     
 
-def fetch_existing_clicks(subscriber_hash):
+def fetch_existing_clicks(subscriber_hash, headlines=None):
     """
     Fetch all existing clicked slugs for a subscriber.
 
     Args:
         subscriber_hash (str): The unique hash of the subscriber.
+        headlines (iterable, optional): Only check these slugs/headlines instead
+            of loading the subscriber's whole click history.
 
     Returns:
         set: A set of slugs that have already been clicked by the subscriber.
     """
     print("Fetching existing clicks")
     try:
-        response = supabase.table("click_activity").select("clicked_headline").eq("subscriber_hash", subscriber_hash).execute()
-        if response.data:
-            return {row["clicked_headline"] for row in response.data}
-        else:
-            return set()
+        if headlines is not None:
+            headlines = list(headlines)
+            if not headlines:
+                return set()
+
+        def build_query():
+            query = supabase.table("click_activity").select("id, clicked_headline").eq("subscriber_hash", subscriber_hash)
+            if headlines is not None:
+                query = query.in_("clicked_headline", headlines)
+            return query
+
+        return {row["clicked_headline"] for row in _iter_keyset(build_query, ["id"])}
     except Exception as e:
         print(f"Error fetching existing clicks for Subscriber {subscriber_hash}: {e}")
         return set()
+
+
+
+def fetch_click_profiles(subscriber_hashes, chunk_size=200, with_dates=False):
+    """
+    Fetch the clicked headlines of many subscribers at once.
+
+    Args:
+        subscriber_hashes (iterable): The subscribers to fetch.
+        chunk_size (int): Subscribers per query; keeps the request URL short.
+        with_dates (bool): Also return when each headline was last clicked.
+
+    Returns:
+        dict: Subscriber hash -> set of clicked headlines, or with_dates a
+        dict of headline -> latest click_date. Subscribers with no clicks
+        are left out.
+    """
+    subscriber_hashes = list(dict.fromkeys(subscriber_hashes))
+    profiles = defaultdict(dict)
+    columns = "id, subscriber_hash, clicked_headline" + (", click_date" if with_dates else "")
+
+    for i in range(0, len(subscriber_hashes), chunk_size):
+        chunk = subscriber_hashes[i : i + chunk_size]
+
+        def build_query():
+            return supabase.table("click_activity").select(columns).in_("subscriber_hash", chunk)
+
+        try:
+            for row in _iter_keyset(build_query, ["id"]):
+                clicks = profiles[row["subscriber_hash"]]
+                click_date = row.get("click_date")
+                previous = clicks.get(row["clicked_headline"])
+                if previous is None or (click_date and click_date > previous):
+                    clicks[row["clicked_headline"]] = click_date
+        except Exception as e:
+            print(f"Error fetching click profiles for {len(chunk)} subscribers: {e}")
+
+    if with_dates:
+        return dict(profiles)
+    return {subscriber_hash: set(clicks) for subscriber_hash, clicks in profiles.items()}
+
+
+def fetch_headline_clickers(headlines, page_size=PAGE_SIZE):
+    """
+    Fetch the subscribers who already have a click stored for any of the given headlines.
+
+    Args:
+        headlines (iterable): Headline variants (raw, cleaned or slug) of one story.
+        page_size (int): Rows fetched per request.
+
+    Returns:
+        set: Subscriber hashes with a matching click_activity row, or None if
+        the lookup failed.
+    """
+    headlines = [headline for headline in set(headlines) if headline]
+    clickers = set()
+    if not headlines:
+        return clickers
+
+    def build_query():
+        return supabase.table("click_activity").select("id, subscriber_hash").in_("clicked_headline", headlines)
+
+    try:
+        for row in _iter_keyset(build_query, ["id"], page_size=page_size):
+            clickers.add(row["subscriber_hash"])
+        return clickers
+    except Exception as e:
+        print(f"Error fetching existing clickers for headline {headlines[0]}: {e}")
+        return None
+
+"""
+     <-----------------------------------   CLICK WATERMARKS ------------------------------------>
+
+"""
+
+
+def fetch_click_watermarks(list_id, page_size=PAGE_SIZE):
+    """
+    Fetch the click sync watermark of every subscriber on a list.
+
+    Args:
+        list_id (str): The newsletter list ID.
+        page_size (int): Rows fetched per request.
+
+    Returns:
+        dict: Mapping of subscriber hash to its watermark row
+        (last_click_date, avg_click_rate, synced_at).
+    """
+    watermarks = {}
+
+    def build_query():
+        return supabase.table("click_watermarks").select(
+            "subscriber_hash, last_click_date, avg_click_rate, synced_at"
+        ).eq("list_id", list_id)
+
+    try:
+        for row in _iter_keyset(build_query, ["subscriber_hash"], page_size=page_size):
+            watermarks[row["subscriber_hash"]] = row
+        return watermarks
+    except Exception as e:
+        print(f"An error occurred while fetching click watermarks for list {list_id}: {e}")
+        return watermarks
+
+
+def upsert_click_watermarks(watermarks, batch_size=500):
+    """
+    Save click sync watermarks.
+
+    Args:
+        watermarks (list): Rows with subscriber_hash, list_id, last_click_date,
+            avg_click_rate and synced_at.
+        batch_size (int): Rows written per request.
+
+    Returns:
+        bool: True if every batch was saved, False otherwise.
+    """
+    success = True
+    for i in range(0, len(watermarks), batch_size):
+        batch = watermarks[i : i + batch_size]
+        try:
+            supabase.table("click_watermarks").upsert(batch, on_conflict="subscriber_hash,list_id").execute()
+        except Exception as e:
+            print(f"Error saving click watermarks in batch {i // batch_size + 1}: {e}")
+            success = False
+
+    print(f"Saved {len(watermarks)} click watermarks.")
+    return success
@@ -0,0 +1,249 @@
+'''
+email_cache.py
+Caches generated emails by the content of the request that produced them
+- the key is a hash of the model, temperature, completion limit, API root and
+  the exact messages sent (system prompt plus the ranked click list from prompt_builder)
+- email_generator and batch_email send the same model, temperature and completion
+  limit, so a draft written by either is reused by the other
+- only complete replies from the default OpenAI endpoint should be stored
+- stored in SQLite so drafts survive Streamlit reruns and restarts
+- entries expire after MAX_AGE_SECONDS; the least recently used are evicted past MAX_ENTRIES
+
+'''
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = "temp/email_cache.sqlite3"
+MAX_ENTRIES = 10000                    # Drafts kept on disk
+MAX_AGE_SECONDS = 30 * 24 * 60 * 60    # Regenerate drafts after a month
+
+
+def fingerprint(model, temperature, messages, max_tokens=None, base_url=None):
+    """
+    Content address of a chat completion request.
+
+    Args:
+        model (str): Chat model.
+        temperature (float): Sampling temperature.
+        messages (list): Chat messages, system prompt included.
+        max_tokens (int, optional): Completion limit, None for the model's own.
+        base_url (str, optional): API root, None for OpenAI's.
+
+    Returns:
+        str: Hex SHA-256 of the request.
+    """
+    payload = json.dumps(
+        {
+            "model": model,
+            "temperature": temperature,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "base_url": base_url,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class EmailCache:
+    """
+    SQLite cache of fingerprint -> generated email.
+
+    Only complete completions (finish_reason "stop") from the default API
+    root should be stored. Every hit refreshes the
+    entry's last use, which decides what is evicted once the cache is full.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES, max_age=MAX_AGE_SECONDS):
+        """
+        Args:
+            path (str): Location of the SQLite file.
+            max_entries (int): Maximum number of cached emails.
+            max_age (int): Seconds before a cached email expires.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = None
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "bypassed": 0}
+        self._open_store()
+
+    def _open_store(self):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS emails (
+                    fingerprint TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    email TEXT NOT NULL,
+                    prompt_tokens INTEGER,
+                    completion_tokens INTEGER,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS emails_last_used ON emails (last_used)")
+            self._conn.commit()
+        except sqlite3.Error as e:
+            print(f"Email cache unavailable, every email will be generated: {e}")
+            self._conn = None
+
+    def lookup(self, key):
+        """
+        Look up a cached email.
+
+        Args:
+            key (str): A fingerprint().
+
+        Returns:
+            dict: The cached `email`, `model`, token counts and `created_at`, or None.
+        """
+        if self._conn is None:
+            return None
+
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT email, model, prompt_tokens, completion_tokens, created_at FROM emails WHERE fingerprint = ?",
+                    (key,),
+                ).fetchone()
+                if row and now - row[4] > self.max_age:
+                    self._conn.execute("DELETE FROM emails WHERE fingerprint = ?", (key,))
+                    self._conn.commit()
+                    self.stats["evictions"] += 1
+                    row = None
+                if row is None:
+                    self.stats["misses"] += 1
+                    return None
+
+                self._conn.execute("UPDATE emails SET last_used = ? WHERE fingerprint = ?", (now, key))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"Error reading email cache: {e}")
+                self.stats["misses"] += 1
+                return None
+
+            self.stats["hits"] += 1
+        email, model, prompt_tokens, completion_tokens, created_at = row
+        return {
+            "email": email,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "created_at": created_at,
+        }
+
+    def store(self, key, model, email, prompt_tokens=None, completion_tokens=None):
+        """
+        Cache a generated email, evicting the least recently used past max_entries.
+
+        Args:
+            key (str): A fingerprint().
+            model (str): The model that wrote the email.
+            email (str): The generated email.
+            prompt_tokens (int, optional): Usage reported for the request.
+            completion_tokens (int, optional): Usage reported for the request.
+        """
+        if self._conn is None:
+            return
+
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO emails
+                        (fingerprint, model, email, prompt_tokens, completion_tokens, created_at, last_used)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (key, model, email, prompt_tokens, completion_tokens, now, now),
+                )
+                evicted = self._conn.execute(
+                    """
+                    DELETE FROM emails WHERE fingerprint IN (
+                        SELECT fingerprint FROM emails ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,),
+                ).rowcount
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"Error writing email cache: {e}")
+                return
+            self.stats["stores"] += 1
+            self.stats["evictions"] += evicted
+
+    def record_bypass(self):
+        """Count a request that skipped the cache on purpose."""
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def purge_expired(self):
+        """
+        Delete expired entries.
+
+        Returns:
+            int: The number of entries deleted.
+        """
+        if self._conn is None:
+            return 0
+
+        with self._lock:
+            try:
+                cursor = self._conn.execute("DELETE FROM emails WHERE created_at < ?", (time.time() - self.max_age,))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"Error purging email cache: {e}")
+                return 0
+            self.stats["evictions"] += cursor.rowcount
+            return cursor.rowcount
+
+    def clear(self):
+        """
+        Drop every cached email and reset the counters.
+        """
+        with self._lock:
+            for name in self.stats:
+                self.stats[name] = 0
+            if self._conn is not None:
+                try:
+                    self._conn.execute("DELETE FROM emails")
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    print(f"Error clearing email cache: {e}")
+
+    def get_stats(self):
+        """
+        Return a snapshot of the counters.
+
+        Returns:
+            dict: Counters plus the number of cached emails and the hit rate.
+        """
+        size = 0
+        with self._lock:
+            stats = dict(self.stats)
+            if self._conn is not None:
+                try:
+                    size = self._conn.execute("SELECT COUNT(*) FROM emails").fetchone()[0]
+                except sqlite3.Error:
+                    pass
+        stats["size"] = size
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+# Shared cache used by email_generator and batch_email
+email_cache = EmailCache()
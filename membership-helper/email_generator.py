@@ -2,6 +2,8 @@ import openai
 import streamlit as st
 import os
 from prompts import test_gen_funraising as msg
+from email_cache import email_cache, fingerprint
+import prompt_builder
 # Retrieve the OpenAI API key from Streamlit secrets
 os.environ['OPENAI_API_KEY'] = st.secrets["OPEN_AI_KEY"]
  
@@ -26,25 +28,87 @@ message_content = """You are an email fundraiser for a nonprofit news organizati
                     
                   """
 
-def generate_email(subscriber_clicks):
-  
-    
+MODEL = "gpt-4o"
+TEMPERATURE = 0
+MAX_COMPLETION_TOKENS = 400  # The brief asks for at most 180 words; batch_email uses the same limit
 
-    try:
-        # Format input for ChatGPT
-        prompt = f"Generate a personalized fundraising email based on these topics.  {', '.join(subscriber_clicks)}"
 
+def build_messages(subscriber_clicks, token_budget=prompt_builder.PROMPT_TOKEN_BUDGET):
+    """
+    Build the chat messages asking for one subscriber's fundraising email.
+
+    Only the most recent and recurring clicks that fit the token budget are
+    included, see prompt_builder.
+
+    Args:
+        subscriber_clicks (iterable or dict): Headlines or slugs the subscriber
+            clicked, or a dict of headline -> click_date.
+        token_budget (int): Estimated tokens of headlines to include.
+
+    Returns:
+        list: Chat completion messages.
+    """
+    return prompt_builder.build_messages(subscriber_clicks, msg.brief, token_budget)  #import from prompts/test_gen_funraising.py
+
+
+def prepare_request(subscriber_clicks):
+    """
+    Build the messages for a click set and their cache fingerprint.
+
+    Args:
+        subscriber_clicks (iterable or dict): See build_messages.
+
+    Returns:
+        tuple: (fingerprint, messages)
+    """
+    messages = build_messages(subscriber_clicks)
+    return fingerprint(MODEL, TEMPERATURE, messages, MAX_COMPLETION_TOKENS), messages
+
+
+def generate_email(subscriber_clicks, use_cache=True):
+    """
+    Generate a fundraising email for one subscriber's clicks.
+
+    An email generated earlier for the same click set, prompt and model is
+    returned from email_cache without calling OpenAI.
+
+    Args:
+        subscriber_clicks (iterable or dict): See build_messages.
+        use_cache (bool): Set to False to always call OpenAI; the new email
+            still replaces the cached one.
+
+    Returns:
+        str: The email, or an error message if generation failed.
+    """
+    key, messages = prepare_request(subscriber_clicks)
+    if use_cache:
+        cached = email_cache.lookup(key)
+        if cached:
+            return cached["email"]
+    else:
+        email_cache.record_bypass()
+
+    try:
         response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": msg.brief},  #import from prompts/test_gen_funraising.py
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0,
-             
+            model=MODEL,
+            messages=messages,
+            temperature=TEMPERATURE,
+            max_tokens=MAX_COMPLETION_TOKENS,
         )
-        print(response.choices[0].message.content)
-        return response.choices[0].message.content
+        choice = response.choices[0]
+        email = choice.message.content
+        print(email)
+        usage = response.usage
+        # A reply cut off by the length limit or a content filter is shown but not reused
+        if choice.finish_reason == "stop":
+            email_cache.store(
+                key,
+                MODEL,
+                email,
+                prompt_tokens=usage.prompt_tokens if usage else None,
+                completion_tokens=usage.completion_tokens if usage else None,
+            )
+        return email
     except Exception as e:
         print(f"Error generating email: {e}")
         return "Failed to generate email. Please try again."
\ No newline at end of file
@@ -0,0 +1,238 @@
+'''
+headline_cache.py
+Caches WordPress slug -> headline lookups
+- in-process LRU for the current run
+- SQLite store so entries survive Streamlit reruns and restarts
+- negative caching for slugs WordPress doesn't know about
+- expired rows are purged on open and the store is capped at MAX_STORED_ENTRIES
+
+'''
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_PATH = "temp/headline_cache.sqlite3"
+MAX_ENTRIES = 5000                 # In-memory LRU size
+MAX_STORED_ENTRIES = 100000        # SQLite rows kept; the oldest fetched are dropped past this
+TTL_SECONDS = 7 * 24 * 60 * 60     # Re-fetch headlines after a week in case they were edited
+NEGATIVE_TTL_SECONDS = 60 * 60     # Retry unknown slugs after an hour
+
+# Stored in place of a headline when WordPress returned no post for the slug
+_MISSING = None
+
+
+class HeadlineCache:
+    """
+    Two-level cache of (site, slug) -> headline.
+
+    Lookups check the in-memory LRU first and fall back to SQLite. Slugs that
+    WordPress has no post for are cached as missing so they are not requested
+    again on every click.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES,
+                 ttl=TTL_SECONDS, negative_ttl=NEGATIVE_TTL_SECONDS, max_stored_entries=MAX_STORED_ENTRIES):
+        """
+        Args:
+            path (str): Location of the SQLite file, or None for memory only.
+            max_entries (int): Maximum number of entries kept in memory.
+            max_stored_entries (int): Maximum number of rows kept in SQLite.
+            ttl (int): Seconds before a cached headline expires.
+            negative_ttl (int): Seconds before a missing slug is looked up again.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_stored_entries = max_stored_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self.stats = {"hits": 0, "negative_hits": 0, "misses": 0, "evictions": 0, "stores": 0}
+
+        if path:
+            self._open_store()
+            self.purge_expired()
+
+    def _open_store(self):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS headlines (
+                    site TEXT NOT NULL,
+                    slug TEXT NOT NULL,
+                    headline TEXT,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (site, slug)
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS headlines_fetched_at_idx ON headlines (fetched_at)")
+            self._conn.commit()
+        except sqlite3.Error as e:
+            print(f"Headline cache store unavailable, using memory only: {e}")
+            self._conn = None
+
+    def _expired(self, headline, fetched_at, now):
+        ttl = self.ttl if headline is not _MISSING else self.negative_ttl
+        return now - fetched_at > ttl
+
+    def _remember(self, key, headline, fetched_at):
+        self._memory[key] = (headline, fetched_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def lookup(self, site, slug):
+        """
+        Look up a slug in the cache.
+
+        Args:
+            site (str): The WordPress site URL.
+            slug (str): The post slug.
+
+        Returns:
+            tuple: (found, headline). `found` is False on a miss; a found entry
+            with a None headline means WordPress has no post for the slug.
+        """
+        key = (site, slug)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None and self._conn is not None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT headline, fetched_at FROM headlines WHERE site = ? AND slug = ?",
+                        key,
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    print(f"Error reading headline cache for slug {slug}: {e}")
+                    row = None
+                if row:
+                    entry = (row[0], row[1])
+
+            if entry is None or self._expired(entry[0], entry[1], now):
+                self._memory.pop(key, None)
+                self.stats["misses"] += 1
+                return False, None
+
+            self._remember(key, entry[0], entry[1])
+            if entry[0] is _MISSING:
+                self.stats["negative_hits"] += 1
+            else:
+                self.stats["hits"] += 1
+            return True, entry[0]
+
+    def store(self, site, slug, headline):
+        """
+        Store a headline, or None to record that the slug has no post.
+
+        Args:
+            site (str): The WordPress site URL.
+            slug (str): The post slug.
+            headline (str): The rendered post title, or None.
+        """
+        self.store_many(site, {slug: headline})
+
+    def store_many(self, site, headlines):
+        """
+        Store several slug -> headline results for a site in one transaction.
+
+        Args:
+            site (str): The WordPress site URL.
+            headlines (dict): Mapping of slug to headline (or None when missing).
+        """
+        if not headlines:
+            return
+
+        now = time.time()
+        with self._lock:
+            for slug, headline in headlines.items():
+                self._remember((site, slug), headline, now)
+            self.stats["stores"] += len(headlines)
+
+            if self._conn is not None:
+                try:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO headlines (site, slug, headline, fetched_at) VALUES (?, ?, ?, ?)",
+                        [(site, slug, headline, now) for slug, headline in headlines.items()],
+                    )
+                    self._conn.execute(
+                        """
+                        DELETE FROM headlines WHERE rowid IN (
+                            SELECT rowid FROM headlines ORDER BY fetched_at DESC LIMIT -1 OFFSET ?
+                        )
+                        """,
+                        (self.max_stored_entries,),
+                    )
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    print(f"Error writing headline cache for {site}: {e}")
+
+    def purge_expired(self):
+        """
+        Delete expired rows from the SQLite store.
+
+        Returns:
+            int: The number of rows deleted.
+        """
+        if self._conn is None:
+            return 0
+
+        now = time.time()
+        with self._lock:
+            try:
+                cursor = self._conn.execute(
+                    """
+                    DELETE FROM headlines
+                    WHERE (headline IS NOT NULL AND fetched_at < ?)
+                       OR (headline IS NULL AND fetched_at < ?)
+                    """,
+                    (now - self.ttl, now - self.negative_ttl),
+                )
+                self._conn.commit()
+                return cursor.rowcount
+            except sqlite3.Error as e:
+                print(f"Error purging headline cache: {e}")
+                return 0
+
+    def clear(self):
+        """
+        Drop every cached entry, in memory and on disk, and reset the counters.
+        """
+        with self._lock:
+            self._memory.clear()
+            for name in self.stats:
+                self.stats[name] = 0
+            if self._conn is not None:
+                try:
+                    self._conn.execute("DELETE FROM headlines")
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    print(f"Error clearing headline cache: {e}")
+
+    def get_stats(self):
+        """
+        Return a snapshot of the hit/miss counters.
+
+        Returns:
+            dict: Counters plus the current in-memory size and hit rate.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self._memory)
+        lookups = stats["hits"] + stats["negative_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["negative_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+# Shared cache used by utils.get_post_details
+headline_cache = HeadlineCache()
@@ -0,0 +1,348 @@
+'''
+jobs.py
+Durable queue for long-running syncs
+- jobs are stored in SQLite so they survive Streamlit reruns and restarts
+- one active job per kind and list_id; enqueueing a duplicate returns the existing job
+- at most one running job per list_id (jobs for "*" lock every list)
+- workers (worker.py) claim jobs, report progress and heartbeat while running
+
+'''
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime, timezone
+
+JOBS_PATH = "temp/jobs.sqlite3"
+ALL_LISTS = "*"           # list_id of jobs that touch every list
+STALE_AFTER = 120         # Seconds without a heartbeat before a running job is assumed dead
+MAX_ATTEMPTS = 3          # Claims of one job before it is failed instead of requeued
+PROGRESS_INTERVAL = 1.0   # Minimum seconds between progress writes
+
+ACTIVE_STATUSES = ("queued", "running")
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job when cancellation was requested."""
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue shared by the Streamlit pages and the workers.
+
+    Every method opens its own connection, so one JobQueue can be used from
+    any thread or process.
+    """
+
+    def __init__(self, path=JOBS_PATH):
+        """
+        Args:
+            path (str): Location of the SQLite file.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    list_id TEXT NOT NULL,
+                    params TEXT NOT NULL DEFAULT '{}',
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    stage TEXT,
+                    progress_done INTEGER NOT NULL DEFAULT 0,
+                    progress_total INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    heartbeat_at REAL,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_list ON jobs (list_id, id)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _row(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"] or "{}")
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def enqueue(self, kind, list_id, params=None):
+        """
+        Queue a job unless the same kind of job is already queued or running for the list.
+
+        Args:
+            kind (str): Handler name, see worker.HANDLERS.
+            list_id (str): The list the job works on, or ALL_LISTS.
+            params (dict, optional): JSON-serialisable handler arguments.
+
+        Returns:
+            tuple: (job, created) where job is the new or already active job
+            and created is False if an active duplicate was returned.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            existing = conn.execute(
+                "SELECT * FROM jobs WHERE kind = ? AND list_id = ? AND status IN (?, ?) ORDER BY id LIMIT 1",
+                (kind, list_id, *ACTIVE_STATUSES),
+            ).fetchone()
+            if existing:
+                conn.execute("COMMIT")
+                return self._row(existing), False
+
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, list_id, params, created_at) VALUES (?, ?, ?, ?)",
+                (kind, list_id, json.dumps(params or {}), _now()),
+            )
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (cursor.lastrowid,)).fetchone()
+            conn.execute("COMMIT")
+            return self._row(job), True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def claim(self, worker):
+        """
+        Claim the oldest queued job whose list has no running job.
+
+        Running jobs whose worker stopped heartbeating are requeued (or failed
+        after MAX_ATTEMPTS) first.
+
+        Args:
+            worker (str): Name of the claiming worker.
+
+        Returns:
+            dict: The claimed job, now running, or None if nothing can run.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._recover_stale(conn)
+            row = conn.execute(
+                """
+                SELECT * FROM jobs AS j
+                WHERE j.status = 'queued'
+                  AND NOT EXISTS (
+                      SELECT 1 FROM jobs AS r
+                      WHERE r.status = 'running'
+                        AND (r.list_id = j.list_id OR r.list_id = ? OR j.list_id = ?)
+                  )
+                ORDER BY j.id
+                LIMIT 1
+                """,
+                (ALL_LISTS, ALL_LISTS),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            conn.execute(
+                """
+                UPDATE jobs
+                SET status = 'running', worker = ?, attempts = attempts + 1,
+                    heartbeat_at = ?, started_at = ?, error = NULL
+                WHERE id = ?
+                """,
+                (worker, time.time(), _now(), row["id"]),
+            )
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+            return self._row(job)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _recover_stale(self, conn):
+        cutoff = time.time() - STALE_AFTER
+        conn.execute(
+            """
+            UPDATE jobs
+            SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                error = 'Worker stopped responding',
+                finished_at = CASE WHEN attempts >= ? THEN ? ELSE NULL END,
+                worker = NULL
+            WHERE status = 'running' AND heartbeat_at < ?
+            """,
+            (MAX_ATTEMPTS, MAX_ATTEMPTS, _now(), cutoff),
+        )
+
+    def heartbeat(self, job_id):
+        """
+        Record that a running job's worker is alive.
+
+        Returns:
+            bool: True if cancellation of the job was requested.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id))
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def update_progress(self, job_id, done, total, stage=None):
+        """
+        Record a running job's progress; also counts as a heartbeat.
+
+        Raises:
+            JobCancelled: Cancellation of the job was requested.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute(
+                """
+                UPDATE jobs
+                SET progress_done = ?, progress_total = ?, stage = COALESCE(?, stage), heartbeat_at = ?
+                WHERE id = ?
+                """,
+                (done, total, stage, time.time(), job_id),
+            )
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row and row["cancel_requested"]:
+            raise JobCancelled(f"Job {job_id} was cancelled")
+
+    def finish(self, job_id, status, result=None, error=None):
+        """
+        Mark a job as succeeded, failed or cancelled.
+
+        Args:
+            job_id (int): The job.
+            status (str): One of FINISHED_STATUSES.
+            result (dict, optional): JSON-serialisable handler result.
+            error (str, optional): Why the job failed.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, heartbeat_at = NULL WHERE id = ?",
+                (status, json.dumps(result, default=str) if result is not None else None, error, _now(), job_id),
+            )
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued job, or ask the worker running it to stop.
+
+        Returns:
+            bool: True if the job was active.
+        """
+        with closing(self._connect()) as conn:
+            queued = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (_now(), job_id),
+            ).rowcount
+            running = conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,)
+            ).rowcount
+        return bool(queued or running)
+
+    def get(self, job_id):
+        """Fetch one job, or None."""
+        with closing(self._connect()) as conn:
+            return self._row(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def last_finished(self, kinds):
+        """
+        When a job of any of `kinds` last finished, however it ended.
+
+        Args:
+            kinds (iterable): Job kinds.
+
+        Returns:
+            str: ISO timestamp, or None if none has finished.
+        """
+        kinds = list(kinds)
+        if not kinds:
+            return None
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                f"SELECT max(finished_at) FROM jobs WHERE kind IN ({', '.join('?' * len(kinds))})",
+                kinds,
+            ).fetchone()[0]
+
+    def recent(self, kind=None, list_id=None, limit=10):
+        """
+        Fetch the most recent jobs, newest first.
+
+        Args:
+            kind (str, optional): Only jobs of this kind.
+            list_id (str, optional): Only jobs for this list.
+            limit (int): Maximum number of jobs.
+
+        Returns:
+            list: Job dictionaries.
+        """
+        query = "SELECT * FROM jobs WHERE 1 = 1"
+        args = []
+        if kind:
+            query += " AND kind = ?"
+            args.append(kind)
+        if list_id:
+            query += " AND list_id = ?"
+            args.append(list_id)
+        query += " ORDER BY id DESC LIMIT ?"
+        args.append(limit)
+
+        with closing(self._connect()) as conn:
+            return [self._row(row) for row in conn.execute(query, args).fetchall()]
+
+
+class JobContext:
+    """
+    Handed to a job handler: its parameters plus a throttled progress reporter.
+    """
+
+    def __init__(self, queue, job):
+        self.queue = queue
+        self.job = job
+        self.params = job["params"]
+        self._last_write = 0.0
+
+    def progress(self, done, total, stage=None):
+        """
+        Report progress. Writes are throttled to one per PROGRESS_INTERVAL,
+        except the final one.
+
+        Raises:
+            JobCancelled: Cancellation of the job was requested.
+        """
+        now = time.monotonic()
+        if done < total and now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._last_write = now
+        self.queue.update_progress(self.job["id"], done, total, stage)
+
+
+def worker_name():
+    """Name identifying this worker process in the jobs table."""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+job_queue = JobQueue()
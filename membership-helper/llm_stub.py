@@ -0,0 +1,148 @@
+"""
+Local stand-in for OpenAI's chat completions endpoint, for exercising
+batch_email offline.
+
+    python llm_stub.py
+
+starts the stub, runs a small batch through generate_emails_async and prints
+the summary. Use start_stub() to run it from your own scripts.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class CompletionStub:
+    """
+    Answers chat completions with a canned email and a usage block.
+
+    Responses are delayed by `latency` seconds (plus up to `jitter`), a
+    `failure_rate` fraction of requests fail with a 500 and every
+    `rate_limit_every`th request gets a 429 with a Retry-After header.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.1, failure_rate=0.0, rate_limit_every=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rate_limit_every = rate_limit_every
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def complete(self, payload):
+        """
+        Build the response to one request.
+
+        Returns:
+            tuple: (status, body, headers)
+        """
+        with self._lock:
+            self.requests += 1
+            number = self.requests
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+            if self.rate_limit_every and number % self.rate_limit_every == 0:
+                return 429, {"error": {"message": "Rate limit reached", "type": "requests"}}, {"Retry-After": "0.1"}
+            if random.random() < self.failure_rate:
+                return 500, {"error": {"message": "The server had an error", "type": "server_error"}}, {}
+
+            messages = payload.get("messages", [])
+            topics = messages[-1]["content"] if messages else ""
+            content = f"Your support keeps local reporting going. Stories like these depend on members: {topics[-200:]}"
+            prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+            completion_tokens = len(content) // 4
+            return 200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "stub"),
+                "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }, {}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def _handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def _send(self, status, body, headers=None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(*stub.complete(payload))
+            else:
+                self._send(404, {"error": {"message": "Not found"}})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_stub(host="127.0.0.1", port=0, **kwargs):
+    """
+    Start the stub server on a background thread.
+
+    Args:
+        host (str): Interface to bind.
+        port (int): Port to bind, or 0 for any free port.
+        **kwargs: Passed to CompletionStub.
+
+    Returns:
+        tuple: (server, base_url) where base_url can be passed as `base_url`
+        to the batch_email functions. server.stub holds the request counters.
+        Call server.shutdown() when done.
+    """
+    stub = CompletionStub(**kwargs)
+    server = ThreadingHTTPServer((host, port), _handler(stub))
+    server.stub = stub
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    import asyncio
+    from batch_email import generate_emails_async
+
+    server, base_url = start_stub(latency=0.2, failure_rate=0.02, rate_limit_every=25)
+    profiles = {
+        uuid.uuid4().hex: {f"Sample headline {n}" for n in random.sample(range(100), 5)}
+        for _ in range(100)
+    }
+    try:
+        summary = asyncio.run(
+            generate_emails_async(profiles, "temp/stub_emails.ndjson", concurrency=10, tokens_per_minute=1_000_000,
+                                  base_url=base_url, api_key="stub")
+        )
+        print(summary)
+        print(f"Stub served {server.stub.requests} requests, at most {server.stub.max_in_flight} at once.")
+    finally:
+        server.shutdown()
@@ -0,0 +1,445 @@
+'''
+mirror.py
+Local columnar mirror of click_activity and subscribers for exploration
+- clicks are stored as Parquet partitioned by month of click_date
+  (temp/mirror/click_activity/click_month=YYYY-MM/part_<last id>_<n>.parquet)
+- each refresh appends only the rows whose id is above the stored watermark,
+  then merges months that have collected many small parts
+- ids are assigned at insert, not commit, so the last REFRESH_OVERLAP ids are
+  read again and any that weren't committed last time are added
+- subscribers are small and change in place, so they are rewritten whole
+- queries run on an embedded DuckDB engine and never touch Supabase
+
+    python mirror.py             incremental refresh
+    python mirror.py --rebuild   drop the mirror and copy everything again
+
+'''
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from contextlib import closing
+from datetime import datetime, timezone
+import duckdb
+import pandas as pd
+from db import iter_click_activity_since, iter_subscribers
+
+MIRROR_DIR = "temp/mirror"
+REFRESH_CHUNK = 50000   # Clicks per write; each write adds one Parquet part per month touched
+MAX_PARTS = 8           # Parts in a month before the refresh merges them into one
+REFRESH_OVERLAP = 20000 # Ids below the watermark read again, for inserts that committed late
+JOB_KEY = "mirror"      # list_id of mirror_refresh jobs: they queue behind each other and all-list jobs, not list syncs
+
+CLICK_COLUMNS = "id, subscriber_hash, clicked_headline, newsletter, click_date"
+SUBSCRIBER_COLUMNS = "subscriber_hash, list_id, status, total_clicks, created_at"
+
+_PART = re.compile(r"^part_(\d+)_\d+\.parquet$")
+
+# Stands in for the views while the mirror is still empty
+_EMPTY_CLICKS = (
+    "SELECT NULL::BIGINT AS id, NULL::VARCHAR AS subscriber_hash, NULL::VARCHAR AS clicked_headline, "
+    "NULL::VARCHAR AS newsletter, NULL::TIMESTAMP AS click_date, NULL::VARCHAR AS click_month WHERE false"
+)
+_EMPTY_SUBSCRIBERS = (
+    "SELECT NULL::VARCHAR AS subscriber_hash, NULL::VARCHAR[] AS list_id, NULL::VARCHAR AS status, "
+    "NULL::INTEGER AS total_clicks, NULL::TIMESTAMP AS created_at WHERE false"
+)
+
+
+def _sql_path(path):
+    return path.replace("\\", "/").replace("'", "''")
+
+
+def _utc(values):
+    # Stored as naive UTC so DuckDB's date functions need no time zone support
+    return pd.to_datetime(values, utc=True, format="ISO8601").dt.tz_convert(None)
+
+
+class ClickMirror:
+    """
+    The Parquet mirror on disk and the DuckDB queries over it.
+
+    state.json lists the live click parts, and readers only open the files it
+    lists. Parts are written to a staging directory, moved into place, and
+    only then added to the list with an atomic replace of state.json, so a
+    reader sees either the old set of files or the new one, never both and
+    never a half-written file. Files that are no longer listed (merged away,
+    or left by a refresh that died) are deleted at the start of the next
+    refresh, after every reader of the old list has finished.
+    """
+
+    def __init__(self, path=MIRROR_DIR):
+        """
+        Args:
+            path (str): Directory holding the mirror.
+        """
+        self.path = path
+        self.clicks_dir = os.path.join(path, "click_activity")
+        self.subscribers_path = os.path.join(path, "subscribers.parquet")
+        self.state_path = os.path.join(path, "state.json")
+        self.staging_dir = os.path.join(path, "_staging")
+
+    def state(self):
+        """
+        The mirror's watermark and bookkeeping.
+
+        Returns:
+            dict: `last_id` (highest mirrored click id), `clicks`, `subscribers`,
+            `refreshed_at` and `parts` (live click files, relative to the
+            click_activity directory).
+        """
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"last_id": 0, "clicks": 0, "subscribers": 0, "refreshed_at": None, "parts": []}
+        if "parts" not in state:
+            # Mirrors written before the parts list: every part up to the watermark is live
+            state["parts"] = sorted(
+                os.path.relpath(os.path.join(dirpath, f), self.clicks_dir)
+                for dirpath, _, filenames in os.walk(self.clicks_dir)
+                for f in filenames if _PART.match(f) and int(_PART.match(f)[1]) <= state["last_id"]
+            )
+        return state
+
+    def _save_state(self, state):
+        os.makedirs(self.path, exist_ok=True)
+        temp_path = f"{self.state_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.state_path)
+
+    def _remove_unlisted(self, state):
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        if not os.path.isdir(self.clicks_dir):
+            return
+        live = set(state["parts"])
+        for dirpath, _, filenames in os.walk(self.clicks_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if os.path.relpath(path, self.clicks_dir) not in live:
+                    os.remove(path)
+
+    def _place(self, source, month, last_id, state):
+        # Files that were merged away stay on disk until the next refresh, so skip taken names
+        target = os.path.join(self.clicks_dir, month)
+        os.makedirs(target, exist_ok=True)
+        n = state["clicks"]
+        while os.path.exists(os.path.join(target, f"part_{last_id}_{n}.parquet")):
+            n += 1
+        name = f"part_{last_id}_{n}.parquet"
+        os.replace(source, os.path.join(target, name))
+        return os.path.join(month, name)
+
+    def _write_clicks(self, rows, state):
+        frame = pd.DataFrame.from_records(rows, columns=[c.strip() for c in CLICK_COLUMNS.split(",")])
+        frame["click_date"] = _utc(frame["click_date"])
+        frame["click_month"] = frame["click_date"].dt.strftime("%Y-%m")
+        last_id = max(int(frame["id"].max()), state["last_id"])
+
+        staging = os.path.join(self.staging_dir, uuid.uuid4().hex)
+        os.makedirs(self.staging_dir, exist_ok=True)
+        with closing(duckdb.connect()) as con:
+            con.register("new_clicks", frame)
+            con.execute(
+                f"COPY new_clicks TO '{_sql_path(staging)}' (FORMAT PARQUET, PARTITION_BY (click_month))"
+            )
+
+        for dirpath, _, filenames in os.walk(staging):
+            month = os.path.relpath(dirpath, staging)
+            for filename in sorted(filenames):
+                state["parts"].append(self._place(os.path.join(dirpath, filename), month, last_id, state))
+        shutil.rmtree(staging, ignore_errors=True)
+
+        state["last_id"] = last_id
+        state["clicks"] += len(rows)
+        self._save_state(state)
+
+    def _write_subscribers(self):
+        frame = pd.DataFrame.from_records(
+            iter_subscribers(SUBSCRIBER_COLUMNS),
+            columns=[c.strip() for c in SUBSCRIBER_COLUMNS.split(",")],
+        )
+        frame["list_id"] = frame["list_id"].map(lambda lists: list(lists) if lists else [])
+        frame["total_clicks"] = pd.to_numeric(frame["total_clicks"]).fillna(0).astype("int32")
+        frame["created_at"] = _utc(frame["created_at"])
+
+        os.makedirs(self.path, exist_ok=True)
+        temp_path = f"{self.subscribers_path}.tmp"
+        with closing(duckdb.connect()) as con:
+            con.register("subscriber_rows", frame)
+            con.execute(
+                "COPY (SELECT subscriber_hash, list_id::VARCHAR[] AS list_id, status, total_clicks, created_at "
+                f"FROM subscriber_rows) TO '{_sql_path(temp_path)}' (FORMAT PARQUET)"
+            )
+        os.replace(temp_path, self.subscribers_path)
+        return len(frame)
+
+    def refresh(self, progress_callback=None):
+        """
+        Copy clicks stored since the last refresh, and every subscriber.
+
+        Rows from the last REFRESH_OVERLAP ids below the watermark that aren't
+        mirrored yet are copied too: a multi-row insert can take lower ids but
+        commit after a refresh has read past them.
+
+        Args:
+            progress_callback (callable, optional): Called as
+                progress_callback(new_clicks) after each write.
+
+        Returns:
+            dict: `new_clicks` (`late_clicks` of them below the previous
+            watermark), the mirror's `clicks` and `subscribers`, `last_id`
+            and `duration` in seconds.
+        """
+        started = time.perf_counter()
+        state = self.state()
+        self._remove_unlisted(state)
+
+        previous_id = state["last_id"]
+        overlap_from = max(previous_id - REFRESH_OVERLAP, 0)
+        mirrored = set()
+        if previous_id:
+            mirrored = set(self.query("SELECT id FROM click_activity WHERE id > ?", [overlap_from])["id"].tolist())
+
+        new_clicks = 0
+        late_clicks = 0
+        chunk = []
+        for row in iter_click_activity_since(overlap_from, CLICK_COLUMNS):
+            if row["id"] in mirrored:
+                continue
+            if row["id"] <= previous_id:
+                late_clicks += 1
+            chunk.append(row)
+            if len(chunk) >= REFRESH_CHUNK:
+                self._write_clicks(chunk, state)
+                new_clicks += len(chunk)
+                chunk = []
+                if progress_callback:
+                    progress_callback(new_clicks)
+        if chunk:
+            self._write_clicks(chunk, state)
+            new_clicks += len(chunk)
+
+        compacted = self._compact(state)
+        state["subscribers"] = self._write_subscribers()
+        state["refreshed_at"] = datetime.now(timezone.utc).isoformat()
+        self._save_state(state)
+
+        result = {
+            "new_clicks": new_clicks,
+            "late_clicks": late_clicks,
+            "compacted_months": compacted,
+            "clicks": state["clicks"],
+            "subscribers": state["subscribers"],
+            "last_id": state["last_id"],
+            "duration": round(time.perf_counter() - started, 1),
+        }
+        print(f"Mirror refreshed: {result}")
+        return result
+
+    def compact(self, max_parts=MAX_PARTS):
+        """
+        Merge the parts of every month that has more than max_parts into one file.
+
+        The merged file replaces the parts in the list readers use; the parts
+        themselves are deleted by the next refresh.
+
+        Args:
+            max_parts (int): Parts a month may have before it is merged.
+
+        Returns:
+            int: The number of months merged.
+        """
+        return self._compact(self.state(), max_parts)
+
+    def _compact(self, state, max_parts=MAX_PARTS):
+        months = {}
+        for part in state["parts"]:
+            months.setdefault(os.path.dirname(part), []).append(part)
+
+        compacted = 0
+        for month, parts in sorted(months.items()):
+            if len(parts) <= max_parts:
+                continue
+
+            last_id = max(int(_PART.match(os.path.basename(part))[1]) for part in parts)
+            os.makedirs(self.staging_dir, exist_ok=True)
+            merged = os.path.join(self.staging_dir, f"{uuid.uuid4().hex}.parquet")
+            files = ", ".join(f"'{_sql_path(os.path.join(self.clicks_dir, part))}'" for part in parts)
+            with closing(duckdb.connect()) as con:
+                con.execute(
+                    f"COPY (SELECT * FROM read_parquet([{files}]) ORDER BY click_date, id) "
+                    f"TO '{_sql_path(merged)}' (FORMAT PARQUET)"
+                )
+
+            # Place the merged file first, then swap it for the parts in one state write
+            placed = self._place(merged, month, last_id, state)
+            merged_parts = set(parts)
+            state["parts"] = [part for part in state["parts"] if part not in merged_parts] + [placed]
+            self._save_state(state)
+            compacted += 1
+        return compacted
+
+    def rebuild(self, progress_callback=None):
+        """
+        Delete the mirror and copy everything again.
+
+        Returns:
+            dict: See refresh().
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+        return self.refresh(progress_callback)
+
+    def connect(self):
+        """
+        Open a DuckDB connection with `click_activity` and `subscribers` views
+        over the mirror. Connections are cheap; use one per thread.
+
+        Returns:
+            DuckDBPyConnection: The connection.
+        """
+        con = duckdb.connect()
+        parts = self.state()["parts"]
+        if parts:
+            files = ", ".join(f"'{_sql_path(os.path.join(self.clicks_dir, part))}'" for part in parts)
+            con.execute(
+                "CREATE VIEW click_activity AS SELECT * FROM read_parquet("
+                f"[{files}], hive_partitioning = true, hive_types = {{'click_month': VARCHAR}})"
+            )
+        else:
+            con.execute(f"CREATE VIEW click_activity AS {_EMPTY_CLICKS}")
+        if os.path.exists(self.subscribers_path):
+            con.execute(f"CREATE VIEW subscribers AS SELECT * FROM read_parquet('{_sql_path(self.subscribers_path)}')")
+        else:
+            con.execute(f"CREATE VIEW subscribers AS {_EMPTY_SUBSCRIBERS}")
+        return con
+
+    def query(self, sql, params=None):
+        """
+        Run SQL against the mirror's views.
+
+        Returns:
+            DataFrame: The result.
+        """
+        with closing(self.connect()) as con:
+            return con.execute(sql, params or []).df()
+
+    @staticmethod
+    def _filters(start_date=None, end_date=None, newsletter=None, headline=None):
+        clauses, params = [], []
+        if start_date:
+            # The month bound lets DuckDB skip whole partitions
+            clauses += ["click_month >= ?", "click_date >= ?::DATE"]
+            params += [start_date[:7], start_date]
+        if end_date:
+            clauses += ["click_month <= ?", "click_date < ?::DATE + INTERVAL 1 DAY"]
+            params += [end_date[:7], end_date]
+        if newsletter:
+            clauses.append("newsletter = ?")
+            params.append(newsletter)
+        if headline:
+            clauses.append("clicked_headline ILIKE ?")
+            params.append(f"%{headline}%")
+        return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def clicks(self, start_date=None, end_date=None, newsletter=None, headline=None, limit=100):
+        """
+        Click rows, newest first.
+
+        Args:
+            start_date (str, optional): First click date (YYYY-MM-DD).
+            end_date (str, optional): Last click date (YYYY-MM-DD), inclusive.
+            newsletter (str, optional): Newsletter list ID.
+            headline (str, optional): Only headlines containing this text.
+            limit (int): Maximum number of rows.
+
+        Returns:
+            DataFrame: id, subscriber_hash, clicked_headline, newsletter, click_date.
+        """
+        where, params = self._filters(start_date, end_date, newsletter, headline)
+        return self.query(
+            f"""
+            SELECT id, subscriber_hash, clicked_headline, newsletter, click_date
+            FROM click_activity {where}
+            ORDER BY click_date DESC, id DESC
+            LIMIT ?
+            """,
+            params + [limit],
+        )
+
+    def headline_popularity(self, start_date=None, end_date=None, newsletter=None, headline=None, limit=10):
+        """
+        The most clicked headlines.
+
+        Returns:
+            DataFrame: clicked_headline, clicks and distinct subscribers, most
+            clicked first.
+        """
+        where, params = self._filters(start_date, end_date, newsletter, headline)
+        return self.query(
+            f"""
+            SELECT clicked_headline, count(*) AS clicks, count(DISTINCT subscriber_hash) AS subscribers
+            FROM click_activity {where}
+            GROUP BY clicked_headline
+            ORDER BY clicks DESC, subscribers DESC, clicked_headline
+            LIMIT ?
+            """,
+            params + [limit],
+        )
+
+    def clicks_per_day(self, start_date=None, end_date=None, newsletter=None, headline=None):
+        """
+        Clicks per newsletter per day.
+
+        Returns:
+            DataFrame: One row per day, one column per newsletter list ID, zero filled.
+        """
+        where, params = self._filters(start_date, end_date, newsletter, headline)
+        counts = self.query(
+            f"""
+            SELECT CAST(click_date AS DATE) AS day, newsletter, count(*) AS clicks
+            FROM click_activity {where}
+            GROUP BY ALL
+            """,
+            params,
+        )
+        if counts.empty:
+            return pd.DataFrame()
+        return counts.pivot_table(index="day", columns="newsletter", values="clicks", fill_value=0).sort_index()
+
+    def summary(self, start_date=None, end_date=None, newsletter=None, headline=None):
+        """
+        Totals for a filter: clicks, distinct subscribers and headlines.
+
+        Returns:
+            dict: `clicks`, `subscribers` and `headlines`.
+        """
+        where, params = self._filters(start_date, end_date, newsletter, headline)
+        row = self.query(
+            f"""
+            SELECT count(*) AS clicks, count(DISTINCT subscriber_hash) AS subscribers,
+                   count(DISTINCT clicked_headline) AS headlines
+            FROM click_activity {where}
+            """,
+            params,
+        )
+        return {column: int(row[column].iloc[0]) for column in row.columns}
+
+
+# Shared mirror used by the pages and worker.py
+click_mirror = ClickMirror()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the local click activity mirror.")
+    parser.add_argument("--rebuild", action="store_true", help="Drop the mirror and copy everything again.")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        click_mirror.rebuild()
+    else:
+        click_mirror.refresh()
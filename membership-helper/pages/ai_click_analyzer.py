@@ -1,12 +1,21 @@
+import os
 import streamlit as st
-from db import fetch_existing_clicks
+from db import fetch_click_profiles, fetch_all_newsletters
 import email_generator as gen
+import prompt_builder
+from email_cache import email_cache
+from jobs import job_queue
+from batch_email import JOB_KEY as EMAIL_BATCH_KEY
+from clustering import DEFAULT_THRESHOLD
+
+JOB_POLL_SECONDS = 2  # How often a running batch's progress is refreshed
 
 st.title("AI Click Analyzer")
 st.markdown("Generate personalized marketing emails based on member click activity.")
 
 # Input field for Subscriber Hash
 subscriber_hash = st.text_input("Enter Subscriber Hash")
+regenerate = st.checkbox("Regenerate", help="Ask OpenAI for a new email even if one was already written for these clicks.")
 
 
 # Submit Button
@@ -15,14 +24,20 @@ if st.button("Generate Email"):
         st.error("Please enter a valid subscriber hash.")
     else:
         # Fetch existing clicks for the subscriber
-        subscriber_clicks = fetch_existing_clicks(subscriber_hash)
+        subscriber_clicks = fetch_click_profiles([subscriber_hash], with_dates=True).get(subscriber_hash)
 
         if not subscriber_clicks:
             st.warning("No click activity found for this subscriber.")
         else:
             # Show a spinner while generating the email
             with st.spinner(f"Analyzing click activity for subscriber: {subscriber_hash}"):
-                generated_email = gen.generate_email(subscriber_clicks)
+                generated_email = gen.generate_email(subscriber_clicks, use_cache=not regenerate)
+
+            prompt_headlines = prompt_builder.select_clicks(subscriber_clicks)
+            st.caption(
+                f"Prompt used the {len(prompt_headlines)} most recent and recurring of {len(subscriber_clicks)} "
+                f"clicked headlines (~{sum(prompt_builder.estimate_tokens(h) for h in prompt_headlines)} tokens)."
+            )
 
             # Display the generated email
             if generated_email:
@@ -30,6 +45,93 @@ if st.button("Generate Email"):
             else:
                 st.error("Failed to generate email. Please try again.")
 
+cache_stats = email_cache.get_stats()
+st.caption(
+    f"Email cache: {cache_stats['size']} drafts stored, {cache_stats['hits']} hits and "
+    f"{cache_stats['misses']} misses since the app started ({cache_stats['hit_rate']:.0%} hit rate)"
+)
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_email_batch_job():
+    """Show the latest email batch, refreshing while it runs."""
+    jobs = job_queue.recent(kind="email_batch", list_id=EMAIL_BATCH_KEY, limit=1)
+    if not jobs:
+        return
+    job = jobs[0]
+
+    if job["status"] == "queued":
+        st.info(f"Job #{job['id']} is waiting for a worker.")
+    elif job["status"] == "running":
+        total = job["progress_total"]
+        st.progress(
+            min(job["progress_done"] / total, 1.0) if total else 0.0,
+            text=f"Job #{job['id']}: {job['stage'] or 'Starting'} ({job['progress_done']}/{total})",
+        )
+        if st.button("Cancel", key=f"cancel_{job['id']}"):
+            job_queue.cancel(job["id"])
+    elif job["status"] == "succeeded":
+        result = job["result"]
+        st.success(
+            f"Generated {result['succeeded']} of {result['requested']} emails in {result['duration']:.0f}s "
+            f"({result['total_tokens']} tokens)."
+        )
+        if result.get("clusters") is not None:
+            st.info(
+                f"Similar subscribers shared emails: {result['clusters']} emails were written for "
+                f"{result['requested'] - result['skipped']} subscribers, saving {result['llm_calls_saved']} OpenAI calls."
+            )
+        if result.get("cached"):
+            st.info(f"{result['cached']} emails were unchanged and came from the cache.")
+        if result["failed"]:
+            st.error(f"{result['failed']} emails failed; see the error column of the output.")
+        if result["skipped"]:
+            st.warning(f"Skipped {result['skipped']} subscribers with no click activity.")
+        if result["p50_latency"] is not None:
+            st.caption(f"Latency per email: {result['p50_latency']:.1f}s median, {result['p95_latency']:.1f}s p95")
 
+        if os.path.exists(result["output_path"]):
+            with open(result["output_path"], "rb") as f:
+                st.download_button("Download Emails", f, file_name=os.path.basename(result["output_path"]))
+    elif job["status"] == "cancelled":
+        st.warning(f"Job #{job['id']} was cancelled.")
+    else:
+        st.error(f"Job #{job['id']} failed: {job['error']}")
+
+
+st.divider()
+st.subheader("Batch Generate Emails")
+st.markdown("Generate emails for the subscribers with the most clicks. Runs on the worker (`python worker.py`).")
 
+newsletters = fetch_all_newsletters()
+batch_options = {"All newsletters": None, **{n["name"]: n["list_id"] for n in newsletters}}
+selected = st.selectbox("Newsletter", options=batch_options.keys())
+top = st.number_input("Number of top clickers", min_value=1, max_value=10000, value=100)
+output_format = st.radio("Output format", ["ndjson", "csv"], horizontal=True)
+batch_regenerate = st.checkbox("Regenerate cached emails", key="batch_regenerate")
+share_emails = st.checkbox("Share one email among subscribers with similar clicks")
+cluster_threshold = st.slider(
+    "Similarity needed to share an email",
+    min_value=0.5,
+    max_value=1.0,
+    value=DEFAULT_THRESHOLD,
+    step=0.05,
+    disabled=not share_emails,
+    help="1.0 only groups subscribers who clicked exactly the same stories.",
+)
+
+if st.button("Generate Batch"):
+    params = {
+        "list_id": batch_options[selected],
+        "top": int(top),
+        "format": output_format,
+        "use_cache": not batch_regenerate,
+        "cluster_threshold": cluster_threshold if share_emails else None,
+    }
+    job, created = job_queue.enqueue("email_batch", EMAIL_BATCH_KEY, params)
+    if created:
+        st.success(f"Queued job #{job['id']} to write {top} emails.")
+    else:
+        st.info(f"An email batch is already {job['status']} (#{job['id']}).")
 
+show_email_batch_job()
@@ -1,18 +1,141 @@
+import pandas as pd
 import streamlit as st
-from db import fetch_click_activity, insert_click_activity, update_total_clicks, fetch_most_popular_headline, fetch_most_popular_headline, fetch_subscribers_sorted_by_clicks, fetch_all_newsletters, get_all_newsletter_names
+from db import fetch_all_newsletters, get_all_newsletter_names
+from mirror import click_mirror, JOB_KEY as MIRROR_JOB_KEY
 from datetime import datetime, timedelta
-from tasks import process_subscriber_clicks, process_click_activity
-from chimp.member_clicks import get_member_activity
-from utils import extract_slug_from_url, get_post_details, clean_headline
+from utils import clean_headline
+from jobs import job_queue, ALL_LISTS
+
+JOB_POLL_SECONDS = 2  # How often a running job's progress is refreshed
 
 
 
 st.title("Click Activity")
 st.markdown("Analyze and explore click activity from newsletters.")
 
+
+def show_click_result(result, names=None):
+    """Summarise a finished click activity job."""
+    if "campaign_count" in result:
+        st.success(
+            f"Processed {result['processed_count']} clicks from {result['link_count']} links "
+            f"in {result['campaign_count']} campaigns."
+        )
+    elif "newsletters" in result:
+        st.success(
+            f"Processed {result['processed_count']} clicks for {result['subscriber_count']} subscribers "
+            f"across {len(result['newsletters'])} newsletters."
+        )
+    else:
+        st.success(f"Processed {result['processed_count']} new clicks.")
+
+    if result.get("resumed_subscribers"):
+        st.info(f"Resumed an interrupted run; {result['resumed_subscribers']} subscribers were already done.")
+    if result.get("unchanged_subscribers"):
+        st.info(f"Skipped {result['unchanged_subscribers']} subscribers with no new activity since the last sync.")
+    if result["skipped_count"] > 0:
+        st.warning(f"Skipped {result['skipped_count']} invalid or duplicate clicks.")
+    if result["error_count"] > 0:
+        st.error(f"Encountered {result['error_count']} errors.")
+
+    if "newsletters" in result:
+        st.table([
+            {
+                "Newsletter": (names or {}).get(list_id, list_id),
+                "Processed": counts["processed_count"],
+                "Skipped": counts["skipped_count"],
+                "Errors": counts["error_count"],
+            }
+            for list_id, counts in result["newsletters"].items()
+        ])
+
+    cache_stats = result.get("headline_cache")
+    if cache_stats:
+        st.caption(
+            f"Headline cache: {cache_stats['hits']} hits, {cache_stats['negative_hits']} known-missing, "
+            f"{cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)"
+        )
+
+    # Hosts that kept failing were skipped until their circuit reset
+    for host, circuit in (result.get("circuits") or {}).items():
+        if circuit["state"] != "closed":
+            st.warning(f"{host} was failing ({circuit['failures']} errors in a row); its requests were paused.")
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_click_jobs(list_id, names=None):
+    """Show the latest click activity job for a list, refreshing while it runs."""
+    kind = "click_sync_all" if list_id == ALL_LISTS else "click_sync"
+    jobs = job_queue.recent(kind=kind, list_id=list_id, limit=1)
+    if not jobs:
+        return
+    job = jobs[0]
+
+    if job["status"] == "queued":
+        st.info(f"Job #{job['id']} is waiting for a worker.")
+    elif job["status"] == "running":
+        total = job["progress_total"]
+        st.progress(
+            min(job["progress_done"] / total, 1.0) if total else 0.0,
+            text=f"Job #{job['id']}: {job['stage'] or 'Starting'} ({job['progress_done']}/{total})",
+        )
+        if st.button("Cancel", key=f"cancel_{job['id']}"):
+            job_queue.cancel(job["id"])
+    elif job["status"] == "succeeded":
+        st.caption(f"Job #{job['id']} finished {job['finished_at']}")
+        show_click_result(job["result"], names)
+    elif job["status"] == "cancelled":
+        st.warning(f"Job #{job['id']} was cancelled.")
+    else:
+        st.error(f"Job #{job['id']} failed: {job['error']}")
+
+
 tab1, tab2 = st.tabs(["Explore Click Activity", "Fetch New Click Activity"])
 
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_mirror_job():
+    """Show the latest mirror refresh, refreshing while it runs."""
+    jobs = job_queue.recent(kind="mirror_refresh", list_id=MIRROR_JOB_KEY, limit=1)
+    if not jobs:
+        return
+    job = jobs[0]
+
+    if job["status"] == "queued":
+        st.info(f"Job #{job['id']} is waiting for a worker.")
+    elif job["status"] == "running":
+        st.info(f"Job #{job['id']}: {job['stage'] or 'Starting'} ({job['progress_done']} new clicks so far)")
+        if st.button("Cancel", key=f"cancel_{job['id']}"):
+            job_queue.cancel(job["id"])
+    elif job["status"] == "succeeded":
+        result = job["result"]
+        st.caption(
+            f"Job #{job['id']} copied {result['new_clicks']} new clicks in {result['duration']:.0f}s; "
+            "rerun the page to see them."
+        )
+    elif job["status"] == "cancelled":
+        st.warning(f"Job #{job['id']} was cancelled.")
+    else:
+        st.error(f"Job #{job['id']} failed: {job['error']}")
+
+
 with tab1:
+    # Every widget below is answered from the local Parquet mirror, see mirror.py
+    mirror_state = click_mirror.state()
+    if mirror_state["refreshed_at"]:
+        refreshed_at = datetime.fromisoformat(mirror_state["refreshed_at"])
+        st.caption(
+            f"{mirror_state['clicks']} clicks mirrored locally, "
+            f"refreshed {refreshed_at.strftime('%B %d, %Y %I:%M %p')} UTC"
+        )
+    else:
+        st.info("The local click mirror is empty. Refresh it to explore click activity.")
+
+    if st.button("Refresh Mirror", help="Copy clicks stored since the last refresh. Runs on the worker (`python worker.py`)."):
+        job, created = job_queue.enqueue("mirror_refresh", MIRROR_JOB_KEY, {})
+        if not created:
+            st.info(f"A mirror refresh is already {job['status']} (#{job['id']}).")
+    show_mirror_job()
+
     # Filters for fetching click activity
     st.subheader("Filters")
 
@@ -29,66 +152,81 @@ with tab1:
 
     start_date = st.date_input("Start Date", value=(datetime.now() - timedelta(days=7)), max_value=datetime.now())
     end_date = st.date_input("End Date", value=datetime.now(), max_value=datetime.now())
+    headline_filter = st.text_input("Headline Contains", help="Only clicks whose headline contains this text.")
     limit = st.number_input("Number of Results", min_value=1, max_value=1000, value=100)
 
+    newsletter_names = get_all_newsletter_names()
+    filters = {
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "headline": headline_filter.strip() or None,
+    }
 
-    # Fetch click activity
+    # Clicks per newsletter per day
+    clicks_per_day = click_mirror.clicks_per_day(**filters)
+    if not clicks_per_day.empty:
+        st.write("### Clicks per Day")
+        st.line_chart(clicks_per_day.rename(columns=lambda list_id: newsletter_names.get(list_id, list_id)))
+
+    if selected_newsletter:
+        totals = click_mirror.summary(newsletter=newsletter_options[selected_newsletter], **filters)
+        st.caption(
+            f"{totals['clicks']} clicks by {totals['subscribers']} subscribers on "
+            f"{totals['headlines']} headlines in {selected_newsletter} for these dates."
+        )
 
-    newsletter_names = get_all_newsletter_names()
+
+    # Fetch click activity
 
     if st.button("Get Click Activity"):
         if selected_newsletter:
-            try:
-                # Call fetch_click_activity
-                click_activity = fetch_click_activity(
-                    start_date=start_date.isoformat(),
-                    end_date=end_date.isoformat(),
-                    newsletter=newsletter_options[selected_newsletter],
-                    limit=limit,
-                )
+            click_activity = click_mirror.clicks(
+                newsletter=newsletter_options[selected_newsletter],
+                limit=limit,
+                **filters,
+            )
+
+            # Check if data is returned
+            if not click_activity.empty:
+                # Map newsletter IDs to names and prepare the display data
+                display_data = pd.DataFrame({
+                    "Headline": click_activity["clicked_headline"],
+                    "Newsletter": click_activity["newsletter"].map(newsletter_names).fillna("Unknown"),
+                    "Click Date": click_activity["click_date"].dt.strftime("%Y-%m-%d %H:%M"),
+                })
 
-                # Check if data is returned
-                if click_activity:
-                    # Map newsletter IDs to names and prepare the display data
-                    display_data = [
-                        {
-                            "Headline": item["clicked_headline"],
-                            "Newsletter": newsletter_names.get(item["newsletter"], "Unknown"),
-                            "Click Date": item["click_date"],
-                        }
-                        for item in click_activity
-                    ]
-
-                    # Display the results
-                    st.write(f"Fetched {len(display_data)} click activity records:")
-                    st.table(display_data)
-                else:
-                    st.info("No click activity found for the given criteria.")
-            except Exception as e:
-                # Handle unexpected errors
-                st.error(f"An error occurred while fetching click activity: {e}")
-                st.write("Debug info:", e)  # Optional: Remove in production
+                # Display the results
+                st.write(f"Fetched {len(display_data)} click activity records:")
+                st.dataframe(display_data, hide_index=True)
+            else:
+                st.info("No click activity found for the given criteria.")
         else:
             st.warning("Please select a newsletter.")
 
 
-    # Fetch the most popular headline
-    if st.button("Get Most Popular Headline"):
+    # The most popular headlines
+    top_n = st.number_input("Number of Top Headlines", min_value=1, max_value=100, value=10)
+
+    if st.button("Get Most Popular Headlines"):
         if selected_newsletter:
-            try:
-                popular_headline = fetch_most_popular_headline(
-                    start_date=start_date.isoformat(),
-                    end_date=end_date.isoformat(),
-                )
+            top_headlines = click_mirror.headline_popularity(
+                newsletter=newsletter_options[selected_newsletter],
+                limit=top_n,
+                **filters,
+            )
 
-                if popular_headline:
-                    st.write("### Most Popular Headline")
-                    st.write(f"**Headline:** {popular_headline['clicked_headline']}")
-                    st.write(f"**Click Count:** {popular_headline['click_count']}")
-                else:
-                    st.info("No headline data found for the given criteria.")
-            except Exception as e:
-                st.error(f"An error occurred while fetching the most popular headline: {e}")
+            if not top_headlines.empty:
+                st.write("### Most Popular Headlines")
+                st.dataframe(
+                    pd.DataFrame({
+                        "Headline": top_headlines["clicked_headline"].map(clean_headline),
+                        "Click Count": top_headlines["clicks"],
+                        "Readers": top_headlines["subscribers"],
+                    }),
+                    hide_index=True,
+                )
+            else:
+                st.info("No headline data found for the given criteria.")
         else:
             st.warning("Please select a newsletter.")
 
@@ -107,39 +245,47 @@ with tab2:
             format_func=lambda id: next((n["name"] for n in newsletters if n["list_id"] == id), id)
         )
 
-        if st.button("Fetch Click Activity"):
-            # Fetch subscribers for the selected newsletter
-            subscribers = fetch_subscribers_sorted_by_clicks(list_id)
-
-            if not subscribers:
-                st.info("No subscribers found for this list.")
-            else:
-                # Initialize progress bar
-                subscribers = sorted(subscribers, key=lambda s: s.get("total_clicks", 0), reverse=True)
-
-                total_subscribers = len(subscribers)
-                progress_bar = st.progress(0)
-
-    
+        mode = st.radio(
+            "Ingestion mode",
+            options=["Per subscriber", "Mailchimp batch", "By campaign"],
+            horizontal=True,
+            help=(
+                "Per subscriber asks Mailchimp for each reader's activity. "
+                "Mailchimp batch submits the whole list as one batch job. "
+                "By campaign walks recent campaigns' links and their clickers, which needs the fewest calls."
+            ),
+        )
+        campaign_days = st.number_input("Campaigns from the last N days", min_value=1, max_value=365, value=30) if mode == "By campaign" else None
 
-                for idx, subscriber in enumerate(subscribers, start=1):
-                    subscriber_hash = subscriber["subscriber_hash"]
+        incremental = st.checkbox(
+            "Only fetch new activity",
+            value=True,
+            help="Skip subscribers whose Mailchimp stats haven't changed since a recent sync and ignore clicks older than the last sync.",
+        )
 
+        if st.button("Fetch Click Activity"):
+            job_mode = {"Per subscriber": "subscriber", "Mailchimp batch": "batch", "By campaign": "campaign"}[mode]
+            job, created = job_queue.enqueue(
+                "click_sync",
+                list_id,
+                {"mode": job_mode, "incremental": incremental, "campaign_days": campaign_days},
+            )
+            if created:
+                st.success(f"Queued click activity job #{job['id']}. It keeps running if you leave this page.")
+            else:
+                st.info(f"A click activity job for this newsletter is already {job['status']} (#{job['id']}).")
 
-                     # Call process_click_activity for the current subscriber
-                    result = process_click_activity(list_id, subscriber_hash)
-                    
-                    if result.get("processed_count", 0) > 0:
-                        st.success(f"Processed {result['processed_count']} clicks for subscriber {subscriber_hash}.")
-                    if result.get("skipped_count", 0) > 0:
-                        st.warning(f"Skipped {result['skipped_count']} invalid clicks for subscriber {subscriber_hash}.")
-                    if result.get("error_count", 0) > 0:
-                        st.error(f"Encountered {result['error_count']} errors for subscriber {subscriber_hash}.")
+        show_click_jobs(list_id)
 
+        st.divider()
+        st.subheader("Sync All Newsletters")
+        st.markdown("Fetch new click activity for every newsletter at once. Readers on several lists are processed only once.")
 
-                    # Update progress bar
-                    progress_percentage = int((idx / total_subscribers) * 100)
-                    progress_bar.progress(progress_percentage)
+        if st.button("Sync All Newsletters"):
+            job, created = job_queue.enqueue("click_sync_all", ALL_LISTS, {"incremental": incremental})
+            if created:
+                st.success(f"Queued job #{job['id']} to sync every newsletter.")
+            else:
+                st.info(f"A sync of every newsletter is already {job['status']} (#{job['id']}).")
 
-                # success
-                st.success("Finished processing click activity.")
\ No newline at end of file
+        show_click_jobs(ALL_LISTS, {n["list_id"]: n["name"] for n in newsletters})
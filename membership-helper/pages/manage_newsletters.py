@@ -1,10 +1,9 @@
 import streamlit as st
-from db import fetch_all_newsletters, add_newsletter, update_newsletter_subscriber_count
-from chimp.subscriber_sync import sync_subscribers_from_mailchimp
-
-from chimp import newsletters as nl 
+from db import fetch_all_newsletters, add_newsletter
+from jobs import job_queue, ACTIVE_STATUSES
 from datetime import datetime
-import json
+
+JOB_POLL_SECONDS = 2  # How often running sync jobs are refreshed
  
 
  
@@ -15,6 +14,43 @@ if not st.session_state.get("authenticated", False):
     st.switch_page("pages/login.py")
     st.stop()  # Stop further execution of the page
 
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_sync_jobs(names):
+    """List recent subscriber sync jobs, refreshing while they run."""
+    jobs = job_queue.recent(kind="subscriber_sync", limit=5)
+
+    # A sync that finished since the last poll changed the table above, so redraw the whole page
+    active = {job["id"] for job in jobs if job["status"] in ACTIVE_STATUSES}
+    finished = st.session_state.get("active_sync_jobs", set()) - active
+    st.session_state["active_sync_jobs"] = active
+    if finished:
+        st.rerun()
+
+    if not jobs:
+        return
+
+    st.subheader("Sync Jobs")
+    for job in jobs:
+        name = names.get(job["list_id"], job["list_id"])
+        result = job["result"] or {}
+        if job["status"] == "queued":
+            st.info(f"#{job['id']} {name}: waiting for a worker.")
+        elif job["status"] == "running":
+            st.info(f"#{job['id']} {name}: {job['stage'] or 'starting'}...")
+        elif job["status"] == "succeeded":
+            st.success(
+                f"#{job['id']} {name}: synced ({result.get('mode')} sync, "
+                f"{result.get('synced_count')} updated, {result.get('removed_count')} removed). "
+                f"Subscriber count updated to {result.get('subscriber_count')}."
+            )
+        elif job["status"] == "cancelled":
+            st.warning(f"#{job['id']} {name}: cancelled.")
+        else:
+            st.error(f"#{job['id']} {name}: failed. {job['error']}")
+
+
 st.title("Newsletter Setup")
 st.markdown("Manage your newsletters: Add new ones and view existing details.")
 
@@ -42,6 +78,10 @@ with tab2:
     
     if newsletters:
         st.write("Here are the newsletters currently in the database:")
+        full_reconcile = st.checkbox(
+            "Full reconcile",
+            help="Re-export the entire audience instead of only the members changed since the last sync.",
+        )
 
         for newsletter in newsletters:
             col1, col2, col3, col4, col5 = st.columns([3, 2, 1, 2, 2])
@@ -52,32 +92,20 @@ with tab2:
             # Format the `last_synced` timestamp
             last_synced_raw = newsletter.get("last_synced")
             last_synced_formatted = (
-                datetime.fromisoformat(last_synced_raw).strftime("%B %d, %Y %I:%M %p")
+                datetime.fromisoformat(last_synced_raw).astimezone().strftime("%B %d, %Y %I:%M %p")
                 if last_synced_raw and last_synced_raw != "Never"
                 else "Never"
             )
             col4.write(last_synced_formatted)
 
-            # Sync button logic
+            # Sync runs in a worker; the button only queues it
             if col5.button("Sync", key=f"sync_{newsletter['list_id']}"):
-                with st.spinner(f"Syncing data for {newsletter['name']}..."):
-                    try:
-                        # Trigger the sync process
-                        exported_file = sync_subscribers_from_mailchimp(newsletter["list_id"])
-
-                        if exported_file:
-                            # Update the subscriber count using the number of records in the JSON file
-                            with open(exported_file, "r") as f:
-                                subscribers = json.load(f)
-                                subscriber_count = len(subscribers)
-
-                            now = datetime.now().isoformat()
-                            update_newsletter_subscriber_count(newsletter["list_id"], subscriber_count, now)
-
-                            st.success(f"Newsletter '{newsletter['name']}' synced successfully! Subscriber count updated to {subscriber_count}.")
-                        else:
-                            st.error(f"Failed to sync newsletter '{newsletter['name']}'. Please try again.")
-                    except Exception as e:
-                        st.error(f"An unexpected error occurred: {e}")
+                job, created = job_queue.enqueue("subscriber_sync", newsletter["list_id"], {"full": full_reconcile})
+                if created:
+                    st.success(f"Queued sync of '{newsletter['name']}' (job #{job['id']}).")
+                else:
+                    st.info(f"A sync of '{newsletter['name']}' is already {job['status']} (job #{job['id']}).")
+
+        show_sync_jobs({n["list_id"]: n["name"] for n in newsletters})
     else:
         st.info("No newsletters found.")
@@ -1,9 +1,10 @@
 import streamlit as st
-from db import get_total_subscribers, fetch_subscribers, fetch_subscribers_sorted_by_clicks, fetch_all_newsletters
+from db import get_total_subscribers, fetch_subscribers, fetch_subscribers_sorted_by_clicks, fetch_all_newsletters, get_query_cache_stats
 from chimp.member_clicks import get_member_activity
 from datetime import datetime, timedelta
 from utils import extract_slug_from_url, get_post_details, clean_headline
 from tasks import process_click_activity
+from analytics import get_analytics, ANALYTICS_DAYS
 
 
 st.title("Member Data")
@@ -12,9 +13,14 @@ st.markdown("Fetch and display subscriber data based on criteria.")
 # Display total subscribers
 total_subscribers = get_total_subscribers()
 st.write(f"**Total Subscribers:** {total_subscribers}")
+cache_stats = get_query_cache_stats()
+st.caption(
+    f"Query cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+    f"({cache_stats['hit_rate']:.0%} hit rate)"
+)
 
 # Tabs for different filters
-tab1, tab2 = st.tabs(["By Date Created", "Explore member clicks"])
+tab1, tab2, tab3 = st.tabs(["By Date Created", "Explore member clicks", "Engagement"])
 
 # Tab 1: Search by Date Created
 with tab1:
@@ -69,4 +75,35 @@ with tab2:
 
             st.success("Finished processing click activity.")
 
-            
\ No newline at end of file
+            
+
+
+with tab3:
+    st.subheader("Subscriber Engagement")
+    st.markdown(f"Clicks per subscriber over the last {ANALYTICS_DAYS} days, and how many readers the lists share.")
+
+    analytics = get_analytics(refresh=st.button("Refresh Data"))
+    newsletter_names = {n["list_id"]: n["name"] for n in fetch_all_newsletters()}
+
+    engagement_list = st.selectbox(
+        "Newsletter",
+        options=[None, *newsletter_names],
+        format_func=lambda list_id: "All subscribers" if list_id is None else newsletter_names.get(list_id, list_id),
+    )
+    distribution = analytics.engagement_distribution(engagement_list)
+    st.bar_chart(distribution.set_index("clicks")["subscribers"])
+    st.dataframe(
+        distribution.assign(share=(distribution["share"] * 100).round(1)).rename(
+            columns={"clicks": "Clicks", "subscribers": "Subscribers", "share": "Share (%)"}
+        ),
+        hide_index=True,
+    )
+
+    st.write("### List Overlap")
+    st.caption("Subscribers on both lists; the diagonal is each list's size.")
+    overlap = analytics.list_overlap()
+    if overlap.empty:
+        st.info("No list memberships found.")
+    else:
+        rename = lambda list_id: newsletter_names.get(list_id, list_id)
+        st.dataframe(overlap.rename(index=rename, columns=rename))
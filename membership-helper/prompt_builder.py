@@ -0,0 +1,169 @@
+'''
+prompt_builder.py
+Builds email prompts that stay within a token budget however much a reader clicks
+- near-identical headlines (a story clicked as both slug and headline) are merged
+- clicks are ranked by recency and by how often their topic recurs in the reader's history
+- the best ones are added until the budget, measured with a local token estimate, is spent
+- the static system prompt always comes first and the per-reader part last, so the
+  provider can reuse its cached prefix across requests
+
+'''
+import math
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+from clustering import tokenize
+
+PROMPT_TOKEN_BUDGET = 250        # Tokens of headlines per prompt
+RECENCY_HALF_LIFE_DAYS = 30      # A click this much older than the newest counts half as much
+NEAR_DUPLICATE_SIMILARITY = 0.8  # Word overlap (Jaccard) at which two headlines are the same story
+RECURRENCE_WEIGHT = 2.0          # Worth of a topic whose words appear in every other click, in clicks
+
+INSTRUCTION = "Generate a personalized fundraising email based on these topics, most relevant first."
+
+_PIECE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    """
+    Estimate the tokens of a text without a tokenizer: one per punctuation
+    mark and about one per five characters of each word.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: Estimated token count.
+    """
+    return sum(max(1, (len(piece) + 2) // 5) for piece in _PIECE.findall(text))
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value
+    if value:
+        try:
+            return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    return None
+
+
+def rank_clicks(clicks):
+    """
+    Merge near-identical headlines and rank them, most relevant first.
+
+    Merging uses prefix filtering, so a headline is only compared with the
+    groups that share one of its rarest words, not with every group.
+
+    A headline's frequency is the number of clicks merged into it plus
+    RECURRENCE_WEIGHT times the share of the reader's other clicks its words
+    appear in. Its score is the frequency halved every RECENCY_HALF_LIFE_DAYS
+    before the reader's newest click, so the order only changes when the
+    clicks do.
+
+    Args:
+        clicks (iterable or dict): Clicked headlines or slugs, or a dict of
+            headline -> click_date (ISO string or datetime).
+
+    Returns:
+        list: Headlines, best first.
+    """
+    dates = clicks if isinstance(clicks, dict) else dict.fromkeys(clicks)
+
+    # Headlines before slugs and longer before shorter, so the fullest spelling of a story is kept
+    headlines = sorted(
+        {" ".join(h.split()): _parse_date(d) for h, d in dates.items() if h and h.strip()}.items(),
+        key=lambda item: (" " not in item[0], -len(item[0]), item[0]),
+    )
+
+    # Two sets with Jaccard >= t share a word among the first |words| - ceil(t * |words|) + 1
+    # of each, rarest first, so only groups sharing one of those need comparing
+    word_sets = [set(tokenize(headline)) for headline, _ in headlines]
+    frequency = Counter(word for words in word_sets for word in words)
+    by_prefix = defaultdict(list)   # word -> indexes of groups with it in their prefix
+
+    groups = []
+    for (headline, clicked_at), words in zip(headlines, word_sets):
+        ordered = sorted(words, key=lambda w: (frequency[w], w))
+        prefix = ordered[:len(ordered) - math.ceil(NEAR_DUPLICATE_SIMILARITY * len(ordered) - 1e-9) + 1]
+        candidates = sorted({k for word in prefix for k in by_prefix[word]})
+        for k in candidates:
+            group = groups[k]
+            union = words | group["words"]
+            if len(words & group["words"]) / len(union) >= NEAR_DUPLICATE_SIMILARITY:
+                group["count"] += 1
+                if clicked_at and (group["clicked_at"] is None or clicked_at > group["clicked_at"]):
+                    group["clicked_at"] = clicked_at
+                break
+        else:
+            for word in prefix:
+                by_prefix[word].append(len(groups))
+            groups.append({"headline": headline, "words": words, "count": 1, "clicked_at": clicked_at})
+
+    word_counts = {}
+    for group in groups:
+        for word in group["words"]:
+            word_counts[word] = word_counts.get(word, 0) + 1
+    dated = [g["clicked_at"] for g in groups if g["clicked_at"]]
+    newest = max(dated) if dated else None
+
+    others = max(len(groups) - 1, 1)
+    for group in groups:
+        recurrence = (
+            sum(word_counts[w] - 1 for w in group["words"]) / len(group["words"]) / others if group["words"] else 0
+        )
+        recency = 1.0
+        if newest and group["clicked_at"]:
+            try:
+                age_days = (newest - group["clicked_at"]).total_seconds() / 86400
+            except TypeError:
+                age_days = 0  # Mixed naive and aware timestamps
+            recency = 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS)
+        group["score"] = (group["count"] + RECURRENCE_WEIGHT * recurrence) * recency
+
+    groups.sort(key=lambda g: (-g["score"], g["headline"]))
+    return [group["headline"] for group in groups]
+
+
+def select_clicks(clicks, token_budget=PROMPT_TOKEN_BUDGET):
+    """
+    The highest-ranked headlines that fit in the token budget.
+
+    Args:
+        clicks (iterable or dict): See rank_clicks.
+        token_budget (int): Maximum estimated tokens of headlines. The best
+            headline is always kept.
+
+    Returns:
+        list: Headlines, best first.
+    """
+    selected = []
+    used = 0
+    for headline in rank_clicks(clicks):
+        tokens = estimate_tokens(headline) + 2  # Bullet and line break
+        if selected and used + tokens > token_budget:
+            continue
+        selected.append(headline)
+        used += tokens
+    return selected
+
+
+def build_messages(clicks, system_prompt, token_budget=PROMPT_TOKEN_BUDGET):
+    """
+    Build chat messages for one email: the static system prompt, then the
+    instruction and the reader's selected headlines.
+
+    Args:
+        clicks (iterable or dict): See rank_clicks.
+        system_prompt (str): Identical for every reader.
+        token_budget (int): See select_clicks.
+
+    Returns:
+        list: Chat completion messages.
+    """
+    topics = "\n".join(f"- {headline}" for headline in select_clicks(clicks, token_budget))
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"{INSTRUCTION}\n{topics}"},
+    ]
@@ -0,0 +1,15 @@
+-- Last ingested click per subscriber and list, used by the incremental click sync.
+-- avg_click_rate is Mailchimp's member stat at the time of the last sync. If it
+-- hasn't moved since, the member record hasn't changed after synced_at, and the
+-- watermark is recent, the subscriber is skipped (see needs_click_sync in tasks.py).
+
+create table if not exists click_watermarks (
+    subscriber_hash text not null,
+    list_id text not null,
+    last_click_date timestamptz,
+    avg_click_rate numeric,
+    synced_at timestamptz not null default now(),
+    primary key (subscriber_hash, list_id)
+);
+
+create index if not exists click_watermarks_list_id_idx on click_watermarks (list_id);
@@ -0,0 +1,142 @@
+-- Clicks per (newsletter, headline, day), kept up to date by triggers on
+-- click_activity inserts, updates and deletes so top-headline queries never
+-- scan the raw clicks. Running this file also backfills it.
+
+create table if not exists headline_daily_clicks (
+    newsletter text not null,
+    clicked_headline text not null,
+    click_day date not null,
+    click_count bigint not null default 0,
+    primary key (newsletter, clicked_headline, click_day)
+);
+
+create index if not exists headline_daily_clicks_day_idx on headline_daily_clicks (click_day);
+
+-- Statement-level triggers see every row of a multi-row insert at once, so a
+-- bulk insert of N clicks becomes one aggregated upsert.
+create or replace function headline_rollup_insert()
+returns trigger
+language plpgsql
+as $$
+begin
+    insert into headline_daily_clicks (newsletter, clicked_headline, click_day, click_count)
+    select newsletter, clicked_headline, (click_date at time zone 'UTC')::date, count(*)
+    from new_rows
+    where newsletter is not null and clicked_headline is not null and click_date is not null
+    group by 1, 2, 3
+    on conflict (newsletter, clicked_headline, click_day)
+    do update set click_count = headline_daily_clicks.click_count + excluded.click_count;
+    return null;
+end;
+$$;
+
+create or replace function headline_rollup_delete()
+returns trigger
+language plpgsql
+as $$
+begin
+    update headline_daily_clicks h
+    set click_count = h.click_count - d.removed
+    from (
+        select newsletter, clicked_headline, (click_date at time zone 'UTC')::date as click_day, count(*) as removed
+        from old_rows
+        group by 1, 2, 3
+    ) d
+    where h.newsletter = d.newsletter
+      and h.clicked_headline = d.clicked_headline
+      and h.click_day = d.click_day;
+
+    delete from headline_daily_clicks where click_count <= 0;
+    return null;
+end;
+$$;
+
+-- An edit moves its clicks from the old (newsletter, headline, day) to the new
+-- one: old rows count -1, new rows +1, and the net change is applied at once.
+create or replace function headline_rollup_update()
+returns trigger
+language plpgsql
+as $$
+begin
+    insert into headline_daily_clicks (newsletter, clicked_headline, click_day, click_count)
+    select newsletter, clicked_headline, click_day, sum(change)
+    from (
+        select newsletter, clicked_headline, (click_date at time zone 'UTC')::date as click_day, 1 as change
+        from new_rows
+        union all
+        select newsletter, clicked_headline, (click_date at time zone 'UTC')::date, -1
+        from old_rows
+    ) changes
+    where newsletter is not null and clicked_headline is not null and click_day is not null
+    group by 1, 2, 3
+    having sum(change) <> 0
+    on conflict (newsletter, clicked_headline, click_day)
+    do update set click_count = headline_daily_clicks.click_count + excluded.click_count;
+
+    delete from headline_daily_clicks where click_count <= 0;
+    return null;
+end;
+$$;
+
+drop trigger if exists click_activity_rollup_insert on click_activity;
+create trigger click_activity_rollup_insert
+    after insert on click_activity
+    referencing new table as new_rows
+    for each statement execute function headline_rollup_insert();
+
+drop trigger if exists click_activity_rollup_delete on click_activity;
+create trigger click_activity_rollup_delete
+    after delete on click_activity
+    referencing old table as old_rows
+    for each statement execute function headline_rollup_delete();
+
+drop trigger if exists click_activity_rollup_update on click_activity;
+create trigger click_activity_rollup_update
+    after update on click_activity
+    referencing old table as old_rows new table as new_rows
+    for each statement execute function headline_rollup_update();
+
+-- Top headlines for a date range, optionally for one newsletter.
+create or replace function top_headlines(
+    p_start date default null,
+    p_end date default null,
+    p_newsletter text default null,
+    p_limit integer default 10
+)
+returns table (clicked_headline text, click_count bigint)
+language sql
+stable
+as $$
+    select clicked_headline, sum(click_count)::bigint as click_count
+    from headline_daily_clicks
+    where (p_start is null or click_day >= p_start)
+      and (p_end is null or click_day <= p_end)
+      and (p_newsletter is null or newsletter = p_newsletter)
+    group by clicked_headline
+    order by click_count desc, clicked_headline
+    limit p_limit;
+$$;
+
+-- Recount the whole rollup from click_activity. Inserts and edits wait while
+-- it runs, so none is counted twice or missed; re-running it is safe.
+create or replace function rebuild_headline_rollups()
+returns bigint
+language plpgsql
+as $$
+declare
+    rows_written bigint;
+begin
+    lock table click_activity in share row exclusive mode;
+    delete from headline_daily_clicks;
+    insert into headline_daily_clicks (newsletter, clicked_headline, click_day, click_count)
+    select newsletter, clicked_headline, (click_date at time zone 'UTC')::date, count(*)
+    from click_activity
+    where newsletter is not null and clicked_headline is not null and click_date is not null
+    group by 1, 2, 3;
+    get diagnostics rows_written = row_count;
+    return rows_written;
+end;
+$$;
+
+-- Backfill from the clicks stored before the triggers existed.
+select rebuild_headline_rollups();
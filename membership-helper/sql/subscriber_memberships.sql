@@ -0,0 +1,53 @@
+-- Set-based list membership updates for the subscriber sync.
+-- subscribers.list_id is an array because one reader can be on several lists;
+-- these functions add or remove a single list without touching the others.
+
+-- Upsert a batch of subscribed members of one list, adding the list to their
+-- list_id array. p_subscribers is a JSON array of
+-- {"subscriber_hash": ..., "created_at": ...} objects.
+create or replace function merge_subscriber_memberships(p_list_id text, p_subscribers jsonb)
+returns integer
+language sql
+as $$
+    with incoming as (
+        select distinct on (s ->> 'subscriber_hash')
+            s ->> 'subscriber_hash' as subscriber_hash,
+            nullif(s ->> 'created_at', '')::timestamptz as created_at
+        from jsonb_array_elements(p_subscribers) as s
+        where s ->> 'subscriber_hash' is not null
+    ),
+    merged as (
+        insert into subscribers (subscriber_hash, list_id, status, created_at)
+        select subscriber_hash, array[p_list_id], 'subscribed', created_at
+        from incoming
+        on conflict (subscriber_hash) do update
+        set list_id = (
+                select array_agg(distinct l)
+                from unnest(coalesce(subscribers.list_id, '{}') || excluded.list_id) as l
+            ),
+            status = 'subscribed',
+            created_at = least(subscribers.created_at, excluded.created_at)
+        returning 1
+    )
+    select count(*)::integer from merged;
+$$;
+
+-- Remove one list from a batch of subscribers who left it. Subscribers left on
+-- no list get p_status; the others keep their current status.
+create or replace function remove_subscriber_memberships(p_list_id text, p_hashes text[], p_status text)
+returns integer
+language sql
+as $$
+    with updated as (
+        update subscribers
+        set list_id = array_remove(list_id, p_list_id),
+            status = case
+                when cardinality(array_remove(list_id, p_list_id)) = 0 then p_status
+                else status
+            end
+        where subscriber_hash = any(p_hashes)
+          and p_list_id = any(list_id)
+        returning 1
+    )
+    select count(*)::integer from updated;
+$$;
@@ -0,0 +1,94 @@
+-- Server-side reconcile of the subscribers table against a fresh Mailchimp export.
+-- The exported hashes are staged under a sync id, then the subscribers missing
+-- from the export are found with an anti-join and updated in one statement,
+-- so the table never has to leave the database.
+
+create unlogged table if not exists subscriber_sync_staging (
+    sync_id uuid not null,
+    subscriber_hash text not null,
+    staged_at timestamptz not null default now(),
+    primary key (sync_id, subscriber_hash)
+);
+
+-- Bulk load one batch of exported hashes for a sync.
+create or replace function stage_subscriber_hashes(p_sync_id uuid, p_hashes text[])
+returns integer
+language sql
+as $$
+    with staged as (
+        insert into subscriber_sync_staging (sync_id, subscriber_hash)
+        select p_sync_id, h
+        from unnest(p_hashes) as h
+        where h is not null
+        on conflict do nothing
+        returning 1
+    )
+    select count(*)::integer from staged;
+$$;
+
+-- Find the subscribers of p_list_id (or of any list when null) that are not
+-- staged under p_sync_id and either mark them or delete them.
+--
+-- With a list, the list is removed from the missing subscribers' list_id
+-- arrays; only those left on no list are marked with p_status (or deleted
+-- when p_delete). Without a list every missing subscriber is marked/deleted.
+-- The staging rows of the sync, and any abandoned ones older than a day,
+-- are cleared afterwards.
+create or replace function reconcile_missing_subscribers(
+    p_sync_id uuid,
+    p_list_id text default null,
+    p_status text default 'deleted',
+    p_delete boolean default false
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_staged integer;
+    v_missing integer;
+    v_updated integer := 0;
+    v_deleted integer := 0;
+begin
+    select count(*) into v_staged from subscriber_sync_staging where sync_id = p_sync_id;
+
+    create temporary table missing_subscribers on commit drop as
+    select s.subscriber_hash,
+           case
+               when p_list_id is null then true
+               else cardinality(array_remove(s.list_id, p_list_id)) = 0
+           end as orphaned
+    from subscribers s
+    where (p_list_id is null or p_list_id = any(s.list_id))
+      and not exists (
+          select 1 from subscriber_sync_staging st
+          where st.sync_id = p_sync_id and st.subscriber_hash = s.subscriber_hash
+      );
+
+    select count(*) into v_missing from missing_subscribers;
+
+    if p_delete then
+        delete from subscribers s
+        using missing_subscribers m
+        where s.subscriber_hash = m.subscriber_hash and m.orphaned;
+        get diagnostics v_deleted = row_count;
+    end if;
+
+    update subscribers s
+    set list_id = case when p_list_id is null then s.list_id else array_remove(s.list_id, p_list_id) end,
+        status = case when m.orphaned then p_status else s.status end
+    from missing_subscribers m
+    where s.subscriber_hash = m.subscriber_hash
+      and not (p_delete and m.orphaned);
+    get diagnostics v_updated = row_count;
+
+    delete from subscriber_sync_staging
+    where sync_id = p_sync_id or staged_at < now() - interval '1 day';
+
+    return jsonb_build_object(
+        'staged', v_staged,
+        'missing', v_missing,
+        'updated', v_updated,
+        'deleted', v_deleted
+    );
+end;
+$$;
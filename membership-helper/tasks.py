@@ -1,12 +1,206 @@
-from utils import extract_slug_from_url, get_post_details, clean_headline
-from chimp.member_clicks import get_member_activity
-from db import update_total_clicks, insert_click_activity, fetch_existing_clicks
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from utils import extract_slug_from_url, get_post_details_bulk, resolve_site_slugs, get_wp_site, clean_headline
+from chimp.member_clicks import get_member_activity, MAX_CONNECTIONS
+from chimp.batch_activity import fetch_list_activity_batched
+from chimp.newsletters import fetch_member_click_stats
+from chimp.campaign_clicks import fetch_recent_campaigns, fetch_campaign_links, iter_link_clickers
+from checkpoints import IngestCheckpoint, CHECKPOINT_EVERY
+from db import update_total_clicks, fetch_existing_clicks, fetch_all_newsletters, fetch_subscribers_sorted_by_clicks, ClickWriter, fetch_click_watermarks, upsert_click_watermarks, fetch_headline_clickers
+
+# Worker threads for the all-newsletter sync. Mailchimp calls are additionally
+# capped at MAX_CONNECTIONS by chimp.member_clicks.
+SYNC_MAX_WORKERS = MAX_CONNECTIONS
+
+# Re-check a subscriber's activity at least this often, even when nothing in
+# their Mailchimp stats suggests new clicks. Those stats are only a hint (see
+# needs_click_sync), so this bounds how late a missed click can arrive.
+WATERMARK_RECHECK_DAYS = 7
+
+# Mailchimp's avg_click_rate is a 0-1 share; a reader at the cap keeps the same
+# rate however many new clicks they make, so they are always checked.
+MAX_CLICK_RATE = 1.0
+
+
+def get_clicks(activity):
+    """
+    Pull the click actions out of a Mailchimp member activity response.
+
+    Args:
+        activity (dict): Response from get_member_activity.
+
+    Returns:
+        list: Click activity entries, each with its extracted `slug`.
+    """
+    clicks = []
+    for act in activity.get("activity", []):
+        if act.get("action") == "click":
+            clicks.append({**act, "slug": extract_slug_from_url(act.get("url", ""))})
+    return clicks
+
+
+def parse_timestamp(timestamp):
+    """
+    Parse a Mailchimp or Supabase ISO 8601 timestamp.
+
+    Args:
+        timestamp (str): The timestamp, e.g. "2024-12-01T14:02:00+00:00".
+
+    Returns:
+        datetime: A timezone-aware datetime, or None if it can't be parsed.
+    """
+    if not timestamp:
+        return None
+    try:
+        parsed = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def clicks_since(clicks, since):
+    """
+    Keep only the clicks newer than a watermark.
+
+    Args:
+        clicks (list): Clicks from get_clicks.
+        since (str): The watermark timestamp, or None to keep every click.
+
+    Returns:
+        list: The clicks after `since`.
+    """
+    since = parse_timestamp(since)
+    if since is None:
+        return clicks
+    return [click for click in clicks if (parse_timestamp(click.get("timestamp")) or since) > since]
+
+
+def latest_click_date(clicks, since=None):
+    """
+    Find the newest click timestamp, falling back to the previous watermark.
+
+    Args:
+        clicks (list): Clicks from get_clicks.
+        since (str, optional): The previous watermark.
+
+    Returns:
+        str: The newest timestamp in ISO format, or None.
+    """
+    dates = [parse_timestamp(click.get("timestamp")) for click in clicks]
+    dates = [date for date in dates + [parse_timestamp(since)] if date]
+    return max(dates).isoformat() if dates else None
+
+
+def needs_click_sync(watermark, member_stats, now, recheck_days=WATERMARK_RECHECK_DAYS):
+    """
+    Decide whether a subscriber may have new click activity since the last sync.
+
+    Mailchimp has no cheap "last clicked" field, so this is a heuristic. A
+    subscriber is fetched when any of these hold:
+    - they were never synced and have clicked at some point,
+    - the watermark is older than recheck_days,
+    - their member record changed (`last_changed`) after the last sync,
+    - their click rate is at the cap, where it can't move,
+    - their click rate differs from the one stored with the watermark.
+    A rate can also stay put when new clicks keep the same ratio to new
+    campaigns; such clicks wait for the recheck.
+
+    Args:
+        watermark (dict): The subscriber's click_watermarks row, or None.
+        member_stats (dict): The subscriber's Mailchimp stats from
+            fetch_member_click_stats, or None if unknown.
+        now (datetime): The current time (timezone-aware).
+        recheck_days (int): Force a check when the watermark is older than this.
+
+    Returns:
+        bool: True if the subscriber's activity should be fetched.
+    """
+    if member_stats is None or member_stats.get("avg_click_rate") is None:
+        return True
+
+    click_rate = float(member_stats["avg_click_rate"])
+
+    if watermark is None:
+        # Never synced: only worth fetching if they have ever clicked
+        return click_rate > 0
+
+    synced_at = parse_timestamp(watermark.get("synced_at"))
+    if synced_at is None or now - synced_at > timedelta(days=recheck_days):
+        return True
+
+    last_changed = parse_timestamp(member_stats.get("last_changed"))
+    if last_changed is not None and last_changed > synced_at:
+        return True
+
+    if click_rate >= MAX_CLICK_RATE:
+        return True
+
+    previous_rate = watermark.get("avg_click_rate")
+    return previous_rate is None or abs(float(previous_rate) - click_rate) > 1e-9
+
+
+def ingest_subscriber_clicks(subscriber_hash, clicks, existing_clicks, writer):
+    """
+    Queue a subscriber's clicks for storage, skipping ones already recorded.
+
+    Args:
+        subscriber_hash (str): The unique hash of the subscriber.
+        clicks (list): Clicks from get_clicks, each annotated with its
+            `newsletter` list ID and resolved `headline` (or None).
+        existing_clicks (set): Slugs and headlines already stored for the
+            subscriber. Updated in place with the newly queued clicks.
+        writer (ClickWriter): Buffered writer the rows are added to. Rows that
+            later fail to flush are reported by the writer, not in these counts.
+
+    Returns:
+        dict: A summary of processed, skipped, and error counts.
+    """
+    processed_count = 0
+    skipped_count = 0
+    error_count = 0
+
+    for click in clicks:
+        slug = click["slug"]
+        if not slug:
+            print(f"Skipped invalid slug for Subscriber {subscriber_hash}")
+            skipped_count += 1
+            continue
+
+        headline = click.get("headline") or slug
+        cleaned_headline= clean_headline(headline)
+
+        if slug in existing_clicks or cleaned_headline in existing_clicks or headline in existing_clicks:
+            print(f"Skipped duplicate or invalid slug/headline for Subscriber {subscriber_hash}: {slug}, {headline}")
+            skipped_count += 1
+            continue
+
+        try:
+            # Queue click activity for the database
+            writer.add(
+                subscriber_hash=subscriber_hash,
+                clicked_headline=headline,
+                newsletter=click["newsletter"],
+                click_date=click["timestamp"]
+            )
+            # Add both slug and headline to the existing clicks set
+            existing_clicks.add(slug)
+            existing_clicks.add(headline)
+            processed_count += 1
+        except Exception as e:
+            print(f"Error queueing click activity for Subscriber {subscriber_hash}: {e}")
+            error_count += 1
+
+    return {"processed_count": processed_count, "skipped_count": skipped_count, "error_count": error_count}
 
 
 def process_subscriber_clicks(list_id, subscribers):
     """
     Process click activity for each subscriber and store it in the database.
 
+    Activity is fetched for the whole batch first so that every distinct slug
+    can be resolved to a headline in a handful of WordPress requests.
+
     Args:
         list_id (str): The newsletter list ID.
         subscribers (list): List of subscriber hashes.
@@ -19,6 +213,8 @@ def process_subscriber_clicks(list_id, subscribers):
     error_count = 0
     processed_slugs = set()
 
+    # Fetch activity for the batch
+    subscriber_clicks = {}
     for subscriber_hash in subscribers:
         activity = get_member_activity(list_id, subscriber_hash)
 
@@ -27,44 +223,52 @@ def process_subscriber_clicks(list_id, subscribers):
             skipped_count += 1
             continue
 
-        # Filter for click actions
-        clicks = [act for act in activity["activity"] if act["action"] == "click"]
+        subscriber_clicks[subscriber_hash] = get_clicks(activity)
 
-        # Track total clicks for the subscriber
-        total_clicks = 0
+    # Resolve every slug in the batch at once
+    headlines = get_post_details_bulk(
+        (click["slug"] for clicks in subscriber_clicks.values() for click in clicks),
+        list_id,
+    )
 
-        for click in clicks:
-            # Extract slug and post details
-            slug = extract_slug_from_url(click.get("url", ""))
-            if not slug or slug == "unknown" or slug in processed_slugs:
-                print(f"Skipped invalid or duplicate slug for Subscriber {subscriber_hash}: {slug}")
-                skipped_count += 1
-                continue
+    total_clicks = {}
+    with ClickWriter() as writer:
+        for subscriber_hash, clicks in subscriber_clicks.items():
+            # Track total clicks for the subscriber
+            total_clicks[subscriber_hash] = 0
 
-            post_details = get_post_details(slug, list_id)
-            if not post_details:
-                print(f"Skipped slug with no valid post details for Subscriber {subscriber_hash}: {slug}")
-                skipped_count += 1
-                continue
+            for click in clicks:
+                slug = click["slug"]
+                if not slug or slug == "unknown" or slug in processed_slugs:
+                    print(f"Skipped invalid or duplicate slug for Subscriber {subscriber_hash}: {slug}")
+                    skipped_count += 1
+                    continue
 
-            # Store click activity
-            try:
-                insert_click_activity(
+                post_details = headlines.get(slug)
+                if not post_details:
+                    print(f"Skipped slug with no valid post details for Subscriber {subscriber_hash}: {slug}")
+                    skipped_count += 1
+                    continue
+
+                # Store click activity
+                writer.add(
                     subscriber_hash=subscriber_hash,
                     clicked_headline=post_details,
                     newsletter=list_id,
                     click_date=click["timestamp"]
                 )
                 processed_slugs.add(slug)
-                total_clicks += 1
-                processed_count += 1
-            except Exception as e:
-                print(f"Error inserting click activity for Subscriber {subscriber_hash}: {e}")
-                error_count += 1
+                total_clicks[subscriber_hash] += 1
+
+    # Rows that failed to flush count as errors, not processed clicks
+    failures = writer.failures_by_subscriber()
+    processed_count = writer.inserted_count
+    error_count += len(writer.failed_rows)
 
-        # Update total clicks for the subscriber
+    # Update total clicks for each subscriber
+    for subscriber_hash, count in total_clicks.items():
         try:
-            update_total_clicks(subscriber_hash, total_clicks)
+            update_total_clicks(subscriber_hash, count - failures[subscriber_hash])
         except Exception as e:
             print(f"Error updating total clicks for Subscriber {subscriber_hash}: {e}")
             error_count += 1
@@ -75,68 +279,535 @@ def process_subscriber_clicks(list_id, subscribers):
         "error_count": error_count
     }
 
-def process_click_activity(list_id, subscriber_hash):
+def process_click_activity(list_id, subscriber_hash, headlines=None, since=None):
     """
     Process click activity for a specific subscriber, avoiding duplicates.
 
     Args:
         list_id (str): The newsletter list ID.
         subscriber_hash (str): The unique hash of the subscriber.
+        headlines (dict, optional): Slug -> headline map already resolved by the
+            caller. Slugs missing from it are resolved in one bulk lookup.
+        since (str, optional): The subscriber's click watermark. Only newer
+            clicks are processed, and only their headlines are checked for
+            duplicates instead of the whole click history.
 
     Returns:
-        dict: A summary of processed, skipped, and error counts.
+        dict: A summary of processed, skipped, and error counts, plus the
+        newest click seen as `last_click_date`. A failed activity fetch counts
+        as one error, so callers keep the subscriber's watermark where it was.
     """
-
-    
     processed_count = 0
     skipped_count = 0
     error_count = 0
 
-    # Fetch existing clicks for the subscriber
-    existing_clicks = fetch_existing_clicks(subscriber_hash)  # Returns a set of slugs or headlines
-
     # Fetch click activity from Mailchimp
     activity = get_member_activity(list_id, subscriber_hash)
     if not activity or "activity" not in activity:
+        # get_member_activity returns {} on any failure, so this is an error, not "no clicks"
         print(f"No activity data for Subscriber {subscriber_hash}")
-        return {"processed_count": processed_count, "skipped_count": skipped_count, "error_count": error_count}
+        return {"processed_count": processed_count, "skipped_count": skipped_count, "error_count": 1, "last_click_date": since}
 
     # Process clicks
-    clicks = [act for act in activity["activity"] if act["action"] == "click"]
-    total_clicks = 0
+    all_clicks = get_clicks(activity)
+    clicks = clicks_since(all_clicks, since)
+    last_click_date = latest_click_date(all_clicks, since)
+
+    if not clicks:
+        return {"processed_count": processed_count, "skipped_count": skipped_count, "error_count": error_count, "last_click_date": last_click_date}
+
+    headlines = dict(headlines or {})
+    unresolved = {click["slug"] for click in clicks if click["slug"] and click["slug"] not in headlines}
+    if unresolved:
+        headlines.update(get_post_details_bulk(unresolved, list_id))
 
     for click in clicks:
-        slug = extract_slug_from_url(click.get("url", ""))
-        headline = get_post_details(slug, list_id) or slug
-        cleaned_headline= clean_headline(headline)
+        click["newsletter"] = list_id
+        click["headline"] = headlines.get(click["slug"])
 
-        if not slug or slug in existing_clicks or cleaned_headline in existing_clicks or headline in existing_clicks:
-            print(f"Skipped duplicate or invalid slug/headline for Subscriber {subscriber_hash}: {slug}, {headline}")
-            skipped_count += 1
-            continue
+    # Fetch existing clicks for the subscriber
+    if since is None:
+        existing_clicks = fetch_existing_clicks(subscriber_hash)  # Returns a set of slugs or headlines
+    else:
+        candidates = set()
+        for click in clicks:
+            headline = click["headline"] or click["slug"]
+            if headline:
+                candidates.update({click["slug"], headline, clean_headline(headline)})
+        existing_clicks = fetch_existing_clicks(subscriber_hash, headlines=candidates)
 
-        try:
-            # Insert click activity into the database
-            insert_click_activity(
-                subscriber_hash=subscriber_hash,
-                clicked_headline=headline,
-                newsletter=list_id,
-                click_date=click["timestamp"]
-            )
-            # Add both slug and headline to the existing clicks set
-            existing_clicks.add(slug)
-            existing_clicks.add(headline)
-            total_clicks += 1
-            processed_count += 1
-        except Exception as e:
-            print(f"Error inserting click activity for Subscriber {subscriber_hash}: {e}")
-            error_count += 1
+    with ClickWriter() as writer:
+        result = ingest_subscriber_clicks(subscriber_hash, clicks, existing_clicks, writer)
+
+    processed_count = writer.inserted_count
+    skipped_count = result["skipped_count"]
+    error_count = result["error_count"] + len(writer.failed_rows)
 
     # Update total clicks for the subscriber
     try:
-        update_total_clicks(subscriber_hash, total_clicks)
+        update_total_clicks(subscriber_hash, processed_count)
     except Exception as e:
         print(f"Error updating total clicks for Subscriber {subscriber_hash}: {e}")
         error_count += 1
 
-    return {"processed_count": processed_count, "skipped_count": skipped_count, "error_count": error_count}
+    return {"processed_count": processed_count, "skipped_count": skipped_count, "error_count": error_count, "last_click_date": last_click_date}
+
+
+def sync_list_click_activity(list_id, incremental=True, progress_callback=None, resume=True):
+    """
+    Process click activity for every subscriber on a list.
+
+    In incremental mode each subscriber's (subscriber_hash, list_id) watermark
+    limits processing to clicks newer than the last sync, and subscribers whose
+    Mailchimp stats show no sign of new clicks (see needs_click_sync) are
+    skipped without fetching their activity at all.
+
+    Progress is checkpointed every CHECKPOINT_EVERY subscribers (see
+    checkpoints.py). If a run dies partway, the next run with the same options
+    skips the subscribers it already finished and carries on its totals.
+
+    Args:
+        list_id (str): The newsletter list ID.
+        incremental (bool): Use watermarks. Set to False to reprocess every
+            subscriber's full activity.
+        progress_callback (callable, optional): Called as
+            progress_callback(done, total) after each subscriber.
+        resume (bool): Resume an interrupted run. Set to False to start over.
+
+    Returns:
+        dict: A summary of processed, skipped, and error counts, the number
+        of subscribers skipped as unchanged, and `resumed_subscribers`, the
+        number already done by an interrupted run.
+    """
+    subscribers = fetch_subscribers_sorted_by_clicks(list_id)
+    subscribers = sorted(subscribers, key=lambda s: s.get("total_clicks") or 0, reverse=True)
+
+    watermarks = fetch_click_watermarks(list_id) if incremental else {}
+    member_stats = fetch_member_click_stats(list_id) if incremental else {}
+    now = datetime.now(timezone.utc)
+
+    checkpoint = IngestCheckpoint(f"click_sync:{list_id}")
+    checkpoint.begin({"incremental": incremental}, resume=resume)
+
+    summary = {"processed_count": 0, "skipped_count": 0, "error_count": 0, "unchanged_subscribers": 0}
+    summary.update({key: checkpoint.stats.get(key, 0) for key in summary})
+    summary["resumed_subscribers"] = len(checkpoint.completed)
+    new_watermarks = []
+
+    def save_checkpoint(idx):
+        nonlocal new_watermarks
+        # Watermarks first: a subscriber is only done once its watermark is stored
+        if new_watermarks:
+            upsert_click_watermarks(new_watermarks)
+            new_watermarks = []
+        checkpoint.save(idx, summary)
+
+    idx = checkpoint.cursor
+    try:
+        for idx, subscriber in enumerate(subscribers, start=1):
+            subscriber_hash = subscriber["subscriber_hash"]
+            if checkpoint.is_done(subscriber_hash):
+                continue
+
+            watermark = watermarks.get(subscriber_hash)
+            stats = member_stats.get(subscriber_hash)
+
+            if incremental and not needs_click_sync(watermark, stats, now):
+                summary["unchanged_subscribers"] += 1
+            else:
+                since = watermark.get("last_click_date") if watermark else None
+                result = process_click_activity(list_id, subscriber_hash, since=since)
+                for key in ("processed_count", "skipped_count", "error_count"):
+                    summary[key] += result[key]
+
+                # Only move the watermark forward once every new click is stored
+                if result["error_count"] == 0:
+                    new_watermarks.append({
+                        "subscriber_hash": subscriber_hash,
+                        "list_id": list_id,
+                        "last_click_date": result["last_click_date"],
+                        "avg_click_rate": stats.get("avg_click_rate") if stats else None,
+                        "synced_at": now.isoformat(),
+                    })
+
+            checkpoint.mark_done(subscriber_hash)
+            if checkpoint.pending() >= CHECKPOINT_EVERY:
+                save_checkpoint(idx)
+
+            if progress_callback:
+                progress_callback(idx, len(subscribers))
+    except BaseException:
+        # Cancelled or failed: keep what was finished for the next run. The
+        # failure may be the database itself, so don't let the save mask it.
+        try:
+            save_checkpoint(idx)
+        except Exception as e:
+            print(f"Error saving click sync checkpoint for list {list_id}: {e}")
+        raise
+
+    if new_watermarks:
+        upsert_click_watermarks(new_watermarks)
+    checkpoint.complete(summary)
+
+    print(f"Synced click activity for list {list_id}: {summary}")
+    return summary
+
+
+def sync_all_click_activity(newsletters=None, max_workers=SYNC_MAX_WORKERS, progress_callback=None, incremental=True):
+    """
+    Fetch new click activity for every newsletter in one run.
+
+    The run has three stages, each spread over a bounded thread pool:
+    1. Fetch Mailchimp activity for every (list, subscriber) pair.
+    2. Resolve all slugs once per WordPress site, shared by every list on it.
+    3. Store each subscriber's clicks from all of their lists together, so a
+       reader on several lists is deduplicated and updated only once.
+
+    In incremental mode the same watermarks as sync_list_click_activity are
+    used to skip unchanged subscribers and old clicks.
+
+    Args:
+        newsletters (list, optional): Newsletter records to sync. Defaults to
+            every row from fetch_all_newsletters().
+        max_workers (int): Size of the worker pool.
+        progress_callback (callable, optional): Called as
+            progress_callback(stage, done, total) while the run advances.
+        incremental (bool): Use click watermarks.
+
+    Returns:
+        dict: Combined processed, skipped, and error counts, with per-newsletter
+        counts under "newsletters".
+    """
+    if newsletters is None:
+        newsletters = fetch_all_newsletters()
+
+    def report(stage, done, total):
+        if progress_callback:
+            progress_callback(stage, done, total)
+
+    summary = {
+        "processed_count": 0,
+        "skipped_count": 0,
+        "error_count": 0,
+        "subscriber_count": 0,
+        "unchanged_subscribers": 0,
+        "newsletters": {},
+    }
+    now = datetime.now(timezone.utc)
+
+    # Collect every (list, subscriber) pair to fetch, with its watermark
+    pairs = []
+    watermarks = {}
+    click_rates = {}
+    for newsletter in newsletters:
+        list_id = newsletter["list_id"]
+        summary["newsletters"][list_id] = {"processed_count": 0, "skipped_count": 0, "error_count": 0}
+        list_watermarks = fetch_click_watermarks(list_id) if incremental else {}
+        member_stats = fetch_member_click_stats(list_id) if incremental else {}
+
+        for subscriber in fetch_subscribers_sorted_by_clicks(list_id):
+            subscriber_hash = subscriber["subscriber_hash"]
+            watermark = list_watermarks.get(subscriber_hash)
+            stats = member_stats.get(subscriber_hash)
+            if incremental and not needs_click_sync(watermark, stats, now):
+                summary["unchanged_subscribers"] += 1
+                continue
+            pairs.append((list_id, subscriber_hash))
+            watermarks[(list_id, subscriber_hash)] = watermark.get("last_click_date") if watermark else None
+            click_rates[(list_id, subscriber_hash)] = stats.get("avg_click_rate") if stats else None
+
+    # 1. Fetch Mailchimp activity
+    clicks_by_subscriber = defaultdict(list)
+    last_click_dates = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(get_member_activity, list_id, subscriber_hash): (list_id, subscriber_hash)
+            for list_id, subscriber_hash in pairs
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            list_id, subscriber_hash = futures[future]
+            activity = future.result()
+            if not activity or "activity" not in activity:
+                # get_member_activity returns {} on any failure; the watermark stays put for a retry
+                print(f"No activity data for Subscriber {subscriber_hash} on list {list_id}")
+                summary["newsletters"][list_id]["error_count"] += 1
+            else:
+                since = watermarks[(list_id, subscriber_hash)]
+                all_clicks = get_clicks(activity)
+                last_click_dates[(list_id, subscriber_hash)] = latest_click_date(all_clicks, since)
+                for click in clicks_since(all_clicks, since):
+                    click["newsletter"] = list_id
+                    clicks_by_subscriber[subscriber_hash].append(click)
+            report("Fetching Mailchimp activity", done, len(futures))
+
+    # 2. Resolve slugs once per WordPress site
+    slugs_by_site = defaultdict(set)
+    for clicks in clicks_by_subscriber.values():
+        for click in clicks:
+            site = get_wp_site(click["newsletter"])
+            if site and click["slug"]:
+                slugs_by_site[site].add(click["slug"])
+
+    headlines_by_site = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(resolve_site_slugs, site, slugs): site for site, slugs in slugs_by_site.items()}
+        for done, future in enumerate(as_completed(futures), start=1):
+            headlines_by_site[futures[future]] = future.result()
+            report("Resolving headlines", done, len(futures))
+
+    for clicks in clicks_by_subscriber.values():
+        for click in clicks:
+            site_headlines = headlines_by_site.get(get_wp_site(click["newsletter"]), {})
+            click["headline"] = site_headlines.get(click["slug"])
+
+    # 3. Store clicks, once per unique subscriber
+    def store(subscriber_hash, clicks):
+        if any(watermarks[(click["newsletter"], subscriber_hash)] is None for click in clicks):
+            existing_clicks = fetch_existing_clicks(subscriber_hash)
+        else:
+            # Every list has a watermark, so only the new clicks' headlines can collide
+            candidates = set()
+            for click in clicks:
+                headline = click["headline"] or click["slug"]
+                if headline:
+                    candidates.update({click["slug"], headline, clean_headline(headline)})
+            existing_clicks = fetch_existing_clicks(subscriber_hash, headlines=candidates)
+        results = {}
+        for list_id in {click["newsletter"] for click in clicks}:
+            list_clicks = [click for click in clicks if click["newsletter"] == list_id]
+            results[list_id] = ingest_subscriber_clicks(subscriber_hash, list_clicks, existing_clicks, writer)
+        return subscriber_hash, results
+
+    summary["subscriber_count"] = len(clicks_by_subscriber)
+    total_clicks = {}
+    with ClickWriter() as writer, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(store, subscriber_hash, clicks) for subscriber_hash, clicks in clicks_by_subscriber.items()]
+        for done, future in enumerate(as_completed(futures), start=1):
+            subscriber_hash, results = future.result()
+            for list_id, result in results.items():
+                for key in ("processed_count", "skipped_count", "error_count"):
+                    summary["newsletters"][list_id][key] += result[key]
+            total_clicks[subscriber_hash] = sum(result["processed_count"] for result in results.values())
+            writer.flush_if_due()
+            report("Storing clicks", done, len(futures))
+
+    # Rows that failed to flush count as errors, not processed clicks
+    failures = writer.failures_by_subscriber()
+    for row, _ in writer.failed_rows:
+        counts = summary["newsletters"][row["newsletter"]]
+        counts["processed_count"] -= 1
+        counts["error_count"] += 1
+
+    def update_totals(subscriber_hash, count):
+        try:
+            update_total_clicks(subscriber_hash, count)
+            return True
+        except Exception as e:
+            print(f"Error updating total clicks for Subscriber {subscriber_hash}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(update_totals, subscriber_hash, count - failures[subscriber_hash])
+            for subscriber_hash, count in total_clicks.items()
+        ]
+        for future in as_completed(futures):
+            if not future.result():
+                summary["error_count"] += 1
+
+    for counts in summary["newsletters"].values():
+        for key in ("processed_count", "skipped_count", "error_count"):
+            summary[key] += counts[key]
+
+    # Only move a watermark forward once every new click for it is stored
+    failed_pairs = {(row["newsletter"], row["subscriber_hash"]) for row, _ in writer.failed_rows}
+    upsert_click_watermarks([
+        {
+            "subscriber_hash": subscriber_hash,
+            "list_id": list_id,
+            "last_click_date": last_click_date,
+            "avg_click_rate": click_rates[(list_id, subscriber_hash)],
+            "synced_at": now.isoformat(),
+        }
+        for (list_id, subscriber_hash), last_click_date in last_click_dates.items()
+        if (list_id, subscriber_hash) not in failed_pairs
+    ])
+
+    print(f"Synced click activity for {len(newsletters)} newsletters: {summary}")
+    return summary
+
+
+def process_list_clicks_batched(list_id, subscribers=None, chunk_size=500, progress_callback=None, **batch_options):
+    """
+    Process click activity for a whole list using Mailchimp Batch Operations.
+
+    Activity arrives as a stream of batch results; it is handled in chunks of
+    `chunk_size` subscribers, resolving each chunk's slugs in bulk and writing
+    its clicks through a shared ClickWriter.
+
+    Args:
+        list_id (str): The newsletter list ID.
+        subscribers (list, optional): Subscriber hashes to process. Defaults to
+            every subscriber on the list.
+        chunk_size (int): Number of subscribers handled per chunk.
+        progress_callback (callable, optional): Called as
+            progress_callback(done, total) after each chunk.
+        **batch_options: Passed to fetch_list_activity_batched (e.g. base_url).
+
+    Returns:
+        dict: A summary of processed, skipped, and error counts.
+    """
+    if subscribers is None:
+        subscribers = [s["subscriber_hash"] for s in fetch_subscribers_sorted_by_clicks(list_id)]
+
+    summary = {"processed_count": 0, "skipped_count": 0, "error_count": 0}
+    total_clicks = {}
+    done = 0
+
+    def process_chunk(chunk):
+        headlines = get_post_details_bulk(
+            (click["slug"] for clicks in chunk.values() for click in clicks), list_id
+        )
+        for subscriber_hash, clicks in chunk.items():
+            for click in clicks:
+                click["newsletter"] = list_id
+                click["headline"] = headlines.get(click["slug"])
+
+            existing_clicks = fetch_existing_clicks(subscriber_hash)
+            result = ingest_subscriber_clicks(subscriber_hash, clicks, existing_clicks, writer)
+            summary["skipped_count"] += result["skipped_count"]
+            summary["error_count"] += result["error_count"]
+            total_clicks[subscriber_hash] = result["processed_count"]
+
+    with ClickWriter() as writer:
+        chunk = {}
+        for subscriber_hash, activity in fetch_list_activity_batched(list_id, subscribers, **batch_options):
+            done += 1
+            if not activity or "activity" not in activity:
+                print(f"No activity data for Subscriber {subscriber_hash}")
+                summary["skipped_count"] += 1
+            else:
+                chunk[subscriber_hash] = get_clicks(activity)
+
+            if len(chunk) >= chunk_size:
+                process_chunk(chunk)
+                chunk = {}
+                if progress_callback:
+                    progress_callback(done, len(subscribers))
+            writer.flush_if_due()
+
+        if chunk:
+            process_chunk(chunk)
+        if progress_callback:
+            progress_callback(done, len(subscribers))
+
+    # Rows that failed to flush count as errors, not processed clicks
+    failures = writer.failures_by_subscriber()
+    summary["processed_count"] = writer.inserted_count
+    summary["error_count"] += len(writer.failed_rows)
+
+    for subscriber_hash, count in total_clicks.items():
+        try:
+            update_total_clicks(subscriber_hash, count - failures[subscriber_hash])
+        except Exception as e:
+            print(f"Error updating total clicks for Subscriber {subscriber_hash}: {e}")
+            summary["error_count"] += 1
+
+    return summary
+
+
+def process_campaign_clicks(list_id, days=30, progress_callback=None):
+    """
+    Process click activity for a list by walking its campaigns instead of its subscribers.
+
+    For each campaign sent in the last `days` days, the tracked links are
+    fetched, every link's slug is resolved to a headline once for the whole
+    run, and the members who clicked each link are paged through and written
+    in bulk. Links that don't resolve to a WordPress post (donate buttons,
+    social links, ...) are skipped.
+
+    Mailchimp's click-details reports don't include per-member click times, so
+    the campaign's send time is used as the click_date. total_clicks is not
+    updated in this mode.
+
+    Args:
+        list_id (str): The newsletter list ID.
+        days (int): How far back to look for sent campaigns.
+        progress_callback (callable, optional): Called as
+            progress_callback(done, total) after each link.
+
+    Returns:
+        dict: A summary of processed, skipped, and error counts, plus the number
+        of campaigns and links examined. A campaign list or link list that
+        could not be fetched counts as one error.
+    """
+    summary = {
+        "processed_count": 0,
+        "skipped_count": 0,
+        "error_count": 0,
+        "campaign_count": 0,
+        "link_count": 0,
+    }
+
+    since_send_time = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    try:
+        campaigns = fetch_recent_campaigns(list_id, since_send_time=since_send_time)
+    except Exception:
+        summary["error_count"] += 1
+        return summary
+
+    # Gather every clicked link first so slugs are resolved in one pass
+    links = []
+    for campaign in campaigns:
+        try:
+            campaign_links = fetch_campaign_links(campaign["id"])
+        except Exception:
+            summary["error_count"] += 1
+            continue
+        for link in campaign_links:
+            if link.get("unique_clicks", 0) > 0:
+                links.append((campaign, link, extract_slug_from_url(link.get("url", ""))))
+
+    headlines = get_post_details_bulk((slug for _, _, slug in links), list_id)
+
+    summary["campaign_count"] = len(campaigns)
+    summary["link_count"] = len(links)
+    stored = set()   # (subscriber_hash, headline) pairs written in this run
+
+    with ClickWriter() as writer:
+        for done, (campaign, link, slug) in enumerate(links, start=1):
+            headline = headlines.get(slug)
+            if not headline:
+                print(f"Skipped link with no valid post details in campaign {campaign['id']}: {link.get('url')}")
+                summary["skipped_count"] += 1
+            else:
+                existing = fetch_headline_clickers({slug, headline, clean_headline(headline)})
+                if existing is None:
+                    summary["error_count"] += 1
+                else:
+                    try:
+                        for subscriber_hash in iter_link_clickers(campaign["id"], link["id"]):
+                            if subscriber_hash in existing or (subscriber_hash, headline) in stored:
+                                summary["skipped_count"] += 1
+                                continue
+
+                            writer.add(
+                                subscriber_hash=subscriber_hash,
+                                clicked_headline=headline,
+                                newsletter=list_id,
+                                click_date=campaign["send_time"]
+                            )
+                            stored.add((subscriber_hash, headline))
+                    except Exception:
+                        # The clickers read before the failure are kept; a rerun skips them as existing
+                        summary["error_count"] += 1
+
+            writer.flush_if_due()
+            if progress_callback:
+                progress_callback(done, len(links))
+
+    summary["processed_count"] = writer.inserted_count
+    summary["error_count"] += len(writer.failed_rows)
+
+    print(f"Processed campaign clicks for list {list_id}: {summary}")
+    return summary
@@ -0,0 +1,387 @@
+"""
+Shared, connection-pooled HTTP transport for Mailchimp and WordPress calls.
+
+Every request goes through one requests.Session, so connections are kept
+alive and reused instead of paying DNS, TCP and TLS setup per call. The
+session's connection pools are thread-safe; each host gets its own pool,
+sized with set_pool_size() to match how many threads talk to it at once.
+
+Requests made with request() (and the Mailchimp clients) also get connect and
+read timeouts, bounded retries with jittered backoff that honour Retry-After,
+and a per-host circuit breaker that fails fast while a host keeps failing.
+
+    python transport.py
+
+benchmarks per-call latency of fresh connections against the pooled session
+on a local stub server. The stub speaks plain HTTP on loopback, so the saving
+it shows is only the TCP setup; against the real APIs the TLS handshake is
+saved too.
+"""
+import json
+import random
+import threading
+import time
+import types
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+import mailchimp_marketing as MailchimpMarketing
+
+DEFAULT_POOL_SIZE = 10       # Connections kept open per host
+MAX_HOST_POOLS = 32          # Hosts whose pools are kept around
+MAILCHIMP_POOL_SIZE = 10     # Mailchimp allows 10 simultaneous connections per API key
+
+CONNECT_TIMEOUT = 3.05       # Seconds to establish a connection
+READ_TIMEOUT = 30            # Seconds to wait between bytes of a response
+MAILCHIMP_TIMEOUT = (CONNECT_TIMEOUT, 120)  # 1000-member pages can take a while
+
+MAX_RETRIES = 3              # Retries after the first attempt
+BACKOFF_BASE = 0.5           # Seconds; doubles on each retry, with full jitter
+BACKOFF_MAX = 30             # Longest backoff between attempts
+RETRY_AFTER_MAX = 60         # Longest Retry-After we are willing to wait
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+BREAKER_THRESHOLD = 5        # Consecutive failures before a host's circuit opens
+BREAKER_RESET = 30           # Seconds an open circuit fails fast before a trial request
+
+_session = None
+_session_lock = threading.Lock()
+_pool_sizes = {}
+
+_mailchimp_clients = {}
+_mailchimp_lock = threading.Lock()
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of calling a host whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one host.
+
+    After `threshold` failures in a row the circuit opens and calls fail fast
+    for `reset_timeout` seconds. Then one trial call is let through: success
+    closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, host, threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET):
+        self.host = host
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        """Return True if a call may go ahead now."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_running:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.threshold:
+                if self.opened_at is None or self.trial_running:
+                    print(f"Circuit opened for {self.host} after {self.failures} failures")
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+def get_breaker(host):
+    """
+    Get the circuit breaker of a host, creating it on first use.
+
+    Args:
+        host (str): Host name, with a port if not the default.
+
+    Returns:
+        CircuitBreaker: The host's breaker.
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host)
+        return breaker
+
+
+def circuit_states():
+    """
+    Get the state of every host's circuit breaker.
+
+    Returns:
+        dict: Host -> {"state", "failures"}.
+    """
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.host: {"state": b.state, "failures": b.failures} for b in breakers}
+
+
+def _retry_after(response):
+    # Retry-After is either a number of seconds or an HTTP date
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt):
+    # Full jitter: uniform between 0 and the exponential cap
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _mount(session, host, size):
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+    session.mount(f"https://{host}/", adapter)
+    session.mount(f"http://{host}/", adapter)
+
+
+def get_session():
+    """
+    Get the process-wide pooled session, creating it on first use.
+
+    Returns:
+        requests.Session: Shared by every thread; do not close it.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                default = HTTPAdapter(pool_connections=MAX_HOST_POOLS, pool_maxsize=DEFAULT_POOL_SIZE)
+                session.mount("https://", default)
+                session.mount("http://", default)
+                for host, size in _pool_sizes.items():
+                    _mount(session, host, size)
+                _session = session
+    return _session
+
+
+def set_pool_size(host, size):
+    """
+    Size the connection pool of one host.
+
+    Args:
+        host (str): Host name, with a port if not the default (e.g. "us2.api.mailchimp.com").
+        size (int): Connections kept open to that host. Extra concurrent
+            requests still go through, on connections that are not reused.
+    """
+    with _session_lock:
+        if _pool_sizes.get(host) == size:
+            return
+        _pool_sizes[host] = size
+        if _session is not None:
+            _mount(_session, host, size)
+
+
+def request(method, url, retries=MAX_RETRIES, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs):
+    """
+    Make a request through the pooled session with timeouts, retries and a circuit breaker.
+
+    Connection errors, timeouts and 429/5xx responses are retried up to
+    `retries` times with jittered exponential backoff, or after the response's
+    Retry-After when it gives one. Non-idempotent methods (POST, PATCH) are
+    only retried on 429 and connect timeouts, when the request can't have been
+    processed. Connection errors and 5xx responses count as failures of the
+    host's circuit breaker; 429 doesn't, since the host is up.
+
+    Args:
+        method (str): HTTP method.
+        url (str): Request URL.
+        retries (int): Retries after the first attempt.
+        timeout (float or tuple): Seconds, or (connect, read) seconds.
+        **kwargs: Passed to requests.Session.request.
+
+    Returns:
+        requests.Response: The response. After the last retry, or when its
+        Retry-After is longer than RETRY_AFTER_MAX, the 429 or 5xx response is
+        returned for the caller to handle.
+
+    Raises:
+        CircuitOpenError: The host's circuit is open.
+        requests.RequestException: The request failed on every attempt.
+    """
+    method = method.upper()
+    host = urlparse(url).netloc
+    breaker = get_breaker(host)
+    idempotent = method in IDEMPOTENT_METHODS
+
+    for attempt in range(retries + 1):
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {host}, not calling {url}")
+
+        try:
+            response = get_session().request(method, url, timeout=timeout, **kwargs)
+        except requests.RequestException as e:
+            breaker.record_failure()
+            retryable = idempotent or isinstance(e, requests.ConnectTimeout)
+            if attempt == retries or not retryable:
+                raise
+            delay = _backoff(attempt)
+            print(f"{method} {host} failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        retryable = response.status_code == 429 or (idempotent and response.status_code in RETRY_STATUSES)
+        if not retryable or attempt == retries:
+            return response
+
+        delay = _retry_after(response)
+        if delay is not None and delay > RETRY_AFTER_MAX:
+            # Retrying sooner than the server asked would only be refused again
+            return response
+        if delay is None:
+            delay = _backoff(attempt)
+        print(f"{method} {host} returned {response.status_code}, retrying in {delay:.1f}s")
+        response.close()
+        time.sleep(delay)
+
+
+def get(url, **kwargs):
+    """GET through request()."""
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    """POST through request()."""
+    return request("POST", url, **kwargs)
+
+
+def _pooled_request(self, method, url, query_params=None, headers=None, body=None):
+    # Replacement for mailchimp_marketing's ApiClient.request, which calls the
+    # module-level requests functions and so opens a new connection every time
+    # and has no retries.
+    auth = None
+    if self.is_basic_auth:
+        auth = ("user", self.api_key)
+    if self.is_oauth:
+        headers.update({"Authorization": "Bearer " + self.access_token})
+
+    data = json.dumps(body) if method in ("POST", "PUT", "PATCH") else None
+    return request(
+        method, url, params=query_params, data=data, headers=headers, auth=auth, timeout=self.timeout
+    )
+
+
+def mailchimp_client(api_key, server, timeout=MAILCHIMP_TIMEOUT):
+    """
+    Get a shared Mailchimp client whose requests go through the pooled session.
+
+    One client is kept per API key and server. Clients hold no per-request
+    state, so they can be used from several threads at once.
+
+    Args:
+        api_key (str): Mailchimp API key.
+        server (str): Server prefix, e.g. "us2".
+        timeout (float or tuple): Seconds, or (connect, read) seconds.
+
+    Returns:
+        mailchimp_marketing.Client: The shared client.
+    """
+    key = (api_key, server)
+    client = _mailchimp_clients.get(key)
+    if client is None:
+        with _mailchimp_lock:
+            client = _mailchimp_clients.get(key)
+            if client is None:
+                client = MailchimpMarketing.Client()
+                client.set_config({"api_key": api_key, "server": server, "timeout": timeout})
+                client.api_client.request = types.MethodType(_pooled_request, client.api_client)
+                set_pool_size(f"{server}.api.mailchimp.com", MAILCHIMP_POOL_SIZE)
+                _mailchimp_clients[key] = client
+    return client
+
+
+def _benchmark(calls=200, threads=4):
+    from concurrent.futures import ThreadPoolExecutor
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, like the real APIs
+        disable_nagle_algorithm = True  # Otherwise delayed ACKs add ~40ms to every reused connection
+
+        def do_GET(self):
+            data = json.dumps({"email_id": self.path.rsplit("/", 2)[-2], "activity": []}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = f"127.0.0.1:{server.server_address[1]}"
+    set_pool_size(host, threads)
+
+    def fresh_client():
+        client = MailchimpMarketing.Client()
+        client.set_config({"api_key": "stub-us2", "server": "us2"})
+        client.api_client.host = f"http://{host}/3.0"
+        return client
+
+    shared = mailchimp_client("stub-us2", "us2")
+    shared.api_client.host = f"http://{host}/3.0"
+
+    cases = {
+        "requests.get per call": lambda i: requests.get(f"http://{host}/3.0/lists/x/members/{i}/activity"),
+        "pooled session": lambda i: get_session().get(f"http://{host}/3.0/lists/x/members/{i}/activity"),
+        "new Mailchimp client per call": lambda i: fresh_client().lists.get_list_member_activity("x", str(i)),
+        "shared Mailchimp client": lambda i: shared.lists.get_list_member_activity("x", str(i)),
+    }
+
+    try:
+        for workers in (1, threads):
+            print(f"{calls} calls, {workers} thread(s):")
+            for name, call in cases.items():
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    list(executor.map(call, range(calls)))
+                elapsed = time.perf_counter() - started
+                print(f"  {name:<32} {elapsed * 1000 / calls * workers:7.2f} ms/call  {calls / elapsed:8.1f} calls/s")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    _benchmark()
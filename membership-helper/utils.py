@@ -1,8 +1,9 @@
 import html
 from datetime import datetime
-import requests
 from urllib.parse import urlparse, unquote, parse_qs
 from db import get_all_newsletter_names, fetch_all_newsletters
+from headline_cache import headline_cache
+import transport
 
 def extract_slug_from_url(post_url):
     """
@@ -46,36 +47,76 @@ def extract_slug_from_url(post_url):
     return None
 
 
-def get_post_details(slug, list_id):
-    # Extract the slug from the post URL
+# WordPress site serving the posts linked from each Mailchimp list
+WP_SITES = {
+    '7867c6e5a8': "https://richmondside.org",
+    '8612bcc0f3': "https://berkeleyside.org",
+    'aad4b5ee64': "https://berkeleyside.org",
+}
 
-    #slug = extract_slug_from_url(post_url)
-    #print("Slug:", slug)
+# Keep enough WordPress connections open for every click sync worker
+WP_POOL_SIZE = 10
+for _site in set(WP_SITES.values()):
+    transport.set_pool_size(urlparse(_site).netloc, WP_POOL_SIZE)
 
-    # WordPress REST API URL to get the post details by slug
- 
 
-    wp_api_url = ""
+def get_wp_site(list_id):
+    """
+    Get the WordPress site URL for a Mailchimp list.
+
+    Args:
+        list_id (str): The Mailchimp list ID.
+
+    Returns:
+        str: The site URL, or None if the list has no known site.
+    """
+    return WP_SITES.get(list_id)
+
+
+def get_post_details(slug, list_id, use_cache=True):
+    """
+    Get the headline of a WordPress post by its slug.
+
+    Results (including slugs with no post) are cached per site in
+    `headline_cache`, so repeated clicks on the same story only hit the
+    WordPress REST API once.
+
+    Args:
+        slug (str): The post slug.
+        list_id (str): The Mailchimp list ID, used to pick the WordPress site.
+        use_cache (bool): Set to False to bypass the cache for this lookup.
+
+    Returns:
+        str: The rendered post title, or None if it can't be found.
+    """
+    site = get_wp_site(list_id)
+    if not site:
+        print(f"No WordPress site configured for list {list_id}")
+        return None
 
-    if list_id == '7867c6e5a8':
-        wp_api_url = f"https://richmondside.org/wp-json/wp/v2/posts?slug={slug}"
-    elif list_id == '8612bcc0f3':
-        wp_api_url =  f"https://berkeleyside.org/wp-json/wp/v2/posts?slug={slug}"
-    elif list_id == 'aad4b5ee64':
-        wp_api_url =  f"https://berkeleyside.org/wp-json/wp/v2/posts?slug={slug}"
+    if use_cache:
+        found, headline = headline_cache.lookup(site, slug)
+        if found:
+            return headline
 
+    # WordPress REST API URL to get the post details by slug
+    wp_api_url = f"{site}/wp-json/wp/v2/posts?slug={slug}"
 
     try:
-        response = requests.get(wp_api_url)
+        response = transport.get(wp_api_url)
 
         if response.status_code == 200:
             json_data = response.json()
             if json_data:
                 post_data = json_data[0]  # Assuming the slug is unique and returns one post
-                return post_data.get('title', {}).get('rendered')
+                headline = post_data.get('title', {}).get('rendered')
             else:
                 print(f"No post data found for slug {slug} at {wp_api_url}")
-                return None
+                headline = None
+
+            # Only cache real answers from WordPress, never transport errors
+            headline_cache.store(site, slug, headline)
+            return headline
         else:
             print(f"Error fetching post details: {response.status_code} - {response.text}")
             return None
@@ -85,6 +126,98 @@ def get_post_details(slug, list_id):
         return None
     
 
+# Slugs per REST call. WordPress allows per_page=100, but long slugs can push
+# the query string past common URL length limits, so stay under that.
+BULK_SLUG_CHUNK_SIZE = 50
+
+
+def get_post_details_bulk(slugs, list_id, use_cache=True):
+    """
+    Resolve many slugs to headlines using as few WordPress REST calls as possible.
+
+    Cached slugs are answered locally; the rest are requested in chunks with
+    `slug=a,b,c`, trimmed to `_fields=slug,title`.
+
+    Args:
+        slugs (iterable): Slugs to resolve. Duplicates and empty values are ignored.
+        list_id (str): The Mailchimp list ID, used to pick the WordPress site.
+        use_cache (bool): Set to False to bypass the cache for this lookup.
+
+    Returns:
+        dict: Mapping of slug to rendered post title, or None if there is no post.
+        Slugs that failed with a transport error are left out.
+    """
+    site = get_wp_site(list_id)
+    if not site:
+        print(f"No WordPress site configured for list {list_id}")
+        return {slug: None for slug in slugs if slug}
+
+    return resolve_site_slugs(site, slugs, use_cache=use_cache)
+
+
+def resolve_site_slugs(site, slugs, use_cache=True):
+    """
+    Resolve many slugs to headlines for a single WordPress site.
+
+    Args:
+        site (str): The WordPress site URL.
+        slugs (iterable): Slugs to resolve. Duplicates and empty values are ignored.
+        use_cache (bool): Set to False to bypass the cache for this lookup.
+
+    Returns:
+        dict: Mapping of slug to rendered post title, or None if there is no post.
+        Slugs that failed with a transport error are left out.
+    """
+    distinct_slugs = sorted({slug for slug in slugs if slug})
+    headlines = {}
+
+    to_fetch = []
+    for slug in distinct_slugs:
+        if use_cache:
+            found, headline = headline_cache.lookup(site, slug)
+            if found:
+                headlines[slug] = headline
+                continue
+        to_fetch.append(slug)
+
+    wp_api_url = f"{site}/wp-json/wp/v2/posts"
+
+    for i in range(0, len(to_fetch), BULK_SLUG_CHUNK_SIZE):
+        chunk = to_fetch[i : i + BULK_SLUG_CHUNK_SIZE]
+        params = {
+            "slug": ",".join(chunk),
+            "_fields": "slug,title",
+            "per_page": 100,
+        }
+
+        try:
+            response = transport.get(wp_api_url, params=params)
+
+            if response.status_code != 200:
+                print(f"Error fetching post details: {response.status_code} - {response.text}")
+                continue
+
+            # WordPress lowercases slugs, so match case-insensitively
+            found_titles = {
+                post.get("slug", "").lower(): post.get("title", {}).get("rendered")
+                for post in response.json()
+            }
+            resolved = {slug: found_titles.get(slug.lower()) for slug in chunk}
+
+            missing = [slug for slug, headline in resolved.items() if headline is None]
+            if missing:
+                print(f"No post data found for {len(missing)} slugs at {wp_api_url}")
+
+            headline_cache.store_many(site, resolved)
+            headlines.update(resolved)
+
+        except Exception as e:
+            print(f"Error fetching post details for {len(chunk)} slugs: {e}")
+
+    print(f"Resolved {len(headlines)} of {len(distinct_slugs)} slugs for {site}")
+    return headlines
+
+
 def clean_headline(headline):
    
     return html.unescape(headline)
\ No newline at end of file
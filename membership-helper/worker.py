@@ -0,0 +1,194 @@
+'''
+worker.py
+Runs queued sync and email batch jobs outside Streamlit
+- python worker.py                 one worker process
+- python worker.py --processes 3   three, each running one job at a time
+Jobs are queued by the pages through jobs.job_queue.
+
+'''
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from jobs import job_queue, JobContext, JobCancelled, worker_name
+from db import fetch_subscribers_sorted_by_clicks, get_newsletter, update_newsletter_subscriber_count
+from chimp.subscriber_sync import sync_subscribers_from_mailchimp
+from tasks import sync_list_click_activity, sync_all_click_activity, process_list_clicks_batched, process_campaign_clicks
+from batch_email import generate_batch_emails, top_subscriber_hashes, CONCURRENCY
+from headline_cache import headline_cache
+from mirror import click_mirror
+from transport import circuit_states
+
+POLL_INTERVAL = 2         # Seconds between checks for new jobs when idle
+HEARTBEAT_INTERVAL = 30   # Seconds between heartbeats of a running job
+EMAIL_BATCH_DIR = "temp/email_batches"
+
+
+def run_subscriber_sync(ctx):
+    """Sync a list's subscribers from Mailchimp and store its new subscriber count."""
+    list_id = ctx.job["list_id"]
+    ctx.progress(0, 1, "Syncing subscribers from Mailchimp")
+
+    stats = sync_subscribers_from_mailchimp(list_id, full=ctx.params.get("full", False))
+    if not stats:
+        raise RuntimeError(f"Subscriber sync of list {list_id} failed")
+
+    # Keep the previous count if Mailchimp couldn't report one
+    subscriber_count = stats["subscriber_count"]
+    if subscriber_count is None:
+        newsletter = get_newsletter(list_id) or {}
+        subscriber_count = newsletter.get("subscriber_count", 0)
+    update_newsletter_subscriber_count(list_id, subscriber_count, stats["started_at"])
+
+    ctx.progress(1, 1, "Done")
+    return {**stats, "subscriber_count": subscriber_count}
+
+
+def _with_transport_stats(result):
+    # The page can't see the worker's caches, so report them with the result
+    return {**result, "headline_cache": headline_cache.get_stats(), "circuits": circuit_states()}
+
+
+def run_click_sync(ctx):
+    """Ingest click activity for one list in the requested mode."""
+    list_id = ctx.job["list_id"]
+    mode = ctx.params.get("mode", "subscriber")
+
+    if mode == "campaign":
+        result = process_campaign_clicks(
+            list_id,
+            days=ctx.params.get("campaign_days", 30),
+            progress_callback=lambda done, total: ctx.progress(done, total, "Processing campaign links"),
+        )
+        return _with_transport_stats(result)
+
+    if mode == "batch":
+        ctx.progress(0, 0, "Waiting for Mailchimp to finish the batch")
+        subscribers = [s["subscriber_hash"] for s in fetch_subscribers_sorted_by_clicks(list_id)]
+        result = process_list_clicks_batched(
+            list_id,
+            subscribers,
+            progress_callback=lambda done, total: ctx.progress(done, total, "Processing batch results"),
+        )
+        return _with_transport_stats({**result, "subscriber_count": len(subscribers)})
+
+    result = sync_list_click_activity(
+        list_id,
+        incremental=ctx.params.get("incremental", True),
+        progress_callback=lambda done, total: ctx.progress(done, total, "Processing subscribers"),
+    )
+    return _with_transport_stats(result)
+
+
+def run_click_sync_all(ctx):
+    """Ingest click activity for every newsletter."""
+    result = sync_all_click_activity(
+        incremental=ctx.params.get("incremental", True),
+        progress_callback=lambda stage, done, total: ctx.progress(done, total, stage),
+    )
+    return _with_transport_stats(result)
+
+
+def run_email_batch(ctx):
+    """Generate fundraising drafts for a list's (or everyone's) top clickers."""
+    ctx.progress(0, 0, "Fetching top clickers")
+    subscribers = top_subscriber_hashes(ctx.params.get("top", 100), ctx.params.get("list_id"))
+
+    output_path = os.path.join(EMAIL_BATCH_DIR, f"job_{ctx.job['id']}.{ctx.params.get('format', 'ndjson')}")
+    return generate_batch_emails(
+        subscribers,
+        output_path,
+        progress_callback=lambda done, total: ctx.progress(done, total, "Generating emails"),
+        concurrency=ctx.params.get("concurrency", CONCURRENCY),
+        use_cache=ctx.params.get("use_cache", True),
+        cluster_threshold=ctx.params.get("cluster_threshold"),
+    )
+
+
+def run_mirror_refresh(ctx):
+    """Copy new click activity into the local Parquet mirror, or rebuild it."""
+    ctx.progress(0, 0, "Copying clicks")
+    refresh = click_mirror.rebuild if ctx.params.get("rebuild") else click_mirror.refresh
+    return refresh(progress_callback=lambda new_clicks: ctx.progress(new_clicks, 0, "Copying clicks"))
+
+
+HANDLERS = {
+    "subscriber_sync": run_subscriber_sync,
+    "click_sync": run_click_sync,
+    "click_sync_all": run_click_sync_all,
+    "email_batch": run_email_batch,
+    "mirror_refresh": run_mirror_refresh,
+}
+
+
+def _heartbeat(job_id, stop):
+    # Long stages (exports, batch waits) report no progress for minutes
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        job_queue.heartbeat(job_id)
+
+
+def run_job(job):
+    """
+    Run one claimed job and record its outcome.
+
+    Args:
+        job (dict): A job returned by job_queue.claim().
+    """
+    handler = HANDLERS.get(job["kind"])
+    if handler is None:
+        job_queue.finish(job["id"], "failed", error=f"Unknown job kind {job['kind']}")
+        return
+
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job["id"], stop), daemon=True).start()
+    print(f"Running job {job['id']} ({job['kind']} for {job['list_id']})")
+
+    try:
+        result = handler(JobContext(job_queue, job))
+        job_queue.finish(job["id"], "succeeded", result=result)
+        print(f"Job {job['id']} succeeded")
+    except JobCancelled:
+        job_queue.finish(job["id"], "cancelled")
+        print(f"Job {job['id']} cancelled")
+    except Exception as e:
+        traceback.print_exc()
+        job_queue.finish(job["id"], "failed", error=str(e))
+        print(f"Job {job['id']} failed: {e}")
+    finally:
+        stop.set()
+
+
+def work(poll_interval=POLL_INTERVAL):
+    """Claim and run jobs until interrupted."""
+    name = worker_name()
+    print(f"Worker {name} waiting for jobs")
+    try:
+        while True:
+            job = job_queue.claim(name)
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+            run_job(job)
+    except KeyboardInterrupt:
+        print(f"Worker {name} stopping")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run queued sync jobs.")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes to start.")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        work()
+    else:
+        processes = [multiprocessing.Process(target=work) for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.join()